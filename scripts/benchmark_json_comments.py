@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Micro-benchmark for finding /*JSON*/ comments (and their line numbers) in jswrap files.
+# Compares the old findall+find+count approach against common.find_json_comments
+#
+# USAGE: benchmark_json_comments.py [-nITERATIONS] [jswrap_file.c ...]
+#
+# With no files, the largest jswrap files (by number of JSON comments) are used
+# ----------------------------------------------------------------------------------------
+
+import re;
+import sys;
+import os;
+import timeit;
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+basedir = scriptdir+"/../"
+sys.path.append(basedir+"scripts");
+sys.path.append(basedir+"boards");
+import common;
+
+# What get_jsondata used to do - this rescans from the start of the file for every
+# comment, and returns the wrong line if the same comment appears twice
+def find_json_comments_old(code):
+  comments = []
+  for comment in re.findall(r"/\*JSON.*?\*/", code, re.VERBOSE | re.MULTILINE | re.DOTALL):
+    charnumber = code.find(comment)
+    linenumber = 1+code.count("\n", 0, charnumber)
+    comments.append((linenumber, comment))
+  return comments
+
+iterations = 50
+files = []
+for arg in sys.argv[1:]:
+  if arg[:2]=="-n": iterations = int(arg[2:])
+  else: files.append(arg)
+
+os.chdir(basedir)
+if not files:
+  allfiles = []
+  for root, dirs, filenames in os.walk("."):
+    if root.startswith("./archives") or root.startswith("./targetlibs"): continue
+    for f in filenames:
+      if f.startswith("jswrap") and f.endswith(".c"):
+        path = os.path.join(root, f)[2:]
+        allfiles.append((open(path).read().count("/*JSON"), path))
+  files = [f for n,f in sorted(allfiles, reverse=True)[:6]]
+
+print("%-40s %8s %8s %10s %10s %8s" % ("File", "Bytes", "Comments", "Old (ms)", "New (ms)", "Speedup"))
+totalOld = 0
+totalNew = 0
+for f in files:
+  code = open(f).read()
+  old = find_json_comments_old(code)
+  new = common.find_json_comments(code)
+  if [c for l,c in old]!=[c for l,c in new]:
+    print("ERROR: different comments found in "+f)
+    exit(1)
+  for (oldLine, comment), (newLine, _) in zip(old, new):
+    if oldLine!=newLine:
+      print("NOTE: "+f+":"+str(newLine)+" is a duplicate comment, previously reported at line "+str(oldLine))
+  tOld = timeit.timeit(lambda: find_json_comments_old(code), number=iterations)*1000/iterations
+  tNew = timeit.timeit(lambda: common.find_json_comments(code), number=iterations)*1000/iterations
+  totalOld += tOld
+  totalNew += tNew
+  print("%-40s %8d %8d %10.3f %10.3f %7.1fx" % (f, len(code), len(new), tOld, tNew, tOld/tNew))
+print("%-40s %8s %8s %10.3f %10.3f %7.1fx" % ("TOTAL", "", "", totalOld, totalNew, totalOld/totalNew))
@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Host benchmark of looking up symbols with the binary search in jswBinarySearch against
+# the tries from build_jswrapper_efficient.py (SYMBOL_TRIE), using the symbol tables from a
+# generated wrapper file. Each table is searched for all of its own symbols (hits) and the
+# same number of symbols from other tables (misses), and the size of each trie is reported.
+#
+#   BOARD=LINUX make
+#   scripts/benchmark_jswrapper_lookup.py gen/jswrapper.c
+#
+# USAGE: benchmark_jswrapper_lookup.py [-nLOOKUPS] [--cc=gcc] [--cflags="-Os"] [jswrapper.c]
+#
+# The wrapper must have been built without SYMBOL_TRIE. Timings are for the host CPU, so
+# use --cc/--cflags to get closer to a board's compiler settings
+# ----------------------------------------------------------------------------------------
+
+import re;
+import sys;
+import os;
+import subprocess;
+import tempfile;
+import shutil;
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(scriptdir);
+import build_jswrapper_efficient;
+
+# Only suggest a trie for tables where it's at least this much faster
+MIN_SPEEDUP = 1.1
+
+# Get { table : [ names ] } from the symbol tables in a generated wrapper file
+def readSymbolTables(filename):
+  code = open(filename).read()
+  match = re.search(r'FLASH_STR\(jswSymbols_str, "(.*?)"\);', code)
+  if not match:
+    print("ERROR: No jswSymbols_str in "+filename)
+    exit(1)
+  symbolChars = match.group(1).replace("\\0", "\0")
+  if "jswSymbolTries[]" in code:
+    print("ERROR: "+filename+" was built with SYMBOL_TRIE")
+    exit(1)
+  tables = {}
+  for match in re.finditer(r'static const JswSymPtr jswSymbols_(\w+)\[\] FLASH_SECT = \{(.*?)\n\};', code, re.DOTALL):
+    names = []
+    for offset in re.findall(r'\{(\d+), ', match.group(2)):
+      offset = int(offset)
+      names.append(symbolChars[offset:symbolChars.index("\0", offset)])
+    if names: tables[match.group(1)] = names
+  return tables
+
+def getCString(s):
+  return '"'+s.replace("\\","\\\\").replace('"','\\"')+'"'
+
+# Output C code that checks and times both ways of looking up symbols in each table
+def getBenchmarkCode(tables, lookups):
+  lines = []
+  codeOut = lines.append
+  codeOut("""#include <stdio.h>
+#include <string.h>
+#include <stdlib.h>
+#include <time.h>
+#define JSW_COMPARE(X) (X)
+#define NOT_USED(X) ((void)(X))
+
+// The same as the loop in jswBinarySearch
+static int __attribute__((noinline)) jswBinarySearch(const char *const *names, int count, const char *name) {
+  int searchMin = 0;
+  int searchMax = count - 1;
+  while (searchMin <= searchMax) {
+    int idx = (searchMin+searchMax) >> 1;
+    int cmp = strcmp(name, names[idx]);
+    if (cmp==0) return idx;
+    if (cmp<0) searchMax = idx-1;
+    else searchMin = idx+1;
+  }
+  return -1;
+}
+
+static double getTime() {
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + t.tv_nsec/1000000000.0;
+}
+
+volatile int jswResult;
+
+// Fastest of several runs, in ns per lookup
+static double timeLookups(int (*trie)(const char *), const char *const *names, int count, const char *const *queries, int queryCount) {
+  int loops = %d / queryCount + 1;
+  double best = 0;
+  for (int run=0;run<5;run++) {
+    int r = 0;
+    double t = getTime();
+    for (int l=0;l<loops;l++)
+      for (int i=0;i<queryCount;i++)
+        r += trie ? trie(queries[i]) : jswBinarySearch(names, count, queries[i]);
+    t = getTime() - t;
+    jswResult = r;
+    if (run==0 || t<best) best = t;
+  }
+  return best * 1000000000.0 / (loops * queryCount);
+}
+""" % lookups)
+  allNames = sorted(set([name for names in tables.values() for name in names]))
+  for table in sorted(tables.keys()):
+    names = tables[table]
+    others = [name for name in allNames if not name in names]
+    step = max(1, len(others) // len(names))
+    misses = others[::step][:len(names)] or ["\xff"]
+    build_jswrapper_efficient.codeOutTrie(codeOut, "jswSymbolTrie_"+table, names)
+    codeOut("static const char *const names_"+table+"[] = {"+", ".join([getCString(n) for n in names])+"};")
+    codeOut("static const char *const misses_"+table+"[] = {"+", ".join([getCString(n) for n in misses])+"};")
+  codeOut("int main() {")
+  for table in sorted(tables.keys()):
+    count = str(len(tables[table]))
+    missCount = "(int)(sizeof(misses_"+table+")/sizeof(char*))"
+    args = "names_"+table+", "+count
+    codeOut("  for (int i=0;i<"+count+";i++)")
+    codeOut("    if (jswSymbolTrie_"+table+"(names_"+table+"[i])!=jswBinarySearch("+args+", names_"+table+"[i])) { printf(\"ERROR: trie for "+table+" returned the wrong index for %s\\n\", names_"+table+"[i]); return 1; }")
+    codeOut("  for (int i=0;i<"+missCount+";i++)")
+    codeOut("    if (jswSymbolTrie_"+table+"(misses_"+table+"[i])!=-1) { printf(\"ERROR: trie for "+table+" found %s\\n\", misses_"+table+"[i]); return 1; }")
+    codeOut("  printf(\""+table+" %f %f %f %f\\n\",")
+    codeOut("    timeLookups(0, "+args+", names_"+table+", "+count+"), timeLookups(jswSymbolTrie_"+table+", "+args+", names_"+table+", "+count+"),")
+    codeOut("    timeLookups(0, "+args+", misses_"+table+", "+missCount+"), timeLookups(jswSymbolTrie_"+table+", "+args+", misses_"+table+", "+missCount+"));")
+  codeOut("  return 0;")
+  codeOut("}")
+  return "\n".join(lines)+"\n"
+
+# Get the size of each function in an executable
+def getFunctionSizes(executable):
+  sizes = {}
+  try:
+    output = subprocess.check_output(["nm", "-S", "--defined-only", executable]).decode("utf-8")
+  except (OSError, subprocess.CalledProcessError):
+    return sizes
+  for line in output.splitlines():
+    fields = line.split()
+    if len(fields)==4:
+      sizes[fields[3]] = int(fields[1], 16)
+  return sizes
+
+if __name__ == "__main__":
+  wrapperFileName = "gen/jswrapper.c"
+  lookups = 500000
+  cc = "gcc"
+  cflags = "-Os"
+  for arg in sys.argv[1:]:
+    if arg.startswith("-n"): lookups = int(arg[2:])
+    elif arg.startswith("--cc="): cc = arg[5:]
+    elif arg.startswith("--cflags="): cflags = arg[9:]
+    elif arg.startswith("-"):
+      print("USAGE: benchmark_jswrapper_lookup.py [-nLOOKUPS] [--cc=gcc] [--cflags=\"-Os\"] [jswrapper.c]")
+      exit(1)
+    else: wrapperFileName = arg
+
+  tables = readSymbolTables(wrapperFileName)
+  print("Benchmarking "+str(len(tables))+" symbol tables from "+wrapperFileName+" with "+cc+" "+cflags)
+  tmpdir = tempfile.mkdtemp()
+  try:
+    source = os.path.join(tmpdir, "benchmark.c")
+    executable = os.path.join(tmpdir, "benchmark")
+    open(source, "w").write(getBenchmarkCode(tables, lookups))
+    subprocess.check_call([cc]+cflags.split()+["-o", executable, source])
+    sizes = getFunctionSizes(executable)
+    output = subprocess.check_output([executable]).decode("utf-8")
+  except (OSError, subprocess.CalledProcessError) as e:
+    print("ERROR: "+str(e))
+    exit(1)
+  finally:
+    shutil.rmtree(tmpdir)
+
+  results = []
+  for line in output.splitlines():
+    fields = line.split()
+    if fields[0]=="ERROR":
+      print(line)
+      exit(1)
+    table = fields[0]
+    bsearchHit, trieHit, bsearchMiss, trieMiss = [float(f) for f in fields[1:]]
+    results.append({ "table" : table, "symbols" : len(tables[table]),
+                     "bsearchHit" : bsearchHit, "trieHit" : trieHit, "bsearchMiss" : bsearchMiss, "trieMiss" : trieMiss,
+                     "trieBytes" : sizes.get("jswSymbolTrie_"+table, 0),
+                     "speedup" : (bsearchHit+bsearchMiss) / max(trieHit+trieMiss, 0.001) })
+  print("")
+  print("Times are ns per lookup. 'trie' is the size of the trie's code, which is needed as well as the table")
+  print("%-32s %7s %10s %10s %10s %10s %8s %8s" % ("table", "symbols", "bsearch", "trie", "bsearch", "trie", "trie", "speedup"))
+  print("%-32s %7s %10s %10s %10s %10s %8s %8s" % ("", "", "hit", "hit", "miss", "miss", "bytes", ""))
+  for r in sorted(results, key=lambda r: -r["symbols"]):
+    print("%-32s %7d %10.2f %10.2f %10.2f %10.2f %8d %7.2fx" % (r["table"], r["symbols"], r["bsearchHit"], r["trieHit"],
+          r["bsearchMiss"], r["trieMiss"], r["trieBytes"], r["speedup"]))
+  print("")
+  faster = [r for r in results if r["speedup"]>=MIN_SPEEDUP]
+  if faster:
+    print("Tries were at least "+str(MIN_SPEEDUP)+"x faster for "+str(len(faster))+" of "+str(len(results))+" tables, for "+str(sum([r["trieBytes"] for r in faster]))+" bytes of code:")
+    print("  SYMBOL_TRIE="+",".join([r["table"] for r in sorted(faster, key=lambda r: r["table"])]))
+  else:
+    print("Tries weren't faster than binary search for any tables")
@@ -300,6 +300,9 @@ for className in sorted(classes, key=lambda s: s.lower()):
 html("  </ul>")
 html('  </div><!-- Contents -->')
 
+# Index so we can quickly look up classes/libraries by name
+jsondataIndex = common.get_jsondata_index(jsondatas)
+
 html("  <a class=\"blush\" name=\"top\"\>");
 #html("  <h2>Detail</h2>")
 lastClass = "XXX"
@@ -324,8 +327,8 @@ for jsondata in detail:
     lastClass=className
     html("<h2 class=\"class\"><a class=\"blush\" name=\""+linkName+"\" href=\"#t_"+linkName+"\" onclick=\"place('t_"+linkName+"');\">"+niceName+"</a></h2>")
     html("  <p class=\"top\"><a href=\"javascript:toppos();\">(top)</a></p>")
-    for j in jsondatas:
-      if (j["type"]=="class" or j["type"]=="library") and j["class"]==className and "description" in j:
+    for j in jsondataIndex.get(("class", className, None), []) + jsondataIndex.get(("library", className, None), []):
+      if "description" in j:
         html_description(j["description"], className)
 
     instances = []
@@ -13,6 +13,9 @@
 # which is useful for autocomplete
 #
 # To generate the stubs for Node.js use `build_jssstub.py node`
+#
+# With `--ir=gen/wrapper_ir.pickle`, the stubs are made from the documentation in the
+# wrapper IR written by a build (so only for that board) rather than by scanning every file
 # ----------------------------------------------------------------------------------------
 
 import sys;
@@ -21,11 +24,15 @@ import common;
 
 # encapsulate output in a comment
 print("/*");
-schemas = common.get_jsondata(True, False)
+irFilenames = [arg[5:] for arg in sys.argv[1:] if arg.startswith("--ir=")]
+ir = irFilenames and common.load_wrapper_ir(irFilenames[0])
+if ir:
+  context = common.get_wrapper_ir_view(ir, True)["struct"]
+else:
+  schemas = common.get_jsondata(True, False)
+  # get structured data for further parsing
+  context = common.get_struct_from_jsondata(schemas)
 print("*/");
-
-# get structured data for further parsing
-context = common.get_struct_from_jsondata(schemas)
 #print(json.dumps(context, sort_keys=True, indent=2))
 
 def println(line):
@@ -24,20 +24,102 @@ sys.path.append(basedir+"scripts");
 sys.path.append(basedir+"boards");
 import importlib;
 import common;
+import heatshrink;
+import build_jswrapper_efficient;
 from collections import OrderedDict;
+try:
+  from StringIO import StringIO;
+except ImportError:
+  from io import StringIO;
 
-if len(sys.argv)<2 or sys.argv[len(sys.argv)-2][:2]!="-B" or sys.argv[len(sys.argv)-1][:2]!="-F":
+if len(sys.argv)<2 or not (sys.argv[len(sys.argv)-2][:2]=="-B" or sys.argv[len(sys.argv)-2][:9]=="--boards=") or sys.argv[len(sys.argv)-1][:2]!="-F":
 	print("USAGE: build_jswrapper.py ... -BBOARD -Fwrapperfile.c")
+	print("       build_jswrapper.py ... --boards=BOARD1,BOARD2,... -Fwrapperfile_%s.c")
+	print("")
+	print("  --boards scans the source files once and then creates a wrapper file for each")
+	print("  board, with %s in the filename replaced by the board name. Use -J to build")
+	print("  boards in parallel (see common.py for other options)")
+	print("")
+	print("  --symbol-hash=all|TABLE1,TABLE2,... uses a perfect hash rather than a binary search")
+	print("  to look up symbols in the given tables (eg. global,Graphics_proto)")
+	print("  --symbol-trie=all|TABLE1,TABLE2,... uses a tree of character comparisons (see")
+	print("  build_jswrapper_efficient.py) to look up symbols in the given tables")
+	print("  --compress-modules heatshrink-compresses built-in JS modules, which are decompressed")
+	print("  when they are first used with require")
+	print("  --symbol-profile=FILE checks the most used symbols in each table (from a profile written")
+	print("  by a JSWRAPPER_COUNT_COMPARISONS build, or JSON) before the binary search")
+	print("  --hot-symbols=N is the most symbols to check first in each table (default 4)")
+	print("  --ir=FILE loads the jsondata from this wrapper IR if it's up to date, or saves it if not")
+	print("  (see common.py). With --boards, %s in the filename is replaced by the board name")
+	print("  --flash-report=FILE writes the flash used by the wrapper for each symbol table and source")
+	print("  file as JSON, and shows what has changed since the report already in FILE (or the one")
+	print("  given with --flash-report-base=FILE). With --boards, %s is replaced by the board name")
+	print("  --analyze-argspecs reports on the argument specifiers used by the given boards, which")
+	print("  functions need generated wrappers, and candidates for fast paths in jsnCallFunction.")
+	print("  No wrapper file is written")
+	print("  --explain shows which BLACKLIST rule removed each symbol, and roughly how much flash")
+	print("  that saved")
+	print("  --app-dir=DIR removes symbols whose names aren't used anywhere in the .js files in DIR")
+	print("  (see removeUnusedSymbols). Use with --explain to list them")
 	exit(1)
 
-boardName = sys.argv[len(sys.argv)-2]
-boardName = boardName[2:]
+if sys.argv[len(sys.argv)-2][:2]=="-B":
+  boardNames = [ sys.argv[len(sys.argv)-2][2:] ]
+  batchMode = False
+else:
+  boardNames = sys.argv[len(sys.argv)-2][9:].split(",")
+  batchMode = True
 
 wrapperFileName = sys.argv[len(sys.argv)-1]
 wrapperFileName = wrapperFileName[2:]
+if batchMode and not "%s" in wrapperFileName:
+  print("ERROR: With --boards, the wrapper filename must contain %s")
+  exit(1)
+
+# Tables to use a perfect hash for (SYMBOL_HASH in the Makefile)
+symbolHashDefault = ""
+# Compress JS modules (COMPRESS_JSMODULES in the Makefile)
+compressModulesDefault = ""
+# Tables to use a trie for (SYMBOL_TRIE in the Makefile)
+symbolTrieDefault = ""
+# Symbol profile to pick the hot symbols in each table from (SYMBOL_PROFILE in the Makefile)
+symbolProfileDefault = ""
+# Most hot symbols to check in each table (HOT_SYMBOLS in the Makefile)
+hotSymbolsDefault = "4"
+# JSON report of the flash used by the wrapper (FLASH_REPORT in the Makefile), and a report to compare it with
+flashReportFileName = ""
+flashReportBaseFileName = ""
+# Just analyze the argument specifiers (see analyzeArgumentSpecifiers)
+analyzeArgSpecs = False
+# Show which blacklist rule removed what
+explainBlacklist = False
+# Directory of JS apps - symbols they don't use are removed (APP_DIR in the Makefile)
+appDirDefault = ""
+for arg in sys.argv[1:]:
+  if arg[:14]=="--symbol-hash=":
+    symbolHashDefault = arg[14:]
+  if arg[:14]=="--symbol-trie=":
+    symbolTrieDefault = arg[14:]
+  if arg[:17]=="--symbol-profile=":
+    symbolProfileDefault = arg[17:]
+  if arg[:14]=="--hot-symbols=":
+    hotSymbolsDefault = arg[14:]
+  if arg=="--compress-modules":
+    compressModulesDefault = "1"
+  if arg[:15]=="--flash-report=":
+    flashReportFileName = arg[15:]
+  if arg[:20]=="--flash-report-base=":
+    flashReportBaseFileName = arg[20:]
+  if arg=="--analyze-argspecs":
+    analyzeArgSpecs = True
+  if arg=="--explain":
+    explainBlacklist = True
+  if arg[:10]=="--app-dir=":
+    appDirDefault = arg[10:]
 
 # Load any JS modules specified on command-line
 jsmodules = {}
+jsmoduleFiles = {} # module name -> the file it came from
 for i in range(1,len(sys.argv)):
   arg = sys.argv[i]
   if arg[0]!="-" and arg[-3:]==".js":
@@ -51,6 +133,7 @@ for i in range(1,len(sys.argv)):
     print("Loading JS module: "+arg+" -> "+modulename)
     jscode = open(arg, "r").read()
     jsmodules[modulename] = jscode
+    jsmoduleFiles[modulename] = arg
 
 # List of argument specifiers (JSWAT...) that have been used
 argSpecs = []
@@ -61,23 +144,31 @@ argSpecCalls = []
 
 def codeOut(s):
 #  print str(s)
+  # common.py scans gen/jswrapper.c for JSON comments too if it isn't given a list of files
+  if "/*JSON" in s:
+    FATAL_ERROR("Generated code can't contain '/*JSON', as it'd be read as a JSON comment: "+s+"\n")
   wrapperFile.write(s+"\n");
 
 def FATAL_ERROR(s):
   sys.stderr.write("ERROR: "+s)
   exit(1)
 
+# Get a string as a C string literal. '/*' is escaped so JS code can't end up looking like a
+# JSON comment in the wrapper file (see codeOut)
+def toCString(s):
+  return json.dumps(s).replace("/*", "/\\052")
+
 # ------------------------------------------------------------------------------------------------------
 
 def getConstructorTestFor(className, variableName):
     # IMPORTANT - we expect built-in objects to be native functions with a pointer to
     # their constructor function inside
-    for jsondata in jsondatas:
-      if jsondata["type"]=="constructor" and jsondata["name"]==className:
-        if variableName=="constructorPtr": # jsvIsNativeFunction/etc has already been done
-          return "constructorPtr==(void*)"+jsondata["generate"];
-        else:
-          return "jsvIsNativeFunction("+variableName+") && (void*)"+variableName+"->varData.native.ptr==(void*)"+jsondata["generate"];
+    jsondata = common.find_jsondata(jsondataIndex, "constructor", className, className)
+    if jsondata:
+      if variableName=="constructorPtr": # jsvIsNativeFunction/etc has already been done
+        return "constructorPtr==(void*)"+jsondata["generate"];
+      else:
+        return "jsvIsNativeFunction("+variableName+") && (void*)"+variableName+"->varData.native.ptr==(void*)"+jsondata["generate"];
     print("No constructor found for "+className)
     exit(1)
 
@@ -187,222 +278,997 @@ def getCDeclaration(jsondata, name):
     s.append(toCType(param[1]));
   return toCType(result[0])+" "+name+"("+",".join(s)+")";
 
-def codeOutSymbolTable(builtin):
+# Work out which symbols will go in a builtin's table, sorted by name
+def getSymbolTableEntries(builtin):
   codeName = builtin["name"]
   # sort by name
   builtin["functions"] = sorted(builtin["functions"], key=lambda n: n["name"]);
-  # output tables
-  listSymbols = []
-  listChars = ""
-  strLen = 0
+  symbols = []
   for sym in builtin["functions"]:
     symName = sym["name"];
 
     if builtin["name"]=="global" and symName in libraries:
       continue # don't include libraries on global namespace
     if "generate" in sym:
-      listSymbols.append("{"+", ".join([str(strLen), getArgumentSpecifier(sym), "(void (*)(void))"+sym["generate"]])+"}")
-      listChars = listChars + symName + "\\0";
-      strLen = strLen + len(symName) + 1
+      symbols.append(sym)
     else:
       print (codeName + "." + symName+" not included in Symbol Table because no 'generate'")
-  builtin["symbolTableChars"] = "\""+listChars+"\"";
+  builtin["symbols"] = symbols
+  builtin["symbolNames"] = [sym["name"] for sym in symbols]
+
+# All symbol tables share one string of names. Each name is only included once, and
+# names that are the end of another name (eg 'compress' of 'decompress' or 'Error' of
+# 'ReferenceError') point to the end of that name. extraNames are other names we search
+# for with jswFindName. Returns the string and the offset of each name
+def buildSymbolStrings(builtins, extraNames):
+  names = []
+  for b in builtins:
+    for name in builtins[b]["symbolNames"]:
+      if not name in names: names.append(name)
+  for name in extraNames:
+    if not name in names: names.append(name)
+  # sort by reversed name - any name that's the end of another comes just before one that it's the end of
+  byEnd = sorted(names, key=lambda n: n[::-1])
+  container = {}
+  for i in reversed(range(len(byEnd))):
+    name = byEnd[i]
+    if i+1<len(byEnd) and byEnd[i+1].endswith(name):
+      container[name] = container[byEnd[i+1]]
+    else:
+      container[name] = name
+  # output names in the order they're first used, so each table's names are mostly together
+  symbolChars = ""
+  offsets = {}
+  for name in names:
+    if container[name]==name:
+      offsets[name] = len(symbolChars)
+      symbolChars = symbolChars + name + "\0"
+  for name in names:
+    offsets[name] = offsets[container[name]] + len(container[name]) - len(name)
+  if len(symbolChars)>65535:
+    FATAL_ERROR("Symbol names are too long for JswSymPtr.strOffset ("+str(len(symbolChars))+" bytes)\n")
+  tableBytes = sum([sum([len(n)+1 for n in builtins[b]["symbolNames"]])+1 for b in builtins]) + sum([len(n)+1 for n in extraNames])
+  print("Symbol names: "+str(len(symbolChars)+1)+" bytes shared by all tables, rather than "+str(tableBytes)+" bytes in separate tables (saved "+str(tableBytes-len(symbolChars)-1)+" bytes)")
+  return symbolChars, offsets
+
+def codeOutSymbolTable(builtin, symbolOffsets):
+  codeName = builtin["name"]
+  # output tables
+  listSymbols = []
+  for sym in builtin["symbols"]:
+    listSymbols.append("{"+", ".join([str(symbolOffsets[sym["name"]]), getArgumentSpecifier(sym), "(void (*)(void))"+sym["generate"]])+"}")
   builtin["symbolTableCount"] = str(len(listSymbols));
   codeOut("static const JswSymPtr jswSymbols_"+codeName+"[] FLASH_SECT = {\n  "+",\n  ".join(listSymbols)+"\n};");
 
+# Output a sorted table of offsets of names in jswSymbols_str so jswFindName can binary search
+# it, and return the C expression that finds the index of nameVar in it (or -1)
+def codeOutNameIndex(tableName, names, symbolOffsets, nameVar="name"):
+  names = sorted(names) # same order as strcmp, as names are ASCII
+  if not names: return "-1"
+  codeOut("static const unsigned short "+tableName+"[] FLASH_SECT = { // "+", ".join(names))
+  codeOut("  "+", ".join([str(symbolOffsets[name]) for name in names]))
+  codeOut("};")
+  return "jswFindName("+tableName+", "+str(len(names))+", "+nameVar+")"
+
 def codeOutBuiltins(indent, builtin):
   codeOut(indent+"jswBinarySearch(&jswSymbolTables["+builtin["indexName"]+"], parent, name);");
 
+#================== switching on the type of 'parent' ==============
+# For each check that getTestFor can return: the JsVar types (JSV_...) it matches that we
+# can switch on, and whether it matches any other types (strings, names/etc). Checks that
+# aren't in here are done for every type.
+varTypeTests = {
+  "jsvIsString(parent)" : ([], True),
+  "jsvIsPin(parent)" : (["JSV_PIN"], False),
+  "jsvIsInt(parent)" : (["JSV_INTEGER","JSV_PIN"], True),
+  "jsvIsFloat(parent)" : (["JSV_FLOAT"], False),
+  "jsvIsNumeric(parent)" : (["JSV_INTEGER","JSV_FLOAT","JSV_BOOLEAN","JSV_PIN"], True),
+  "jsvIsArray(parent)" : (["JSV_ARRAY"], False),
+  "jsvIsArrayBuffer(parent)" : (["JSV_ARRAYBUFFER"], False),
+  "jsvIsFunction(parent)" : (["JSV_FUNCTION","JSV_NATIVE_FUNCTION","JSV_FUNCTION_RETURN"], False),
+}
+
+# Output a switch on parent's type that does codeOutMatch(indent, test) for each of 'tests'
+# (in order) that could match. If 'returns' is set, codeOutMatch always returns so we stop
+# at the first unconditional match. 'preamble' has lines of code to output first for some types.
+def codeOutVarTypeSwitch(indent, tests, codeOutMatch, returns, preamble={}):
+  global wrapperFile
+  varTypes = []
+  for test in tests:
+    for varType in varTypeTests.get(test.partition(" && ")[0], ([], True))[0]:
+      if not varType in varTypes: varTypes.append(varType)
+  for varType in preamble:
+    if not varType in varTypes: varTypes.append(varType)
+  # work out the code for each case, then put the cases with the same code together
+  cases = OrderedDict()
+  realWrapperFile = wrapperFile
+  for varType in varTypes+["default"]:
+    wrapperFile = StringIO()
+    caseIndent = indent+"    "
+    if varType in preamble:
+      for line in preamble[varType]: codeOut(caseIndent+line)
+    done = False
+    for test in tests:
+      base, _, extra = test.partition(" && ")
+      if base in varTypeTests:
+        types, other = varTypeTests[base]
+        if varType=="default":
+          if not other: continue
+          extra = test
+        elif not varType in types: continue
+      else:
+        extra = test
+      if extra:
+        codeOut(caseIndent+"if (JSW_COMPARE("+extra+")) {")
+        codeOutMatch(caseIndent+"  ", test)
+        codeOut(caseIndent+"}")
+      else:
+        codeOutMatch(caseIndent, test)
+        if returns:
+          done = True
+          break
+    if not done: codeOut(caseIndent+"break;")
+    code = wrapperFile.getvalue()
+    if not code in cases: cases[code] = []
+    cases[code].append(varType)
+  wrapperFile = realWrapperFile
+  codeOut(indent+"switch (JSW_COMPARE(parent->flags & JSV_VARTYPEMASK)) {")
+  for code in cases:
+    codeOut(indent+"  "+" ".join([("default:" if t=="default" else "case "+t+":") for t in cases[code]]))
+    wrapperFile.write(code)
+  codeOut(indent+"}")
+
+# Constructor function pointers are in a table, rather than being checked one after the other.
+# Function addresses aren't known until link time, so when we're not SAVE_ON_FLASH the
+# table gets sorted by address (in RAM) on first use and is binary searched.
+def codeOutConstructorTable(constructorTable):
+  codeOut('#define JSW_NO_SYMBOLS 255')
+  codeOut('typedef struct {')
+  codeOut('  void *ptr; // the constructor\'s native function')
+  codeOut('  unsigned char symbols; // jswGetSymbolListForObject')
+  codeOut('  unsigned char objectProto; // jswGetSymbolListForObjectProto')
+  codeOut('  unsigned char constructorProto; // jswGetSymbolListForConstructorProto')
+  codeOut('} JswConstructor;')
+  codeOut('#define JSW_CONSTRUCTOR_COUNT '+str(max(len(constructorTable),1)))
+  codeOut('static const JswConstructor jswConstructors[JSW_CONSTRUCTOR_COUNT] FLASH_SECT = {')
+  for ptr in constructorTable:
+    c = constructorTable[ptr]
+    codeOut('  {(void*)'+ptr+', '+', '.join([c.get(k, "JSW_NO_SYMBOLS") for k in ["symbols","objectProto","constructorProto"]])+'},')
+  if not constructorTable:
+    codeOut('  {0, JSW_NO_SYMBOLS, JSW_NO_SYMBOLS, JSW_NO_SYMBOLS}')
+  codeOut('};')
+  codeOut("""
+static const JswConstructor *jswFindConstructor(void *ptr) {
+#ifdef SAVE_ON_FLASH
+  for (int i=0;i<JSW_CONSTRUCTOR_COUNT;i++)
+    if (JSW_COMPARE(jswConstructors[i].ptr==ptr)) return &jswConstructors[i];
+#else
+  static unsigned char order[JSW_CONSTRUCTOR_COUNT]; // indices of jswConstructors, sorted by ptr
+  static bool sorted = false;
+  if (!sorted) {
+    for (int i=0;i<JSW_CONSTRUCTOR_COUNT;i++) {
+      int j = i;
+      while (j>0 && (size_t)jswConstructors[order[j-1]].ptr > (size_t)jswConstructors[i].ptr) {
+        order[j] = order[j-1];
+        j--;
+      }
+      order[j] = (unsigned char)i;
+    }
+    sorted = true;
+  }
+  int searchMin = 0;
+  int searchMax = JSW_CONSTRUCTOR_COUNT - 1;
+  while (searchMin <= searchMax) {
+    int idx = (searchMin+searchMax) >> 1;
+    const JswConstructor *c = &jswConstructors[order[idx]];
+    if (JSW_COMPARE(c->ptr==ptr)) return c;
+    if ((size_t)c->ptr > (size_t)ptr)
+      searchMax = idx-1;
+    else
+      searchMin = idx+1;
+  }
+#endif
+  return 0;
+}
+
+// Get the symbol list from one of the fields in JswConstructor, or 0
+static const JswSymList *jswGetConstructorSymbols(unsigned char idx) {
+  return (idx==JSW_NO_SYMBOLS) ? 0 : &jswSymbolTables[idx];
+}
+""")
+
+# Add a constructor (by the check from getConstructorTestFor) to the constructor table,
+# returning False if the check isn't a simple pointer comparison
+def addToConstructorTable(constructorTable, check, field, builtin):
+  for prefix in ["jsvIsNativeFunction(parent) && (void*)parent->varData.native.ptr==(void*)", "constructorPtr==(void*)", "(void*)parent->varData.native.ptr==(void*)"]:
+    if check.startswith(prefix):
+      ptr = check[len(prefix):]
+      if not ptr in constructorTable: constructorTable[ptr] = {}
+      if not field in constructorTable[ptr]: # the first match is the one that would have been used
+        constructorTable[ptr][field] = builtin["indexName"]
+      return True
+  return False
+
+#================== compressed JS modules ==============
+# Output jswGetBuiltInJSLibrary with each module compressed with heatshrink, and
+# report how much flash that saves. Returns the compressed size of each module
+def codeOutCompressedJSModules(symbolOffsets):
+  codeOut("#ifndef USE_HEATSHRINK")
+  codeOut("#error build_jswrapper.py --compress-modules (COMPRESS_JSMODULES) needs heatshrink, which isn't in SAVE_ON_FLASH builds")
+  codeOut("#endif")
+  codeOut("#include \"jsvariterator.h\"")
+  codeOut("#include \"compress_heatshrink.h\"")
+  totalSize = 0
+  totalCompressed = 0
+  moduleNames = {}
+  moduleBytes = {}
+  for modulename in jsmodules:
+    js = jsmodules[modulename].encode("utf-8")
+    compressed = heatshrink.encode(js)
+    if heatshrink.decode(compressed)!=bytearray(js):
+      FATAL_ERROR("Compressed JS module "+modulename+" didn't decompress correctly\n")
+    moduleNames[modulename] = "jswJSModule_"+re.sub(r"[^A-Za-z0-9_]", "_", modulename)
+    codeOut("static const unsigned char "+moduleNames[modulename]+"[] = { // "+str(len(js))+" bytes uncompressed")
+    for i in range(0, len(compressed), 32):
+      codeOut("  "+"".join([str(c)+"," for c in compressed[i:i+32]]))
+    codeOut("};")
+    print("JS module "+modulename+": "+str(len(js))+" bytes, compressed to "+str(len(compressed))+" bytes ("+str(100*len(compressed)//max(len(js),1))+"%)")
+    totalSize += len(js)
+    totalCompressed += len(compressed)
+    moduleBytes[modulename] = len(compressed)
+  print("JS modules: "+str(totalSize)+" bytes, compressed to "+str(totalCompressed)+" bytes (saved "+str(totalSize-totalCompressed)+" bytes)")
+  codeOut("""
+static JsVar *jswDecompressJSLibrary(const unsigned char *data, size_t dataLen, size_t jsLen) {
+  JsVar *js = jsvNewStringOfLength((unsigned int)jsLen, NULL);
+  if (!js) return 0;
+  HeatShrinkPtrInputCallbackInfo cbi;
+  cbi.ptr = (unsigned char*)data;
+  cbi.len = dataLen;
+  JsvStringIterator it;
+  jsvStringIteratorNew(&it, js, 0);
+  heatshrink_decode_cb(heatshrink_ptr_input_cb, (uint32_t*)&cbi, heatshrink_var_output_cb, (uint32_t*)&it);
+  jsvStringIteratorFree(&it);
+  return js;
+}
+""")
+  codeOut("/** If we have a built-in module with the given name, return a String of the module's contents - or 0 */")
+  findModule = codeOutNameIndex("jswJSModuleNames", jsmodules.keys(), symbolOffsets)
+  codeOut('JsVar *jswGetBuiltInJSLibrary(const char *name) {')
+  codeOut('  switch ('+findModule+') {')
+  for idx, modulename in enumerate(sorted(jsmodules.keys())):
+    codeOut("    case "+str(idx)+": return jswDecompressJSLibrary("+moduleNames[modulename]+", sizeof("+moduleNames[modulename]+"), "+str(len(jsmodules[modulename].encode("utf-8")))+");")
+  codeOut('  }')
+  codeOut('  return 0;')
+  codeOut('}')
+  return moduleBytes
+
+#================== perfect hashes for symbol tables ==============
+# These must match jswHashSymbol/jswHashMix in the jswBinarySearch we output
+def hashSymbol(name):
+  h = 2166136261 # FNV-1a
+  for c in bytearray(name.encode("ascii")):
+    h = ((h ^ c) * 16777619) & 0xFFFFFFFF
+  return h
+
+def hashMix(h, displacement):
+  h = h ^ ((displacement * 0x9E3779B9) & 0xFFFFFFFF)
+  h = h ^ (h >> 15)
+  h = (h * 0x2C1B3C6D) & 0xFFFFFFFF
+  h = h ^ (h >> 12)
+  return h
+
+# Build a minimal perfect hash (hash and displace) for a list of names.
+# Each name's hash picks a bucket, and each bucket has a displacement (<256)
+# that's mixed with the hash to find a unique slot. slots[slot] is then the
+# index of the symbol in the (sorted) table. Returns None if we can't do it
+# (eg. two names with the same hash)
+def buildPerfectHash(names):
+  count = len(names)
+  hashes = [hashSymbol(name) for name in names]
+  for bucketCount in range(max(1, (count+3)//4), count+1):
+    buckets = [[] for b in range(bucketCount)]
+    for i in range(count):
+      buckets[hashes[i] % bucketCount].append(i)
+    displacements = [0] * bucketCount
+    slots = [None] * count
+    ok = True
+    # biggest buckets first, as they're the hardest to place
+    for b in sorted(range(bucketCount), key=lambda b: (-len(buckets[b]), b)):
+      if not buckets[b]: continue
+      found = False
+      for d in range(256):
+        targets = [hashMix(hashes[i], d) % count for i in buckets[b]]
+        if len(set(targets))==len(targets) and all(slots[t] is None for t in targets):
+          found = True
+          break
+      if not found:
+        ok = False
+        break
+      displacements[b] = d
+      for i,t in zip(buckets[b], targets):
+        slots[t] = i
+    if ok:
+      return { "displacements" : displacements, "slots" : slots }
+  return None
+
+# Output hash tables for any symbol tables we've been asked to hash, and
+# report how much flash they cost (assuming 32 bit pointers)
+def codeOutSymbolHashes(builtins, symbolHash):
+  hashNames = symbolHash.split(",")
+  totalBytes = 0
+  hashList = []
+  for b in builtins:
+    builtin = builtins[b]
+    names = builtin["symbolNames"]
+    perfectHash = None
+    if names and not "trie" in builtin and ("all" in hashNames or builtin["name"] in hashNames):
+      perfectHash = buildPerfectHash(names)
+      if not perfectHash:
+        print("WARNING: Unable to build perfect hash for "+builtin["name"]+", using binary search")
+    if not perfectHash:
+      hashList.append("0")
+      continue
+    hashName = "jswSymbolHash_"+builtin["name"]
+    displacements = perfectHash["displacements"]
+    codeOut("static const unsigned char "+hashName+"_buckets[] FLASH_SECT = {"+",".join([str(d) for d in displacements])+"};")
+    codeOut("static const unsigned char "+hashName+"_slots[] FLASH_SECT = {"+",".join([str(i) for i in perfectHash["slots"]])+"};")
+    codeOut("static const JswSymHash "+hashName+" FLASH_SECT = {"+hashName+"_buckets, "+hashName+"_slots, "+str(len(displacements))+"};")
+    hashList.append("&"+hashName)
+    builtin["hashed"] = True
+    tableBytes = len(displacements) + len(names) + 12 + 4 # buckets, slots, JswSymHash, jswSymbolHashes entry
+    builtin["lookupBytes"] = tableBytes
+    searchCompares = len(bin(len(names)))-2
+    print("Symbol hash for "+builtin["name"]+": "+str(len(names))+" symbols, "+str(len(displacements))+" buckets, +"+str(tableBytes)+" bytes flash (binary search was up to "+str(searchCompares)+" compares)")
+    totalBytes += tableBytes
+  codeOut("const JswSymHash *const jswSymbolHashes[] FLASH_SECT = {"+", ".join(hashList)+"};")
+  totalBytes += 4 * hashList.count("0")
+  print("Symbol hashes: +"+str(totalBytes)+" bytes flash in total (excluding code)")
+
+#================== tries for symbol tables ==============
+# Output a function for each of the given tables that finds a symbol's index with a tree of
+# character comparisons (see build_jswrapper_efficient.py), rather than a binary search
+def codeOutSymbolTries(builtins, symbolTrie):
+  trieNames = symbolTrie.split(",")
+  trieList = []
+  for b in builtins:
+    builtin = builtins[b]
+    names = builtin["symbolNames"]
+    if not names or not ("all" in trieNames or builtin["name"] in trieNames):
+      trieList.append("0")
+      continue
+    trieName = "jswSymbolTrie_"+builtin["name"]
+    compares = build_jswrapper_efficient.codeOutTrie(codeOut, trieName, names)
+    trieList.append(trieName)
+    builtin["trie"] = True
+    print("Symbol trie for "+builtin["name"]+": "+str(len(names))+" symbols, "+str(compares)+" character comparisons in the code (binary search was up to "+str(len(bin(len(names)))-2)+" compares)")
+  codeOut("const JswSymTrie jswSymbolTries[] FLASH_SECT = {"+", ".join(trieList)+"};")
+
+#================== hot symbols for symbol tables ==============
+# Load a profile of how often symbols are used. This is either the file written by a Linux
+# build with JSWRAPPER_COUNT_COMPARISONS (with 'table' and 'symbol' lines), or JSON: a list
+# of "table.symbol" with the most used first, or an object of "table.symbol" : count.
+# Returns { table : { "misses" : count, "symbols" : { symbol : count } } }
+def loadSymbolProfile(filename):
+  profile = {}
+  def getTable(name):
+    if not name in profile: profile[name] = { "misses" : 0, "symbols" : {} }
+    return profile[name]
+  try:
+    text = open(filename).read()
+  except IOError:
+    FATAL_ERROR("Couldn't read symbol profile "+filename+"\n")
+  if text.strip()[:1] in ["[","{"]:
+    data = json.loads(text)
+    if isinstance(data, list):
+      data = dict([(name, len(data)-i) for i, name in enumerate(data)])
+    for name in data:
+      if not "." in name:
+        FATAL_ERROR("Symbol profile "+filename+" has "+name+", which should be 'table.symbol'\n")
+      table, symbol = name.rsplit(".", 1)
+      getTable(table)["symbols"][symbol] = getTable(table)["symbols"].get(symbol, 0) + data[name]
+  else:
+    for line in text.splitlines():
+      fields = line.split()
+      if len(fields)==6 and fields[0]=="table":
+        getTable(fields[1])["misses"] += int(fields[3]) - int(fields[4])
+      if len(fields)==4 and fields[0]=="symbol":
+        getTable(fields[1])["symbols"][fields[2]] = getTable(fields[1])["symbols"].get(fields[2], 0) + int(fields[3])
+  return profile
+
+# The number of string compares jswBinarySearch makes to find each symbol in a table
+def getBinarySearchCompares(count):
+  compares = [0] * count
+  ranges = [(0, count-1, 1)]
+  while ranges:
+    searchMin, searchMax, depth = ranges.pop()
+    if searchMin > searchMax: continue
+    idx = (searchMin+searchMax) >> 1
+    compares[idx] = depth
+    ranges.append((searchMin, idx-1, depth+1))
+    ranges.append((idx+1, searchMax, depth+1))
+  return compares
+
+# For each table (without a perfect hash), choose up to hotCount of the most used symbols to
+# check before the binary search - however many make the fewest string compares for the
+# profile, given that every miss and every symbol not in the list has to check them all first
+def codeOutSymbolHotLists(builtins, symbolProfile, hotCount):
+  profile = loadSymbolProfile(symbolProfile)
+  hotLists = []
+  for b in builtins:
+    builtin = builtins[b]
+    names = builtin["symbolNames"]
+    tableProfile = profile.get(builtin["name"])
+    if "hashed" in builtin or "trie" in builtin or not tableProfile or not names:
+      hotLists.append("0")
+      continue
+    counts = [tableProfile["symbols"].get(name, 0) for name in names]
+    # most used first, then in table order so the output is always the same
+    byUse = sorted([i for i in range(len(names)) if counts[i]], key=lambda i: (-counts[i], i))[:hotCount]
+    compares = getBinarySearchCompares(len(names))
+    missCompares = len(bin(len(names)))-2
+    def getCompares(hot):
+      total = tableProfile["misses"] * (len(hot) + missCompares)
+      for i in range(len(names)):
+        if i in hot: total += counts[i] * (hot.index(i)+1)
+        else: total += counts[i] * (len(hot) + compares[i])
+      return total
+    best = min(range(len(byUse)+1), key=lambda n: (getCompares(byUse[:n]), n))
+    if not best:
+      hotLists.append("0")
+      continue
+    hot = byUse[:best]
+    hotName = "jswSymbolHot_"+builtin["name"]
+    codeOut("static const unsigned char "+hotName+"[] FLASH_SECT = {"+", ".join([str(i) for i in hot])+", 255}; // "+", ".join([names[i] for i in hot]))
+    hotLists.append(hotName)
+    builtin["lookupBytes"] = len(hot) + 1
+    print("Hot symbols for "+builtin["name"]+": "+", ".join([names[i] for i in hot])+" ("+str(getCompares([]))+" -> "+str(getCompares(hot))+" string compares for the profile)")
+  codeOut("const unsigned char *const jswSymbolHotLists[] FLASH_SECT = {"+", ".join(hotLists)+"};")
+
+#================== flash used by the wrapper ==============
+# Rough size of a small generated wrapper function (gen_jswrap_...) on Thumb-2, as we can't
+# know what the compiler will make of it
+WRAPPER_FUNCTION_BYTES = 16
+FLASH_REPORT_FIELDS = ["symbolStrings", "symbolPtrs", "symbolLists", "lookupTables", "wrapperFunctions", "jsModules"]
+
+def getPointerBytes(board):
+  return 8 if board.chip["family"]=="LINUX" else 4
+
+def getSymPtrBytes(board):
+  return 4 + getPointerBytes(board) # JswSymPtr is packed except on ESP8266, where it's the same anyway
+
+def getSymListBytes(board):
+  return 2*getPointerBytes(board) + (getPointerBytes(board) if board.chip["family"]=="ESP8266" else 1)
+
+# Does jsondata end up in a symbol table?
+def isBuiltinSymbol(jsondata):
+  return "name" in jsondata and ("generate" in jsondata or "generate_full" in jsondata or "generate_js" in jsondata or jsondata["type"]=="object")
+
+# Estimate the size of the gen_jswrap_... function we output for jsondata, if any
+def getGeneratedFunctionBytes(jsondata):
+  if "generate_js" in jsondata:
+    with open(basedir+jsondata["generate_js"], 'r') as file:
+      return WRAPPER_FUNCTION_BYTES + len(file.read().strip().encode("utf-8")) + 1
+  if jsondata["type"]=="object":
+    return WRAPPER_FUNCTION_BYTES + len(jsondata["name"]) + len(jsondata["instanceof"]) + 2
+  if "generate_full" in jsondata:
+    return WRAPPER_FUNCTION_BYTES
+  return 0
+
+# Roughly how much flash the wrapper uses for jsondata, assuming its name isn't shared
+def getJsondataFlashBytes(board, jsondata):
+  if isBuiltinSymbol(jsondata):
+    return len(jsondata["name"]) + 1 + getSymPtrBytes(board) + getGeneratedFunctionBytes(jsondata)
+  if jsondata["type"] in ["class", "library"]:
+    return len(jsondata["class"]) + 1 + getSymListBytes(board)
+  return 0
+
+# Work out the flash used by what we output for each symbol table and each source file. Names
+# in jswSymbols_str are counted for the first table that uses them, as later ones share them.
+# Only the generated tables and functions are counted, not the native functions they call
+def getFlashReport(board, builtins, symbolChars, symbolOffsets, jsondatas, moduleBytes):
+  pointerBytes = getPointerBytes(board)
+  symPtrBytes = getSymPtrBytes(board)
+  symListBytes = getSymListBytes(board)
+  tables = OrderedDict()
+  files = {}
+  total = dict([(f, 0) for f in FLASH_REPORT_FIELDS])
+  # add to a table and/or file, and the total
+  def addBytes(entries, field, n):
+    for entry in entries:
+      entry[field] = entry.get(field, 0) + n
+      entry["total"] = entry.get("total", 0) + n
+    total[field] += n
+  def getFile(filename):
+    if not filename in files: files[filename] = { "symbols" : 0 }
+    return files[filename]
+  # a name only uses bytes in jswSymbols_str if it isn't the end of another name
+  def takeNameBytes(name):
+    offset = symbolOffsets.pop(name, None)
+    if offset is None or (offset>0 and symbolChars[offset-1]!="\0"): return 0
+    return len(name) + 1
+  symbolOffsets = dict(symbolOffsets) # we remove names as they're counted
+  for b in builtins:
+    builtin = builtins[b]
+    table = { "symbols" : len(builtin["symbols"]) }
+    tables[builtin["name"]] = table
+    addBytes([table], "symbolLists", symListBytes)
+    if "lookupBytes" in builtin: addBytes([table], "lookupTables", builtin["lookupBytes"])
+    for sym in builtin["symbols"]:
+      file = getFile(sym["filename"])
+      file["symbols"] += 1
+      addBytes([table, file], "symbolStrings", takeNameBytes(sym["name"]))
+      addBytes([table, file], "symbolPtrs", symPtrBytes)
+  # class, library and module names that jswFindName searches for
+  for jsondata in jsondatas:
+    if "class" in jsondata and jsondata["class"] in symbolOffsets:
+      addBytes([getFile(jsondata["filename"])], "symbolStrings", takeNameBytes(jsondata["class"]))
+    if "generatedBytes" in jsondata:
+      addBytes([getFile(jsondata["filename"])], "wrapperFunctions", jsondata["generatedBytes"])
+  modules = {}
+  for modulename in sorted(moduleBytes.keys()):
+    modules[modulename] = moduleBytes[modulename]
+    file = getFile(jsmoduleFiles[modulename])
+    addBytes([file], "symbolStrings", takeNameBytes(modulename))
+    addBytes([file], "jsModules", moduleBytes[modulename])
+  for name in sorted(symbolOffsets.keys()):
+    addBytes([getFile("jswrapper.c")], "symbolStrings", takeNameBytes(name))
+  total["symbolStrings"] += 1 # the string's own terminator
+  total["total"] = sum([total[f] for f in FLASH_REPORT_FIELDS])
+  report = OrderedDict()
+  report["board"] = board.__name__
+  report["pointerBytes"] = pointerBytes
+  report["wrapperFunctionBytes"] = WRAPPER_FUNCTION_BYTES # estimated size of each generated function
+  report["flashTotal"] = board.chip["flash"]*1024
+  if "saved_code" in board.chip and "flash_available" in board.chip["saved_code"]:
+    report["flashAvailableForCode"] = board.chip["saved_code"]["flash_available"]*1024
+  report["total"] = total
+  report["tables"] = tables
+  report["files"] = OrderedDict(sorted(files.items(), key=lambda f: (-f[1]["total"], f[0])))
+  report["jsModules"] = modules
+  return report
+
+def formatBytes(n):
+  return ("+" if n>0 else "")+str(n)
+
+# Print the changes in an entry of a flash report, eg. '+24 (+1 symbols, +16 symbolPtrs, +8 symbolStrings)'
+def getFlashReportChange(old, new):
+  changes = []
+  for field in ["symbols"]+FLASH_REPORT_FIELDS:
+    delta = new.get(field, 0) - old.get(field, 0)
+    if delta: changes.append(formatBytes(delta)+" "+field)
+  return formatBytes(new.get("total", 0) - old.get("total", 0))+" ("+", ".join(changes)+")"
+
+# Write the flash report as JSON, and print how it has changed since the last one
+def writeFlashReport(filename, baseFilename, report):
+  baseFilename = baseFilename or filename
+  base = None
+  if os.path.isfile(baseFilename):
+    try:
+      base = json.load(open(baseFilename))
+    except ValueError:
+      print("WARNING: Unable to read flash report "+baseFilename)
+  json.dump(report, open(filename, "w"), indent=1)
+  total = report["total"]["total"]
+  print("Flash used by the wrapper: "+str(total)+" bytes ("+", ".join([str(report["total"][f])+" "+f for f in FLASH_REPORT_FIELDS])+"), written to "+filename)
+  if "flashAvailableForCode" in report:
+    print("  "+str(100*total//report["flashAvailableForCode"])+"% of the "+str(report["flashAvailableForCode"])+" bytes available for code")
+  if not base:
+    for name in list(report["files"].keys())[:10]:
+      print("  %6d %s" % (report["files"][name]["total"], name))
+    return
+  print("Changes since "+baseFilename+": "+formatBytes(total - base["total"]["total"])+" bytes")
+  for section in ["files", "tables"]:
+    old = base.get(section, {})
+    new = report[section]
+    names = sorted(set(list(old.keys())+list(new.keys())), key=lambda n: (-abs(new.get(n,{}).get("total",0)-old.get(n,{}).get("total",0)), n))
+    for name in names:
+      if old.get(name)!=new.get(name):
+        status = " (new)" if not name in old else " (removed)" if not name in new else ""
+        print("  "+section[:-1]+" "+name+status+": "+getFlashReportChange(old.get(name, {}), new.get(name, {})))
+
 #================== to remove JS-definitions given by blacklist==============
-def delete_by_indices(lst, indices):
-    indices_as_set = set(indices)
-    return [ lst[i] for i in range(len(lst)) if i not in indices_as_set ]
-
-def removeBlacklistForWrapper(blacklistfile,datas):
-	json_File = open(blacklistfile,'r')
-	blacklist = json.load(json_File)
-	toremove = []
-	for idx,jsondata in enumerate(datas):
-		if "class" in jsondata:
-			if "name" in jsondata:
-				for black in blacklist:
-					if jsondata["class"] == black["class"]:
-						if(jsondata["name"] == black["name"] or black["name"] == "*"):
-							toremove.append(idx)
-							print("Removing "+black["class"]+"."+black["name"]+" due to blacklist wildcard")
-# extension by jumjum
-		else:
-			if "name" in jsondata:
-				for black in blacklist:
-					if black["class"] == "__":
-						if jsondata["name"] == black["name"]:
-						  toremove.append(idx)
-						  print("Removing global."+black["name"]+" due to blacklist wildcard")
-		if "type" in jsondata:
-			if "class" in jsondata:
-				for black in blacklist:
-					if jsondata["class"] == black["class"]:
-						if black["name"] == "*":
-						  toremove.append(idx)
-						  print("Removing "+black["class"]+" due to blacklist wildcard")
-			if "instanceof" in jsondata:
-				for black in blacklist:
-					if jsondata["instanceof"] == black["class"]:
-						if black["name"] == "*":
-						  toremove.append(idx)
-						  print("Removing "+black["class"]+" due to blacklist wildcard")
-    
-#  end extension by jumjum
-	return delete_by_indices( datas, toremove)
-# ------------------------------------------------------------------------------------------------------
-# ------------------------------------------------------------------------------------------------------
+# The blacklist is a JSON list of {"class":..., "name":...}. A name of "*" removes everything in
+# the class (including instances of it, eg. LED1 for Pin) and a class of "__" removes a global.
+# Returns the rule that removes jsondata, or None
+def getBlacklistRule(jsondata, wildcardClasses, classNames, globalNames):
+  if "class" in jsondata:
+    if jsondata["class"] in wildcardClasses:
+      if "name" in jsondata or "type" in jsondata:
+        return jsondata["class"]+".*"
+    elif "name" in jsondata and (jsondata["class"], jsondata["name"]) in classNames:
+      return jsondata["class"]+"."+jsondata["name"]
+  elif "name" in jsondata and jsondata["name"] in globalNames:
+    return "__."+jsondata["name"]
+  if "type" in jsondata and "instanceof" in jsondata and jsondata["instanceof"] in wildcardClasses:
+    return jsondata["instanceof"]+".*"
+  return None
+
+def getJsondataName(jsondata):
+  if "name" in jsondata:
+    return (jsondata["class"]+"." if "class" in jsondata else "")+jsondata["name"]
+  return jsondata.get("class", jsondata["type"])
+
+# Remove everything matched by the blacklist file from datas
+def removeBlacklistForWrapper(blacklistfile, datas, board=None, explain=False):
+  return removeBlacklist(json.load(open(blacklistfile,'r')), "Blacklist "+blacklistfile, datas, board, explain)
+
+# Remove everything matched by a list of blacklist rules from datas. With 'explain', show which
+# rule removed what, any rules that matched nothing, and roughly how much flash that saved
+def removeBlacklist(blacklist, description, datas, board=None, explain=False):
+  wildcardClasses = set([black["class"] for black in blacklist if black["name"]=="*"])
+  classNames = set([(black["class"], black["name"]) for black in blacklist])
+  globalNames = set([black["name"] for black in blacklist if black["class"]=="__"])
+  removed = OrderedDict([(black["class"]+"."+black["name"], []) for black in blacklist]) # rule -> jsondatas
+  result = []
+  for jsondata in datas:
+    rule = getBlacklistRule(jsondata, wildcardClasses, classNames, globalNames)
+    if rule:
+      removed[rule].append(jsondata)
+      if not explain: print("Removing "+getJsondataName(jsondata)+" due to blacklist ("+rule+")")
+    else:
+      result.append(jsondata)
+  print(description+": removed "+str(len(datas)-len(result))+" of "+str(len(datas))+" entries with "+str(len(blacklist))+" rules")
+  if explain:
+    totalBytes = 0
+    for rule in removed:
+      if not removed[rule]:
+        print("  "+rule+": WARNING: didn't match anything")
+        continue
+      ruleBytes = sum([getJsondataFlashBytes(board, jsondata) for jsondata in removed[rule]]) if board else 0
+      totalBytes += ruleBytes
+      names = [getJsondataName(jsondata) for jsondata in removed[rule]]
+      print("  "+(rule+": " if names!=[rule] else "")+", ".join(names)+(" (about "+str(ruleBytes)+" bytes)" if board else ""))
+    if board:
+      print(description+": reclaimed about "+str(totalBytes)+" bytes of flash in the wrapper's tables and functions (not counting the native functions)")
+  return result
+
+#================== removing symbols that apps don't use ==============
+# Any identifier in an app (or in a string, or even a comment) might be the name of a
+# built-in symbol it uses, so we keep every symbol with that name
+JS_IDENTIFIER = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*")
+# Names the interpreter itself might look up, eg. jspGetNamedField(var, "toString"). Comments
+# are matched too so we can skip them, as the JSON in wrapper files has the name of every symbol
+C_STRING_OR_COMMENT = re.compile(r'"((?:\\.|[^"\\\n])*)"|\'(?:\\.|[^\'\\\n])*\'|/\*.*?\*/|//[^\n]*', re.DOTALL)
+# Code that can make up the names it uses, so we can't tell what they are
+JS_DYNAMIC_CODE = re.compile(r"\beval\s*\(|\bFunction\s*\(")
+
+# Get the identifiers in all the .js files in appDir (and its subdirectories), and the
+# files that use eval or Function
+def getAppIdentifiers(appDir):
+  names = set()
+  files = []
+  dynamicFiles = []
+  for root, dirs, filenames in os.walk(appDir):
+    for filename in sorted(filenames):
+      if not filename.endswith(".js"): continue
+      path = os.path.join(root, filename)
+      code = open(path, "rb").read().decode("utf-8", "replace")
+      files.append(path)
+      names.update(JS_IDENTIFIER.findall(code))
+      if JS_DYNAMIC_CODE.search(code): dynamicFiles.append(path)
+  return names, files, dynamicFiles
+
+# Remove the symbols whose names aren't used by any of the JS apps in appDir, by building
+# a blacklist for them. This is conservative: any use of a name at all (eg. 'read' for
+# Storage.read, or a string "read") keeps every symbol called that, nothing is removed if
+# any app uses eval or Function, and constructors are always kept. Names in built-in JS
+# modules, generate_js code and string constants in C files are kept too
+def removeUnusedSymbols(appDir, datas, board, explain):
+  names, files, dynamicFiles = getAppIdentifiers(appDir)
+  if not files:
+    print("WARNING: No .js files in "+appDir+", so no unused symbols were removed")
+    return datas
+  if dynamicFiles:
+    print("WARNING: "+", ".join(dynamicFiles)+" use eval or Function, so no unused symbols were removed")
+    return datas
+  for js in jsmodules.values():
+    names.update(JS_IDENTIFIER.findall(js))
+  cFiles = set([os.path.join(basedir, "src", f) for f in os.listdir(os.path.join(basedir, "src")) if f.endswith(".c")])
+  for jsondata in datas:
+    if "generate_js" in jsondata:
+      names.update(JS_IDENTIFIER.findall(open(basedir+jsondata["generate_js"]).read()))
+    if jsondata["filename"].endswith(".c"):
+      cFiles.add(os.path.join(basedir, jsondata["filename"]))
+  for cFile in sorted(cFiles):
+    if os.path.isfile(cFile):
+      for match in C_STRING_OR_COMMENT.finditer(open(cFile, "rb").read().decode("utf-8", "replace")):
+        if match.group(1) and JS_IDENTIFIER.findall(match.group(1))==[match.group(1)]:
+          names.add(match.group(1))
+  blacklist = []
+  for jsondata in datas:
+    if isBuiltinSymbol(jsondata) and jsondata["type"]!="constructor" and not jsondata["name"] in names:
+      black = { "class" : jsondata.get("class", "__"), "name" : jsondata["name"] }
+      if not black in blacklist: blacklist.append(black)
+  return removeBlacklist(blacklist, "Symbols not used by the "+str(len(files))+" apps in "+appDir, datas, board, explain)
 # ------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------
-
-print("BOARD "+boardName)
-board = importlib.import_module(boardName)
-
-jsondatas = common.get_jsondata(is_for_document = False, parseArgs = True, boardObject = board)
-if 'BLACKLIST' in os.environ:
-	jsondatas = removeBlacklistForWrapper(os.environ['BLACKLIST'],jsondatas)
-
-includes = common.get_includes_from_jsondata(jsondatas)
-
-# work out what we have actually got
-classes = []
-constructors = []
-for jsondata in jsondatas:
-  if "class" in jsondata :
-    if not jsondata["class"] in classes:
-      classes.append(jsondata["class"])
-  if jsondata["type"]=="constructor":
-    if not jsondata["name"] in constructors:
-      constructors.append(jsondata["name"])
-    if not "return" in jsondata:
-      FATAL_ERROR("Constructors MUST return something: "+jsondata["name"]+":"+jsondata["filename"]+"\n");
-
-# Add constructors if we need them
-for className in classes:
-  if not className in constructors:
-    jsondatas.append({
-        "type":"constructor", "class": className,  "name": className,
-        "generate_full" : "NULL", # return undefined means 'new X' uses the object that was returned, which is correct
-        "filename" : "jswrapper.c",
-        "return" : [ "JsVar", "" ]
-    });
-
 # ------------------------------------------------------------------------------------------------------
-#print json.dumps(tree, sort_keys=True, indent=2)
 # ------------------------------------------------------------------------------------------------------
 
-wrapperFile = open(wrapperFileName,'w')
-
-codeOut('// Automatically generated wrapper file ')
-codeOut('// Generated by scripts/build_jswrapper.py');
-codeOut('');
-codeOut('#include "jswrapper.h"');
-codeOut('#include "jsnative.h"');
-for include in includes:
-  codeOut('#include "'+include+'"');
-codeOut('');
-codeOut('');
-
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('// ----------------------------------------------------------------- AUTO-GENERATED WRAPPERS');
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('');
-
-for jsondata in jsondatas:
-  # Include 'inline' C declarations
-  if ("generate_full" in jsondata) or (jsondata["type"]=="object"):
-    gen_name = "gen_jswrap"  
-    if "class" in jsondata: gen_name = gen_name + "_" + jsondata["class"];
-    gen_name = gen_name + "_" + jsondata["name"];
-    jsondata["generate"] = gen_name
-
-    s = [ ]
-    if jsondata["type"]=="object":
-      jsondata["generate_full"] = "jspNewObject(\""+jsondata["name"]+"\", \""+jsondata["instanceof"]+"\") /* needs JSWAT_EXECUTE_IMMEDIATELY */";
-      params = []
-      result = ["JsVar"]
-    else:
+# Output a wrapper file for the given board's (filtered) jsondata
+def buildWrapper(board, jsondatas, wrapperFileName, symbolHash, symbolTrie, compressModules, symbolProfile, hotSymbols, flashReport, flashReportBase):
+  global jsondataIndex, libraries, wrapperFile
+  includes = common.get_includes_from_jsondata(jsondatas)
+
+  # work out what we have actually got
+  classes = []
+  constructors = []
+  for jsondata in jsondatas:
+    if "class" in jsondata :
+      if not jsondata["class"] in classes:
+        classes.append(jsondata["class"])
+    if jsondata["type"]=="constructor":
+      if not jsondata["name"] in constructors:
+        constructors.append(jsondata["name"])
+      if not "return" in jsondata:
+        FATAL_ERROR("Constructors MUST return something: "+jsondata["name"]+":"+jsondata["filename"]+"\n");
+
+  # Add constructors if we need them
+  for className in classes:
+    if not className in constructors:
+      jsondatas.append({
+          "type":"constructor", "class": className,  "name": className,
+          "generate_full" : "NULL", # return undefined means 'new X' uses the object that was returned, which is correct
+          "filename" : "jswrapper.c",
+          "return" : [ "JsVar", "" ]
+      });
+
+  # Index so we can quickly look up constructors/etc by type+class+name
+  jsondataIndex = common.get_jsondata_index(jsondatas)
+
+  # ------------------------------------------------------------------------------------------------------
+  #print json.dumps(tree, sort_keys=True, indent=2)
+  # ------------------------------------------------------------------------------------------------------
+
+  wrapperFile = open(wrapperFileName,'w')
+
+  codeOut('// Automatically generated wrapper file ')
+  codeOut('// Generated by scripts/build_jswrapper.py');
+  codeOut('');
+  codeOut('#include "jswrapper.h"');
+  codeOut('#include "jsnative.h"');
+  for include in includes:
+    codeOut('#include "'+include+'"');
+  codeOut('');
+  codeOut('');
+
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('// ----------------------------------------------------------------- AUTO-GENERATED WRAPPERS');
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('');
+
+  for jsondata in jsondatas:
+    # Include 'inline' C declarations
+    if ("generate_full" in jsondata) or (jsondata["type"]=="object"):
+      gen_name = "gen_jswrap"  
+      if "class" in jsondata: gen_name = gen_name + "_" + jsondata["class"];
+      gen_name = gen_name + "_" + jsondata["name"];
+      jsondata["generate"] = gen_name
+
+      s = [ ]
+      if jsondata["type"]=="object":
+        jsondata["generate_full"] = "jspNewObject(\""+jsondata["name"]+"\", \""+jsondata["instanceof"]+"\") /* needs JSWAT_EXECUTE_IMMEDIATELY */";
+        params = []
+        result = ["JsVar"]
+      else:
+        params = getParams(jsondata)
+        result = getResult(jsondata);
+        if hasThis(jsondata): s.append("JsVar *parent");
+        for param in params:
+          s.append(toCType(param[1])+" "+param[0]);
+
+      jsondata["generatedBytes"] = getGeneratedFunctionBytes(jsondata)
+      codeOut("static "+toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {");
+      if result[0]:
+        codeOut("  return "+jsondata["generate_full"]+";");
+      else:
+        codeOut("  "+jsondata["generate_full"]+";");
+      codeOut("}");
+      codeOut('');
+    # Include JavaScript functions
+    if ("generate_js" in jsondata):
+      gen_name = "gen_jswrap"  
+      if "class" in jsondata: gen_name = gen_name + "_" + jsondata["class"];
+      gen_name = gen_name + "_" + jsondata["name"];
+      jsondata["generate"] = gen_name
+      
+      s = [ ]
       params = getParams(jsondata)
-      result = getResult(jsondata);
-      if hasThis(jsondata): s.append("JsVar *parent");
-      for param in params:
-        s.append(toCType(param[1])+" "+param[0]);
-
-    codeOut("static "+toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {");
-    if result[0]:
-      codeOut("  return "+jsondata["generate_full"]+";");
-    else:
-      codeOut("  "+jsondata["generate_full"]+";");
-    codeOut("}");
-    codeOut('');
-  # Include JavaScript functions
-  if ("generate_js" in jsondata):
-    gen_name = "gen_jswrap"  
-    if "class" in jsondata: gen_name = gen_name + "_" + jsondata["class"];
-    gen_name = gen_name + "_" + jsondata["name"];
-    jsondata["generate"] = gen_name
-    
-    s = [ ]
-    params = getParams(jsondata)
-    result = getResult(jsondata)
-    if hasThis(jsondata): s.append("JsVar *parent")
-    for param in params:
-      if param[1]!="JsVar": FATAL_ERROR("All arguments to generate_js must be JsVars");
-      s.append(toCType(param[1])+" "+param[0]);   
-
-    js = "";
-    with open(basedir+jsondata["generate_js"], 'r') as file:
-      js = file.read().strip()
-    statement = "jspExecuteJSFunction("+json.dumps(js)
-    if hasThis(jsondata): statement = statement + ", parent"
-    else: statement = statement + ", NULL"
-
-    codeOut("static "+toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {")
-    if len(params):
-      codeOut("  JsVar *args[] = {");
+      result = getResult(jsondata)
+      if hasThis(jsondata): s.append("JsVar *parent")
       for param in params:
-        codeOut("    "+param[0]+",")
-      codeOut("  };")
-      statement = statement + ","+str(len(params))+", args)"
-    else: # no args
-      statement = statement + ",0,NULL)"
-
-    if result[0]:
-      if result[0]!="JsVar": FATAL_ERROR("All arguments to generate_js must be JsVars");
-      codeOut("  return "+statement+";")
-    else:
-      codeOut("  jsvUnLock("+statement+");")
-    codeOut("}");
-    codeOut('');
+        if param[1]!="JsVar": FATAL_ERROR("All arguments to generate_js must be JsVars");
+        s.append(toCType(param[1])+" "+param[0]);   
+
+      js = "";
+      with open(basedir+jsondata["generate_js"], 'r') as file:
+        js = file.read().strip()
+      jsondata["generatedBytes"] = getGeneratedFunctionBytes(jsondata)
+      statement = "jspExecuteJSFunction("+toCString(js)
+      if hasThis(jsondata): statement = statement + ", parent"
+      else: statement = statement + ", NULL"
+
+      codeOut("static "+toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {")
+      if len(params):
+        codeOut("  JsVar *args[] = {");
+        for param in params:
+          codeOut("    "+param[0]+",")
+        codeOut("  };")
+        statement = statement + ","+str(len(params))+", args)"
+      else: # no args
+        statement = statement + ",0,NULL)"
+
+      if result[0]:
+        if result[0]!="JsVar": FATAL_ERROR("All arguments to generate_js must be JsVars");
+        codeOut("  return "+statement+";")
+      else:
+        codeOut("  jsvUnLock("+statement+");")
+      codeOut("}");
+      codeOut('');
+
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('');
+
+  codeOut("""
+// Build with JSWRAPPER_COUNT_COMPARISONS on Linux to count the comparisons made when looking up
+// built-in symbols (checks on the type of 'parent', constructor pointers and string compares).
+// If the JSWRAPPER_PROFILE environment variable is set, the counts for each symbol table are
+// written to the file it names on exit - see scripts/jswrapper_profile.py
+#if defined(LINUX) && defined(JSWRAPPER_COUNT_COMPARISONS)
+#include <stdio.h>
+extern const JswSymList jswSymbolTables[];
+extern const char *const jswSymbolTableNames[];
+extern const unsigned char jswSymbolTableCount;
+static unsigned int jswLookupCount, jswLookupComparisons, jswLookupMisses;
+static unsigned int jswTableSearches[256], jswTableHits[256], jswTableComparisons[256];
+static unsigned int *jswSymbolHits[256]; // hits for each symbol, allocated when a table first has a hit
+static void jswCountHit(const JswSymList *symbolsPtr, const JswSymPtr *sym) {
+  int table = (int)(symbolsPtr - jswSymbolTables);
+  jswTableHits[table]++;
+  if (!jswSymbolHits[table]) jswSymbolHits[table] = calloc(256, sizeof(unsigned int));
+  if (jswSymbolHits[table]) jswSymbolHits[table][sym - symbolsPtr->symbols]++;
+}
+static void jswPrintComparisons() {
+  fprintf(stderr, "jswrapper: %u lookups, %u misses, %u comparisons (%.2f per lookup)\\n",
+          jswLookupCount, jswLookupMisses, jswLookupComparisons, (double)jswLookupComparisons / jswLookupCount);
+  const char *filename = getenv("JSWRAPPER_PROFILE");
+  if (!filename) return;
+  FILE *f = fopen(filename, "w");
+  if (!f) return;
+  fprintf(f, "lookups %u %u %u\\n", jswLookupCount, jswLookupMisses, jswLookupComparisons);
+  for (int i=0;i<jswSymbolTableCount;i++)
+    fprintf(f, "table %s %u %u %u %u\\n", jswSymbolTableNames[i], jswSymbolTables[i].symbolCount,
+            jswTableSearches[i], jswTableHits[i], jswTableComparisons[i]);
+  for (int i=0;i<jswSymbolTableCount;i++)
+    for (int j=0;jswSymbolHits[i] && j<jswSymbolTables[i].symbolCount;j++)
+      if (jswSymbolHits[i][j])
+        fprintf(f, "symbol %s %s %u\\n", jswSymbolTableNames[i],
+                &jswSymbolTables[i].symbolChars[jswSymbolTables[i].symbols[j].strOffset], jswSymbolHits[i][j]);
+  fclose(f);
+}
+#define JSW_COUNT_LOOKUP() { if (!jswLookupCount++) atexit(jswPrintComparisons); }
+#define JSW_COUNT_MISS() jswLookupMisses++
+#define JSW_COUNT_SEARCH(LIST) jswTableSearches[(LIST)-jswSymbolTables]++
+#define JSW_COUNT_HIT(LIST, SYM) jswCountHit(LIST, SYM)
+#define JSW_COMPARE(X) (jswLookupComparisons++, (X))
+#define JSW_COMPARE_SYMBOL(LIST, X) (jswTableComparisons[(LIST)-jswSymbolTables]++, JSW_COMPARE(X))
+#else
+#define JSW_COUNT_LOOKUP()
+#define JSW_COUNT_MISS()
+#define JSW_COUNT_SEARCH(LIST)
+#define JSW_COUNT_HIT(LIST, SYM)
+#define JSW_COMPARE(X) (X)
+#define JSW_COMPARE_SYMBOL(LIST, X) (X)
+#endif
+""");
 
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('');
+  if symbolHash:
+    codeOut("""
+// Perfect hashes for some symbol tables (see codeOutSymbolHashes in build_jswrapper.py)
+typedef struct {
+  const unsigned char *buckets; // displacement for each bucket
+  const unsigned char *slots; // index in the symbol table for each slot
+  unsigned char bucketCount;
+} JswSymHash;
+extern const JswSymList jswSymbolTables[];
+extern const JswSymHash *const jswSymbolHashes[];
+
+static uint32_t jswHashSymbol(const char *name) {
+  uint32_t h = 2166136261u; // FNV-1a
+  while (*name) h = (h ^ (unsigned char)*(name++)) * 16777619u;
+  return h;
+}
 
-codeOut("""
-// Binary search coded to allow for JswSyms to be in flash on the esp8266 where they require
-// word accesses
-JsVar *jswBinarySearch(const JswSymList *symbolsPtr, JsVar *parent, const char *name) {
+static uint32_t jswHashMix(uint32_t h, uint32_t displacement) {
+  h ^= displacement * 0x9E3779B9u;
+  h ^= h >> 15;
+  h *= 0x2C1B3C6Du;
+  h ^= h >> 12;
+  return h;
+}
+""");
+  if symbolTrie:
+    codeOut("""
+// Functions that find the index of a symbol in some symbol tables with a tree of character
+// comparisons (see codeOutSymbolTries in build_jswrapper.py), or return -1
+typedef int (*JswSymTrie)(const char *name);
+extern const JswSymList jswSymbolTables[];
+extern const JswSymTrie jswSymbolTries[];
+""");
+  if symbolProfile:
+    codeOut("""
+// The most used symbols in some symbol tables, checked before the binary search (see
+// codeOutSymbolHotLists in build_jswrapper.py). Each list of indices ends with 255
+extern const JswSymList jswSymbolTables[];
+extern const unsigned char *const jswSymbolHotLists[];
+""");
+  codeOut("""
+static JsVar *jswGetSymbolVar(const JswSymPtr *sym, JsVar *parent) {
+  unsigned short functionSpec = READ_FLASH_UINT16(&sym->functionSpec);
+  if ((functionSpec & JSWAT_EXECUTE_IMMEDIATELY_MASK) == JSWAT_EXECUTE_IMMEDIATELY)
+    return jsnCallFunction(sym->functionPtr, functionSpec, parent, 0, 0);
+  return jsvNewNativeFunction(sym->functionPtr, functionSpec);
+}
+""");
+  if symbolHash or symbolTrie:
+    codeOut("// Look up a symbol using the table's "+" or ".join((["trie"] if symbolTrie else [])+(["perfect hash"] if symbolHash else []))+" if it has one, or binary search if not.")
+    codeOut("// Coded to allow for JswSyms to be in flash on the esp8266 where they require word accesses")
+  else:
+    codeOut("// Binary search coded to allow for JswSyms to be in flash on the esp8266 where they require")
+    codeOut("// word accesses")
+  codeOut("""JsVar *jswBinarySearch(const JswSymList *symbolsPtr, JsVar *parent, const char *name) {
   uint8_t symbolCount = READ_FLASH_UINT8(&symbolsPtr->symbolCount);
-  int searchMin = 0;
+  JSW_COUNT_SEARCH(symbolsPtr);""");
+  if symbolTrie:
+    codeOut("""  JswSymTrie trie = jswSymbolTries[symbolsPtr - jswSymbolTables];
+  if (trie) {
+    int idx = trie(name);
+    if (idx<0) return 0;
+    const JswSymPtr *sym = &symbolsPtr->symbols[idx];
+    JSW_COUNT_HIT(symbolsPtr, sym);
+    return jswGetSymbolVar(sym, parent);
+  }""");
+  if symbolHash:
+    codeOut("""  const JswSymHash *hash = jswSymbolHashes[symbolsPtr - jswSymbolTables];
+  if (hash) {
+    uint32_t h = jswHashSymbol(name);
+    uint8_t bucket = READ_FLASH_UINT8(&hash->buckets[h % READ_FLASH_UINT8(&hash->bucketCount)]);
+    uint8_t idx = READ_FLASH_UINT8(&hash->slots[jswHashMix(h, bucket) % symbolCount]);
+    const JswSymPtr *sym = &symbolsPtr->symbols[idx];
+    unsigned short strOffset = READ_FLASH_UINT16(&sym->strOffset);
+    if (JSW_COMPARE_SYMBOL(symbolsPtr, FLASH_STRCMP(name, &symbolsPtr->symbolChars[strOffset]))==0) {
+      JSW_COUNT_HIT(symbolsPtr, sym);
+      return jswGetSymbolVar(sym, parent);
+    }
+    return 0;
+  }""");
+  if symbolProfile:
+    codeOut("""  const unsigned char *hot = jswSymbolHotLists[symbolsPtr - jswSymbolTables];
+  if (hot) {
+    uint8_t idx;
+    while ((idx = READ_FLASH_UINT8(hot++)) != 255) {
+      const JswSymPtr *sym = &symbolsPtr->symbols[idx];
+      unsigned short strOffset = READ_FLASH_UINT16(&sym->strOffset);
+      if (JSW_COMPARE_SYMBOL(symbolsPtr, FLASH_STRCMP(name, &symbolsPtr->symbolChars[strOffset]))==0) {
+        JSW_COUNT_HIT(symbolsPtr, sym);
+        return jswGetSymbolVar(sym, parent);
+      }
+    }
+  }""");
+  codeOut("""  int searchMin = 0;
   int searchMax = symbolCount - 1;
   while (searchMin <= searchMax) {
     int idx = (searchMin+searchMax) >> 1;
     const JswSymPtr *sym = &symbolsPtr->symbols[idx];
     unsigned short strOffset = READ_FLASH_UINT16(&sym->strOffset);
-    int cmp = FLASH_STRCMP(name, &symbolsPtr->symbolChars[strOffset]);
+    int cmp = JSW_COMPARE_SYMBOL(symbolsPtr, FLASH_STRCMP(name, &symbolsPtr->symbolChars[strOffset]));
     if (cmp==0) {
-      unsigned short functionSpec = READ_FLASH_UINT16(&sym->functionSpec);
-      if ((functionSpec & JSWAT_EXECUTE_IMMEDIATELY_MASK) == JSWAT_EXECUTE_IMMEDIATELY)
-        return jsnCallFunction(sym->functionPtr, functionSpec, parent, 0, 0);
-      return jsvNewNativeFunction(sym->functionPtr, functionSpec);
+      JSW_COUNT_HIT(symbolsPtr, sym);
+      return jswGetSymbolVar(sym, parent);
     } else {
       if (cmp<0) {
         // searchMin is the same
@@ -415,372 +1281,657 @@ JsVar *jswBinarySearch(const JswSymList *symbolsPtr, JsVar *parent, const char *
   }
   return 0;
 }
-
 """);
 
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('');
-codeOut('');
-
-print("Finding Libraries")
-libraries = []
-for jsondata in jsondatas:
-  if jsondata["type"]=="library":
-    print("Found library "+jsondata["class"])
-    libraries.append(jsondata["class"])
-
-print("Classifying Functions")
-builtins = OrderedDict()
-for jsondata in jsondatas:
-  if "name" in jsondata:
-    jsondata["static"] = not (jsondata["type"]=="property" or jsondata["type"]=="method")
-
-    testCode = "!parent"
-    builtinName = "global"
-    className = "global"
-    isProto = False
-    if not jsondata["type"]=="constructor":
-      if "class" in jsondata:
-        testCode = getTestFor(jsondata["class"], jsondata["static"])
-        className = jsondata["class"]
-        builtinName = className
-        if not jsondata["static"]:
-          isProto = True
-          builtinName = builtinName+"_proto";
-
-    if not testCode in builtins:
-      print("Adding "+testCode+" to builtins")
-      builtins[testCode] = { "name" : builtinName, "className" : className, "isProto" : isProto, "functions" : [] }
-    builtins[testCode]["functions"].append(jsondata);
-
-# For the ESP8266 we want to put the structures into flash, we need a fresh section 'cause the
-# .irom.literal section used elsewhere has different readability attributes, sigh
-codeOut("#ifdef ESP8266\n#define FLASH_SECT __attribute__((section(\".irom.literal2\"))) __attribute__((aligned(4)))");
-codeOut("#else\n#define FLASH_SECT\n#endif\n");
-
-print("Outputting Symbol Tables")
-idx = 0
-for b in builtins:
-  builtin = builtins[b]
-  codeOutSymbolTable(builtin);
-  builtins[b]["indexName"] = "jswSymbolIndex_"+builtin["name"];
-  codeOut("static const unsigned char "+builtin["indexName"]+" = "+str(idx)+";");
-  idx = idx + 1
-codeOut('');
-codeOut('');
-
-# output the strings, possibly with __attribute__ to put them into flash
-for b in builtins:
-  builtin = builtins[b]
-  codeOut("FLASH_STR(jswSymbols_"+builtin["name"]+"_str, " + builtin["symbolTableChars"] +");");
-codeOut('');
-# output the symbol table array referencing the above strings
-codeOut('const JswSymList jswSymbolTables[] FLASH_SECT = {');
-for b in builtins:
-  builtin = builtins[b]
-  codeOut("  {"+", ".join(["jswSymbols_"+builtin["name"], "jswSymbols_"+builtin["name"]+"_str", builtin["symbolTableCount"]])+"},");
-codeOut('};');
-
-codeOut('');
-codeOut('');
-
-codeOut('const JswSymList *jswGetSymbolListForConstructorProto(JsVar *constructor) {')
-codeOut('  void *constructorPtr = constructor->varData.native.ptr;')
-for className in builtins:
-  builtin = builtins[className]
-  if builtin["isProto"] and "constructorPtr" in className:
-    codeOut("  if ("+className+") return &jswSymbolTables["+builtin["indexName"]+"];");
-codeOut('  return 0;')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-
-codeOut('JsVar *jswFindBuiltInFunction(JsVar *parent, const char *name) {')
-codeOut('  JsVar *v;')
-codeOut('  if (parent && !jsvIsRoot(parent)) {')
-
-codeOut('    // ------------------------------------------ INSTANCE + STATIC METHODS')
-nativeCheck = "jsvIsNativeFunction(parent) && "
-codeOut('    if (jsvIsNativeFunction(parent)) {')
-codeOut('      const JswSymList *l = jswGetSymbolListForObject(parent);')
-codeOut('      if (l) {');
-codeOut('        v = jswBinarySearch(l, parent, name);')
-codeOut('        if (v) return v;');
-codeOut('      }')
-codeOut('    }')
-for className in builtins:
-  if className!="parent" and  className!="!parent" and not "constructorPtr" in className and not className.startswith(nativeCheck):
-    codeOut('    if ('+className+') {')
-    codeOutBuiltins("      v = ", builtins[className])
-    codeOut('      if (v) return v;');
-    codeOut("    }")
-codeOut('    // ------------------------------------------ INSTANCE METHODS WE MUST CHECK CONSTRUCTOR FOR')
-codeOut('    JsVar *proto = jsvIsObject(parent)?jsvSkipNameAndUnLock(jsvFindChildFromString(parent, JSPARSE_INHERITS_VAR, false)):0;')
-codeOut('    JsVar *constructor = jsvIsObject(proto)?jsvSkipNameAndUnLock(jsvFindChildFromString(proto, JSPARSE_CONSTRUCTOR_VAR, false)):0;')
-codeOut('    jsvUnLock(proto);')
-codeOut('    if (constructor && jsvIsNativeFunction(constructor)) {')
-codeOut('      const JswSymList *l = jswGetSymbolListForConstructorProto(constructor);')
-codeOut('      jsvUnLock(constructor);')
-codeOut('      if (l) {');
-codeOut('        v = jswBinarySearch(l, parent, name);')
-codeOut('        if (v) return v;');
-codeOut('      }')
-codeOut('    } else {')
-codeOut('      jsvUnLock(constructor);')
-codeOut('    }')
-codeOut('    // ------------------------------------------ METHODS ON OBJECT')
-if "parent" in builtins:
-  codeOutBuiltins("    v = ", builtins["parent"])
-  codeOut('    if (v) return v;');
-codeOut('  } else { /* if (!parent) */')
-codeOut('    // ------------------------------------------ FUNCTIONS')
-codeOut('    // Handle pin names - eg LED1 or D5 (this is hardcoded in build_jsfunctions.py)')
-codeOut('    Pin pin = jshGetPinFromString(name);')
-codeOut('    if (pin != PIN_UNDEFINED) {')
-codeOut('      return jsvNewFromPin(pin);')
-codeOut('    }')
-if "!parent" in builtins:
-  codeOutBuiltins("    return ", builtins["!parent"])
-codeOut('  }');
-
-codeOut('  return 0;')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-codeOut('const JswSymList *jswGetSymbolListForObject(JsVar *parent) {')
-nativeTestStr = "jsvIsNativeFunction(parent) && ";
-codeOut("  if (jsvIsNativeFunction(parent)) {");
-for className in builtins:
-  builtin = builtins[className]
-  if not className in ["parent","!parent"] and not builtin["isProto"] and className.startswith(nativeTestStr):
-    codeOut("    if ("+className[len(nativeTestStr):]+") return &jswSymbolTables["+builtin["indexName"]+"];");
-codeOut("  }");
-for className in builtins:
-  builtin = builtins[className]
-  if not className in ["parent","!parent"] and not builtin["isProto"] and not className.startswith(nativeTestStr):
-    codeOut("  if ("+className+") return &jswSymbolTables["+builtin["indexName"]+"];");
-codeOut("  if (parent==execInfo.root) return &jswSymbolTables[jswSymbolIndex_global];");
-codeOut("  return 0;")
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-codeOut('const JswSymList *jswGetSymbolListForObjectProto(JsVar *parent) {')
-codeOut('  if (jsvIsNativeFunction(parent)) {')
-for className in builtins:
-  builtin = builtins[className]
-  if builtin["isProto"] and not "constructorPtr" in className and not className in ["parent","!parent"] :
-    check = className
-    for jsondata in jsondatas:
-      if jsondata["type"]=="constructor" and jsondata["name"]==builtin["className"]:
-        check = "(void*)parent->varData.native.ptr==(void*)"+jsondata["generate"]
-
-    codeOut("    if ("+check+") return &jswSymbolTables["+builtin["indexName"]+"];");
-codeOut('  }')
-codeOut('  JsVar *constructor = jsvIsObject(parent)?jsvSkipNameAndUnLock(jsvFindChildFromString(parent, JSPARSE_CONSTRUCTOR_VAR, false)):0;')
-codeOut('  if (constructor && jsvIsNativeFunction(constructor)) {')
-codeOut('    const JswSymList *l = jswGetSymbolListForConstructorProto(constructor);')
-codeOut('    jsvUnLock(constructor);')
-codeOut('    if (l) return l;')
-codeOut('  }')
-nativeCheck = "jsvIsNativeFunction(parent) && "
-for className in builtins:
-  if className!="parent" and  className!="!parent" and not "constructorPtr" in className and not className.startswith(nativeCheck):
-    codeOut('  if ('+className+") return &jswSymbolTables["+builtins[className]["indexName"]+"];");
-codeOut("  return &jswSymbolTables["+builtins["parent"]["indexName"]+"];")
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-builtinChecks = []
-for jsondata in jsondatas:
-  if "class" in jsondata:
-    check = 'strcmp(name, "'+jsondata["class"]+'")==0';
-    if not jsondata["class"] in libraries:
-      if not check in builtinChecks:
-        builtinChecks.append(check)
-
-
-codeOut('bool jswIsBuiltInObject(const char *name) {')
-codeOut('  return\n'+" ||\n    ".join(builtinChecks)+';')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-
-codeOut('void *jswGetBuiltInLibrary(const char *name) {')
-for lib in libraries:
-  codeOut('  if (strcmp(name, "'+lib+'")==0) return (void*)gen_jswrap_'+lib+'_'+lib+';');
-codeOut('  return 0;')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-objectChecks = {}
-for jsondata in jsondatas:
-  if "type" in jsondata and jsondata["type"]=="class":
-    if "check" in jsondata:
-      objectChecks[jsondata["class"]] = jsondata["check"]
-
-codeOut('/** Given a variable, return the basic object name of it */')
-codeOut('const char *jswGetBasicObjectName(JsVar *var) {')
-codeOut('  if (jsvIsArrayBuffer(var)) {')
-for className in objectChecks.keys():
-  if objectChecks[className].startswith("jsvIsArrayBuffer(var) && "):
-    codeOut("    if ("+objectChecks[className][25:]+") return \""+className+"\";")
-codeOut('  }')
-for className in objectChecks.keys():
-  if not objectChecks[className].startswith("jsvIsArrayBuffer(var) && "):
-    codeOut("  if ("+objectChecks[className]+") return \""+className+"\";")
-codeOut('  return 0;')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-
-codeOut("/** Given the name of a Basic Object, eg, Uint8Array, String, etc. Return the prototype object's name - or 0. */")
-codeOut('const char *jswGetBasicObjectPrototypeName(const char *objectName) {')
-for jsondata in jsondatas:
-  if "type" in jsondata and jsondata["type"]=="class":
-    if "prototype" in jsondata:
-      #print json.dumps(jsondata, sort_keys=True, indent=2)
-      codeOut("  if (!strcmp(objectName, \""+jsondata["class"]+"\")) return \""+jsondata["prototype"]+"\";")
-codeOut('  return strcmp(objectName,"Object") ? "Object" : 0;')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-codeOut("/** Tasks to run on Idle. Returns true if either one of the tasks returned true (eg. they're doing something and want to avoid sleeping) */")
-codeOut('bool jswIdle() {')
-codeOut('  bool wasBusy = false;')
-for jsondata in jsondatas:
-  if "type" in jsondata and jsondata["type"]=="idle":
-    codeOut("  if ("+jsondata["generate"]+"()) wasBusy = true;")
-codeOut('  return wasBusy;')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-codeOut("/** Tasks to run on Hardware Initialisation (called once at boot time, after jshInit, before jsvInit/etc) */")
-codeOut('void jswHWInit() {')
-for jsondata in jsondatas:
-  if "type" in jsondata and jsondata["type"]=="hwinit":
-    codeOut("  "+jsondata["generate"]+"();")
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-codeOut("/** Tasks to run on Initialisation (eg boot/load/reset/after save/etc) */")
-codeOut('void jswInit() {')
-for jsondata in jsondatas:
-  if "type" in jsondata and jsondata["type"]=="init":
-    codeOut("  "+jsondata["generate"]+"();")
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-codeOut("/** Tasks to run on Deinitialisation (eg before save/reset/etc) */")
-codeOut('void jswKill() {')
-for jsondata in jsondatas:
-  if "type" in jsondata and jsondata["type"]=="kill":
-    codeOut("  "+jsondata["generate"]+"();")
-codeOut('}')
-
-codeOut("/** Tasks to run when a character event is received */")
-codeOut('bool jswOnCharEvent(IOEventFlags channel, char charData) {')
-for jsondata in jsondatas:
-  if "type" in jsondata and jsondata["type"].startswith("EV_"):
-    codeOut("  if (channel=="+jsondata["type"]+") return "+jsondata["generate"]+"(charData);")
-codeOut('  return false;')
-codeOut('}')
-
-codeOut("/** If we have a built-in module with the given name, return the module's contents - or 0 */")
-codeOut('const char *jswGetBuiltInJSLibrary(const char *name) {')
-for modulename in jsmodules:
-  codeOut("  if (!strcmp(name,\""+modulename+"\")) return "+json.dumps(jsmodules[modulename])+";")
-codeOut('  return 0;')
-codeOut('}')
-
-codeOut('')
-codeOut('')
-
-codeOut('const char *jswGetBuiltInLibraryNames() {')
-librarynames = []
-for lib in libraries:
-  librarynames.append(lib);
-for lib in jsmodules:
-  librarynames.append(lib);
-codeOut('  return "'+','.join(librarynames)+'";')
-codeOut('}')
-
-codeOut('#ifdef USE_CALLFUNCTION_HACK')
-codeOut('// on Emscripten and i386 we cant easily hack around function calls with floats/etc, plus we have enough')
-codeOut('// resources, so just brute-force by handling every call pattern we use in a switch')
-codeOut('JsVar *jswCallFunctionHack(void *function, JsnArgumentType argumentSpecifier, JsVar *thisParam, JsVar **paramData, int paramCount) {')
-codeOut('  switch(argumentSpecifier) {')
-#for argSpec in argSpecs:
-#  codeOut('  case '+argSpec+":")
-argSpecs = []
-for jsondata in jsondatas:
-  if "generate" in jsondata:
-    argSpec = getArgumentSpecifier(jsondata)
-    if not argSpec in argSpecs:
-      argSpecs.append(argSpec)
-      params = getParams(jsondata)
-      result = getResult(jsondata);
-      pTypes = []
-      pValues = []
-      if hasThis(jsondata): 
-        pTypes.append("JsVar*")
-        pValues.append("thisParam")
-      cmd = "";
-      cmdstart = "";
-      cmdend = "";
-      n = 0
-      for param in params:
-        pTypes.append(toCType(param[1]));
-        if param[1]=="JsVarArray": 
-          cmdstart =  "      JsVar *argArray = (paramCount>"+str(n)+")?jsvNewArray(&paramData["+str(n)+"],paramCount-"+str(n)+"):jsvNewEmptyArray();\n";
-          pValues.append("argArray");
-          cmdend = "      jsvUnLock(argArray);\n\n";
-        else:
-          pValues.append(toCUnbox(param[1])+"((paramCount>"+str(n)+")?paramData["+str(n)+"]:0)");
-        n = n+1
-
-      codeOut("    case "+argSpec+": {");
-      codeOut("      JsVar *result = 0;");
-      if cmdstart:  codeOut(cmdstart); 
-      cmd = "(("+toCType(result[0])+"(*)("+",".join(pTypes)+"))function)("+",".join(pValues)+")";
-      if result[0]: codeOut("      result = "+toCBox(result[0])+"("+cmd+");");
-      else: codeOut("      "+cmd+";");
-      if cmdend:  codeOut(cmdend); 
-      codeOut("      return result;");
-      codeOut("    }");
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('// -----------------------------------------------------------------------------------------');
+  codeOut('');
+  codeOut('');
+
+  print("Finding Libraries")
+  libraries = []
+  for jsondata in jsondatas:
+    if jsondata["type"]=="library":
+      print("Found library "+jsondata["class"])
+      libraries.append(jsondata["class"])
+
+  print("Classifying Functions")
+  builtins = OrderedDict()
+  for jsondata in jsondatas:
+    if "name" in jsondata:
+      jsondata["static"] = not (jsondata["type"]=="property" or jsondata["type"]=="method")
+
+      testCode = "!parent"
+      builtinName = "global"
+      className = "global"
+      isProto = False
+      if not jsondata["type"]=="constructor":
+        if "class" in jsondata:
+          testCode = getTestFor(jsondata["class"], jsondata["static"])
+          className = jsondata["class"]
+          builtinName = className
+          if not jsondata["static"]:
+            isProto = True
+            builtinName = builtinName+"_proto";
+
+      if not testCode in builtins:
+        print("Adding "+testCode+" to builtins")
+        builtins[testCode] = { "name" : builtinName, "className" : className, "isProto" : isProto, "functions" : [] }
+      builtins[testCode]["functions"].append(jsondata);
+
+  # For the ESP8266 we want to put the structures into flash, we need a fresh section 'cause the
+  # .irom.literal section used elsewhere has different readability attributes, sigh
+  codeOut("#ifdef ESP8266\n#define FLASH_SECT __attribute__((section(\".irom.literal2\"))) __attribute__((aligned(4)))");
+  codeOut("#else\n#define FLASH_SECT\n#endif\n");
+
+  print("Outputting Symbol Tables")
+  for b in builtins:
+    getSymbolTableEntries(builtins[b])
+  # Names that jswIsBuiltInObject/jswGetBuiltInLibrary/etc search for
+  builtinObjectNames = []
+  prototypeNames = OrderedDict() # class name -> prototype name
+  for jsondata in jsondatas:
+    if "class" in jsondata:
+      if not jsondata["class"] in libraries and not jsondata["class"] in builtinObjectNames:
+        builtinObjectNames.append(jsondata["class"])
+    if "type" in jsondata and jsondata["type"]=="class" and "prototype" in jsondata:
+      if not jsondata["class"] in prototypeNames: # the first one is the one that would have been used
+        prototypeNames[jsondata["class"]] = jsondata["prototype"]
+  symbolChars, symbolOffsets = buildSymbolStrings(builtins, builtinObjectNames + libraries + list(prototypeNames.keys()) + list(jsmodules.keys()))
+  idx = 0
+  for b in builtins:
+    builtin = builtins[b]
+    codeOutSymbolTable(builtin, symbolOffsets);
+    builtins[b]["indexName"] = "jswSymbolIndex_"+builtin["name"];
+    codeOut("#define "+builtin["indexName"]+" "+str(idx));
+    idx = idx + 1
+  codeOut('');
+  codeOut('');
+
+  # output the strings, possibly with __attribute__ to put them into flash
+  codeOut("FLASH_STR(jswSymbols_str, \""+symbolChars.replace("\0","\\0")+"\");");
+  codeOut('');
+  codeOut("""// Binary search a sorted table of offsets of names in jswSymbols_str, return the index of 'name' or -1
+static int jswFindName(const unsigned short *names, int nameCount, const char *name) {
+  int searchMin = 0;
+  int searchMax = nameCount - 1;
+  while (searchMin <= searchMax) {
+    int idx = (searchMin+searchMax) >> 1;
+    int cmp = FLASH_STRCMP(name, &jswSymbols_str[READ_FLASH_UINT16(&names[idx])]);
+    if (cmp==0) return idx;
+    if (cmp<0) searchMax = idx-1;
+    else searchMin = idx+1;
+  }
+  return -1;
+}
+""")
+  # output the symbol table array referencing the above strings
+  codeOut('const JswSymList jswSymbolTables[] FLASH_SECT = {');
+  for b in builtins:
+    builtin = builtins[b]
+    codeOut("  {"+", ".join(["jswSymbols_"+builtin["name"], "jswSymbols_str", builtin["symbolTableCount"]])+"},");
+  codeOut('};');
+  codeOut('#if defined(LINUX) && defined(JSWRAPPER_COUNT_COMPARISONS)')
+  codeOut('const char *const jswSymbolTableNames[] = {'+", ".join(['"'+builtins[b]["name"]+'"' for b in builtins])+'};')
+  codeOut('const unsigned char jswSymbolTableCount = '+str(len(builtins))+';')
+  codeOut('#endif')
+  if symbolTrie:
+    codeOut('');
+    codeOutSymbolTries(builtins, symbolTrie);
+  if symbolHash:
+    codeOut('');
+    codeOutSymbolHashes(builtins, symbolHash);
+  if symbolProfile:
+    codeOut('');
+    codeOutSymbolHotLists(builtins, symbolProfile, hotSymbols);
+
+  codeOut('');
+  codeOut('');
+
+  print("Outputting Constructor Table")
+  constructorTable = OrderedDict()
+  nativeTestStr = "jsvIsNativeFunction(parent) && ";
+  otherObjectChecks = [] # checks that aren't just a constructor
+  otherConstructorProtoChecks = []
+  otherObjectProtoChecks = []
+  for className in builtins:
+    builtin = builtins[className]
+    if className in ["parent","!parent"]: continue
+    if not builtin["isProto"] and className.startswith(nativeTestStr):
+      if not addToConstructorTable(constructorTable, className, "symbols", builtin):
+        otherObjectChecks.append((className[len(nativeTestStr):], builtin))
+    if builtin["isProto"] and "constructorPtr" in className:
+      if not addToConstructorTable(constructorTable, className, "constructorProto", builtin):
+        otherConstructorProtoChecks.append((className, builtin))
+    if builtin["isProto"] and not "constructorPtr" in className:
+      check = className
+      constructor = common.find_jsondata(jsondataIndex, "constructor", builtin["className"], builtin["className"])
+      if constructor:
+        check = "(void*)parent->varData.native.ptr==(void*)"+constructor["generate"]
+      if not addToConstructorTable(constructorTable, check, "objectProto", builtin):
+        otherObjectProtoChecks.append((check, builtin))
+  codeOutConstructorTable(constructorTable)
+
+  codeOut('const JswSymList *jswGetSymbolListForConstructorProto(JsVar *constructor) {')
+  codeOut('  void *constructorPtr = constructor->varData.native.ptr;')
+  codeOut('  const JswConstructor *c = jswFindConstructor(constructorPtr);')
+  codeOut('  if (c) return jswGetConstructorSymbols(READ_FLASH_UINT8(&c->constructorProto));')
+  for check, builtin in otherConstructorProtoChecks:
+    codeOut("  if (JSW_COMPARE("+check+")) return &jswSymbolTables["+builtin["indexName"]+"];");
+  codeOut('  return 0;')
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+
+  codeOut('JsVar *jswFindBuiltInFunction(JsVar *parent, const char *name) {')
+  codeOut('  JsVar *v;')
+  codeOut('  JSW_COUNT_LOOKUP();')
+  codeOut('  if (parent && !jsvIsRoot(parent)) {')
+
+  codeOut('    // ------------------------------------------ INSTANCE + STATIC METHODS')
+  nativeCheck = "jsvIsNativeFunction(parent) && "
+  def codeOutFindMatch(indent, className):
+    codeOutBuiltins(indent+"v = ", builtins[className])
+    codeOut(indent+'if (v) return v;');
+  codeOutVarTypeSwitch("    ", [className for className in builtins if className!="parent" and  className!="!parent" and not "constructorPtr" in className and not className.startswith(nativeCheck)], codeOutFindMatch, False, {
+    "JSV_NATIVE_FUNCTION" : [
+      '{',
+      '  const JswSymList *l = jswGetSymbolListForObject(parent);',
+      '  if (l) {',
+      '    v = jswBinarySearch(l, parent, name);',
+      '    if (v) return v;',
+      '  }',
+      '}']})
+  codeOut('    // ------------------------------------------ INSTANCE METHODS WE MUST CHECK CONSTRUCTOR FOR')
+  codeOut('    JsVar *proto = jsvIsObject(parent)?jsvSkipNameAndUnLock(jsvFindChildFromString(parent, JSPARSE_INHERITS_VAR, false)):0;')
+  codeOut('    JsVar *constructor = jsvIsObject(proto)?jsvSkipNameAndUnLock(jsvFindChildFromString(proto, JSPARSE_CONSTRUCTOR_VAR, false)):0;')
+  codeOut('    jsvUnLock(proto);')
+  codeOut('    if (constructor && jsvIsNativeFunction(constructor)) {')
+  codeOut('      const JswSymList *l = jswGetSymbolListForConstructorProto(constructor);')
+  codeOut('      jsvUnLock(constructor);')
+  codeOut('      if (l) {');
+  codeOut('        v = jswBinarySearch(l, parent, name);')
+  codeOut('        if (v) return v;');
+  codeOut('      }')
+  codeOut('    } else {')
+  codeOut('      jsvUnLock(constructor);')
+  codeOut('    }')
+  codeOut('    // ------------------------------------------ METHODS ON OBJECT')
+  if "parent" in builtins:
+    codeOutBuiltins("    v = ", builtins["parent"])
+    codeOut('    if (v) return v;');
+  codeOut('  } else { /* if (!parent) */')
+  codeOut('    // ------------------------------------------ FUNCTIONS')
+  codeOut('    // Handle pin names - eg LED1 or D5 (this is hardcoded in build_jsfunctions.py)')
+  codeOut('    Pin pin = jshGetPinFromString(name);')
+  codeOut('    if (pin != PIN_UNDEFINED) {')
+  codeOut('      return jsvNewFromPin(pin);')
+  codeOut('    }')
+  if "!parent" in builtins:
+    codeOutBuiltins("    v = ", builtins["!parent"])
+    codeOut('    if (v) return v;');
+  codeOut('  }');
+
+  codeOut('  JSW_COUNT_MISS();')
+  codeOut('  return 0;')
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  codeOut('const JswSymList *jswGetSymbolListForObject(JsVar *parent) {')
+  codeOut("  if (jsvIsNativeFunction(parent)) {");
+  codeOut('    const JswConstructor *c = jswFindConstructor(parent->varData.native.ptr);')
+  codeOut('    const JswSymList *l = c ? jswGetConstructorSymbols(READ_FLASH_UINT8(&c->symbols)) : 0;')
+  codeOut('    if (l) return l;')
+  for check, builtin in otherObjectChecks:
+    codeOut("    if (JSW_COMPARE("+check+")) return &jswSymbolTables["+builtin["indexName"]+"];");
+  codeOut("  }");
+  for className in builtins:
+    builtin = builtins[className]
+    if not className in ["parent","!parent"] and not builtin["isProto"] and not className.startswith(nativeTestStr):
+      codeOut("  if (JSW_COMPARE("+className+")) return &jswSymbolTables["+builtin["indexName"]+"];");
+  codeOut("  if (parent==execInfo.root) return &jswSymbolTables[jswSymbolIndex_global];");
+  codeOut("  return 0;")
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  codeOut('const JswSymList *jswGetSymbolListForObjectProto(JsVar *parent) {')
+  codeOut('  if (jsvIsNativeFunction(parent)) {')
+  codeOut('    const JswConstructor *c = jswFindConstructor(parent->varData.native.ptr);')
+  codeOut('    const JswSymList *l = c ? jswGetConstructorSymbols(READ_FLASH_UINT8(&c->objectProto)) : 0;')
+  codeOut('    if (l) return l;')
+  for check, builtin in otherObjectProtoChecks:
+    codeOut("    if (JSW_COMPARE("+check+")) return &jswSymbolTables["+builtin["indexName"]+"];");
+  codeOut('  }')
+  codeOut('  JsVar *constructor = jsvIsObject(parent)?jsvSkipNameAndUnLock(jsvFindChildFromString(parent, JSPARSE_CONSTRUCTOR_VAR, false)):0;')
+  codeOut('  if (constructor && jsvIsNativeFunction(constructor)) {')
+  codeOut('    const JswSymList *l = jswGetSymbolListForConstructorProto(constructor);')
+  codeOut('    jsvUnLock(constructor);')
+  codeOut('    if (l) return l;')
+  codeOut('  }')
+  def codeOutProtoMatch(indent, className):
+    codeOut(indent+"return &jswSymbolTables["+builtins[className]["indexName"]+"];")
+  codeOut('  if (parent) { // may be called with 0 to get Object.prototype')
+  codeOutVarTypeSwitch("    ", [className for className in builtins if className!="parent" and  className!="!parent" and not "constructorPtr" in className and not className.startswith(nativeCheck)], codeOutProtoMatch, True)
+  codeOut('  }')
+  codeOut("  return &jswSymbolTables["+builtins["parent"]["indexName"]+"];")
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  findBuiltinObject = codeOutNameIndex("jswBuiltInObjectNames", builtinObjectNames, symbolOffsets)
+  codeOut('bool jswIsBuiltInObject(const char *name) {')
+  codeOut('  return '+findBuiltinObject+'>=0;')
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  findLibrary = codeOutNameIndex("jswBuiltInLibraryNames", libraries, symbolOffsets)
+  codeOut('void *jswGetBuiltInLibrary(const char *name) {')
+  if libraries:
+    codeOut('  switch ('+findLibrary+') {')
+    for idx, lib in enumerate(sorted(libraries)):
+      codeOut('    case '+str(idx)+': return (void*)gen_jswrap_'+lib+'_'+lib+';')
+    codeOut('  }')
+  else:
+    codeOut('  NOT_USED(name);')
+  codeOut('  return 0;')
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  objectChecks = {}
+  for jsondata in jsondatas:
+    if "type" in jsondata and jsondata["type"]=="class":
+      if "check" in jsondata:
+        objectChecks[jsondata["class"]] = jsondata["check"]
+
+  codeOut('/** Given a variable, return the basic object name of it */')
+  codeOut('const char *jswGetBasicObjectName(JsVar *var) {')
+  codeOut('  if (jsvIsArrayBuffer(var)) {')
+  for className in objectChecks.keys():
+    if objectChecks[className].startswith("jsvIsArrayBuffer(var) && "):
+      codeOut("    if ("+objectChecks[className][25:]+") return \""+className+"\";")
+  codeOut('  }')
+  for className in objectChecks.keys():
+    if not objectChecks[className].startswith("jsvIsArrayBuffer(var) && "):
+      codeOut("  if ("+objectChecks[className]+") return \""+className+"\";")
+  codeOut('  return 0;')
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+
+  codeOut("/** Given the name of a Basic Object, eg, Uint8Array, String, etc. Return the prototype object's name - or 0. */")
+  findPrototype = codeOutNameIndex("jswPrototypeClassNames", prototypeNames.keys(), symbolOffsets, "objectName")
+  codeOut('const char *jswGetBasicObjectPrototypeName(const char *objectName) {')
+  # return string literals rather than pointers into jswSymbols_str, which may be in flash
+  codeOut('  switch ('+findPrototype+') {')
+  prototypeCases = OrderedDict() # prototype name -> list of indices
+  for idx, className in enumerate(sorted(prototypeNames.keys())):
+    prototypeCases.setdefault(prototypeNames[className], []).append(idx)
+  for prototype in prototypeCases:
+    codeOut('    '+" ".join(["case "+str(idx)+":" for idx in prototypeCases[prototype]])+' return "'+prototype+'";')
+  codeOut('  }')
+  codeOut('  return strcmp(objectName,"Object") ? "Object" : 0;')
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  codeOut("/** Tasks to run on Idle. Returns true if either one of the tasks returned true (eg. they're doing something and want to avoid sleeping) */")
+  codeOut('bool jswIdle() {')
+  codeOut('  bool wasBusy = false;')
+  for jsondata in jsondatas:
+    if "type" in jsondata and jsondata["type"]=="idle":
+      codeOut("  if ("+jsondata["generate"]+"()) wasBusy = true;")
+  codeOut('  return wasBusy;')
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  codeOut("/** Tasks to run on Hardware Initialisation (called once at boot time, after jshInit, before jsvInit/etc) */")
+  codeOut('void jswHWInit() {')
+  for jsondata in jsondatas:
+    if "type" in jsondata and jsondata["type"]=="hwinit":
+      codeOut("  "+jsondata["generate"]+"();")
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  codeOut("/** Tasks to run on Initialisation (eg boot/load/reset/after save/etc) */")
+  codeOut('void jswInit() {')
+  for jsondata in jsondatas:
+    if "type" in jsondata and jsondata["type"]=="init":
+      codeOut("  "+jsondata["generate"]+"();")
+  codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  codeOut("/** Tasks to run on Deinitialisation (eg before save/reset/etc) */")
+  codeOut('void jswKill() {')
+  for jsondata in jsondatas:
+    if "type" in jsondata and jsondata["type"]=="kill":
+      codeOut("  "+jsondata["generate"]+"();")
+  codeOut('}')
+
+  codeOut("/** Tasks to run when a character event is received */")
+  codeOut('bool jswOnCharEvent(IOEventFlags channel, char charData) {')
+  for jsondata in jsondatas:
+    if "type" in jsondata and jsondata["type"].startswith("EV_"):
+      codeOut("  if (channel=="+jsondata["type"]+") return "+jsondata["generate"]+"(charData);")
+  codeOut('  return false;')
+  codeOut('}')
+
+  moduleBytes = dict([(m, len(jsmodules[m].encode("utf-8"))+1) for m in jsmodules])
+  if compressModules and jsmodules:
+    moduleBytes = codeOutCompressedJSModules(symbolOffsets)
+  elif jsmodules:
+    codeOut("static JsVar *jswNewJSLibraryString(const char *js) {")
+    codeOut("  return jsvNewNativeString((char*)js, strlen(js));")
+    codeOut("}")
+    codeOut("")
+    findModule = codeOutNameIndex("jswJSModuleNames", jsmodules.keys(), symbolOffsets)
+    codeOut("/** If we have a built-in module with the given name, return a String of the module's contents - or 0 */")
+    codeOut('JsVar *jswGetBuiltInJSLibrary(const char *name) {')
+    codeOut('  switch ('+findModule+') {')
+    for idx, modulename in enumerate(sorted(jsmodules.keys())):
+      codeOut("    case "+str(idx)+": return jswNewJSLibraryString("+toCString(jsmodules[modulename])+");")
+    codeOut('  }')
+    codeOut('  return 0;')
+    codeOut('}')
+  else:
+    codeOut("/** If we have a built-in module with the given name, return a String of the module's contents - or 0 */")
+    codeOut('JsVar *jswGetBuiltInJSLibrary(const char *name) {')
+    codeOut('  NOT_USED(name);')
+    codeOut('  return 0;')
+    codeOut('}')
+
+  codeOut('')
+  codeOut('')
+
+  codeOut('const char *jswGetBuiltInLibraryNames() {')
+  librarynames = []
+  for lib in libraries:
+    librarynames.append(lib);
+  for lib in jsmodules:
+    librarynames.append(lib);
+  codeOut('  return "'+','.join(librarynames)+'";')
+  codeOut('}')
+
+  codeOut('#ifdef USE_CALLFUNCTION_HACK')
+  codeOut('// on Emscripten and i386 we cant easily hack around function calls with floats/etc, plus we have enough')
+  codeOut('// resources, so just brute-force by handling every call pattern we use in a switch')
+  codeOut('JsVar *jswCallFunctionHack(void *function, JsnArgumentType argumentSpecifier, JsVar *thisParam, JsVar **paramData, int paramCount) {')
+  # argSpecs that need the same code to call them (eg. because they only differ by
+  # JSWAT_EXECUTE_IMMEDIATELY) share one case
+  argSpecs = []
+  callCases = OrderedDict()
+  maxParams = 0
+  for jsondata in jsondatas:
+    if "generate" in jsondata:
+      argSpec = getArgumentSpecifier(jsondata)
+      if not argSpec in argSpecs:
+        argSpecs.append(argSpec)
+        params = getParams(jsondata)
+        result = getResult(jsondata);
+        pTypes = []
+        pValues = []
+        if hasThis(jsondata): 
+          pTypes.append("JsVar*")
+          pValues.append("thisParam")
+        cmd = "";
+        cmdstart = "";
+        cmdend = "";
+        n = 0
+        for param in params:
+          pTypes.append(toCType(param[1]));
+          if param[1]=="JsVarArray": 
+            cmdstart =  "      JsVar *argArray = (paramCount>"+str(n)+")?jsvNewArray(&paramData["+str(n)+"],paramCount-"+str(n)+"):jsvNewEmptyArray();\n";
+            pValues.append("argArray");
+            cmdend = "      jsvUnLock(argArray);\n\n";
+          else:
+            pValues.append(toCUnbox(param[1])+"(params["+str(n)+"])");
+          n = n+1
+        maxParams = max(maxParams, n)
+
+        code = []
+        code.append("      JsVar *result = 0;");
+        if cmdstart: code.append(cmdstart);
+        cmd = "(("+toCType(result[0])+"(*)("+",".join(pTypes)+"))function)("+",".join(pValues)+")";
+        if result[0]: code.append("      result = "+toCBox(result[0])+"("+cmd+");");
+        else: code.append("      "+cmd+";");
+        if cmdend: code.append(cmdend);
+        code.append("      return result;");
+        code = "\n".join(code)
+        if not code in callCases: callCases[code] = []
+        callCases[code].append(argSpec)
+
+  # pad out the parameters with undefined, so each case doesn't have to check paramCount
+  codeOut('  JsVar *params['+str(max(maxParams,1))+'];')
+  codeOut('  for (int i=0;i<'+str(max(maxParams,1))+';i++) params[i] = (i<paramCount) ? paramData[i] : 0;')
+  codeOut('  switch(argumentSpecifier) {')
+  for code in callCases:
+    for argSpec in callCases[code][:-1]:
+      codeOut("    case "+argSpec+":");
+    codeOut("    case "+callCases[code][-1]+": {");
+    codeOut(code);
+    codeOut("    }");
+  print("jswCallFunctionHack: "+str(len(argSpecs))+" argument specifiers handled by "+str(len(callCases))+" cases ("+str(len(argSpecs)-len(callCases))+" removed)")
+
+  #((uint32_t (*)(size_t,size_t,size_t,size_t))function)(argData[0],argData[1],argData[2],argData[3]);
+  codeOut('  default: jsExceptionHere(JSET_ERROR,"Unknown argspec %d",argumentSpecifier);')
+  codeOut('  }')
+  codeOut('  return 0;')
+  codeOut('}')
+  codeOut('#endif')
+
+  codeOut('')
+  codeOut('')
+
+  wrapperFile.close()
+
+  if flashReport:
+    writeFlashReport(flashReport, flashReportBase, getFlashReport(board, builtins, symbolChars, symbolOffsets, jsondatas, moduleBytes))
+
+# Get a variable that's normally passed in by make. When building from make, the board's
+# NAME= makefile line is what ends up being used, so in batch mode we use that too
+def getBoardMakeVariable(board, name, default):
+  value = default
+  if batchMode and "build" in board.info and "makefile" in board.info["build"]:
+    for line in board.info["build"]["makefile"]:
+      if line.strip().startswith(name+"="):
+        value = line.strip()[len(name)+1:]
+  return value
+
+# Filter the scanned data for the named board, apply any blacklist, and output a wrapper file
+def buildWrapperForBoard(scanned, boardName, wrapperFileName, irFileName, flashReport):
+  print("BOARD "+boardName)
+  board = importlib.import_module(boardName)
+  jsondatas = common.get_board_jsondata(scanned, board, irFileName)
+  blacklist = getBoardMakeVariable(board, "BLACKLIST", os.environ.get('BLACKLIST'))
+  if blacklist:
+    jsondatas = removeBlacklistForWrapper(blacklist, jsondatas, board, explainBlacklist)
+  appDir = getBoardMakeVariable(board, "APP_DIR", appDirDefault)
+  if appDir:
+    jsondatas = removeUnusedSymbols(appDir, jsondatas, board, explainBlacklist)
+  symbolHash = getBoardMakeVariable(board, "SYMBOL_HASH", symbolHashDefault)
+  symbolTrie = getBoardMakeVariable(board, "SYMBOL_TRIE", symbolTrieDefault)
+  compressModules = getBoardMakeVariable(board, "COMPRESS_JSMODULES", compressModulesDefault)
+  symbolProfile = getBoardMakeVariable(board, "SYMBOL_PROFILE", symbolProfileDefault)
+  hotSymbols = int(getBoardMakeVariable(board, "HOT_SYMBOLS", hotSymbolsDefault))
+  buildWrapper(board, jsondatas, wrapperFileName, symbolHash, symbolTrie, compressModules, symbolProfile, hotSymbols, flashReport,
+               flashReportBaseFileName and flashReportBaseFileName.replace("%s", boardName))
+
+# Worker process for --boards. exit() would kill the worker without returning a
+# result, so return the exit code instead
+def buildWrapperForBoardWorker(args):
+  try:
+    buildWrapperForBoard(*args)
+  except SystemExit as e:
+    return e.code or 0
+  return 0
+
+
+#================== argument specifier analysis ==============
+# Rough cost in cycles on a Cortex-M of each part of calling a native function with
+# jsnCallFunction, to rank functions and argument specifiers - not a measurement
+CALL_COST_FAST_PATH = 5 # one of the argument specifiers checked before 'the hard way'
+CALL_COST_GENERIC = 40 # setting up and calling through argData
+CALL_COST_STACK_ARGS = 10 # more than 4 words of arguments, so some go on the stack
+CALL_COST_GENERATED = 6 # the extra call through a gen_jswrap_... function
+CALL_COST_GENERATED_JS = 2000 # parsing and running the JS in a generate_js function
+CALL_COST_ARGUMENT = { "JsVar" : 4, "bool" : 15, "int32" : 20, "int" : 20, "pin" : 25, "float" : 30, "JsVarArray" : 100 }
+CALL_COST_RETURN = { "" : 0, "JsVar" : 0, "bool" : 40, "int32" : 40, "int" : 40, "pin" : 40, "float" : 40 }
+# Argument specifiers that jsnCallFunction handles before 'the hard way'
+FAST_PATH_SIGNATURES = [ "void()", "JsVar*()", "void(this)" ]
+
+# Get a readable form of a function's argument specifier, eg. 'JsVar*(this, int, JsVar*)'
+def getArgumentSignature(jsondata):
+  if jsondata["type"]=="object": return "JsVar*() immediate"
+  params = ["this"] if hasThis(jsondata) else []
+  params += [toCType(param[1]) if param[1]!="JsVarArray" else "JsVarArray" for param in getParams(jsondata)]
+  signature = toCType(getResult(jsondata)[0])+"("+", ".join(params)+")"
+  if jsondata["type"]=="variable" or common.is_property(jsondata):
+    signature += " immediate"
+  return signature
 
+def getSignatureParams(signature):
+  return [p for p in signature[signature.index("(")+1:signature.index(")")].split(", ") if p]
 
-      
+# Estimate the cost of calling the function through jsnCallFunction
+def getCallCost(jsondata, signature):
+  if signature in FAST_PATH_SIGNATURES: return CALL_COST_FAST_PATH
+  params = getParams(jsondata)
+  cost = CALL_COST_GENERIC + CALL_COST_RETURN[getResult(jsondata)[0]]
+  cost += sum([CALL_COST_ARGUMENT[param[1]] for param in params])
+  words = len(params) + (1 if hasThis(jsondata) else 0) + len([p for p in params if p[1]=="float"])
+  if words>4: cost += CALL_COST_STACK_ARGS
+  return cost
+
+# Estimate the extra cost of calling the function through a generated wrapper
+def getWrapperCost(jsondata):
+  if "generate_js" in jsondata: return CALL_COST_GENERATED_JS
+  if "generate_full" in jsondata or jsondata["type"]=="object": return CALL_COST_GENERATED
+  return 0
+
+# Print how argument specifiers are used across all the given boards, which functions need
+# a generated wrapper (and roughly what that costs), and which argument specifiers would be
+# worth handling as a fast path at the start of jsnCallFunction in jsnative.c
+def analyzeArgumentSpecifiers(scanned, boardNames, irFileName):
+  functions = OrderedDict() # "class.name" -> info
+  for boardName in boardNames:
+    board = importlib.import_module(boardName)
+    jsondatas = common.get_board_jsondata(scanned, board, irFileName and irFileName.replace("%s", boardName))
+    blacklist = getBoardMakeVariable(board, "BLACKLIST", os.environ.get('BLACKLIST'))
+    if blacklist:
+      jsondatas = removeBlacklistForWrapper(blacklist, jsondatas, board)
+    for jsondata in jsondatas:
+      if not isBuiltinSymbol(jsondata): continue
+      name = (jsondata["class"]+"." if "class" in jsondata else "")+jsondata["name"]
+      if not name in functions:
+        info = { "name" : name, "filename" : jsondata["filename"], "boards" : [] }
+        if len(getParams(jsondata))>4:
+          info["error"] = str(len(getParams(jsondata)))+" parameters, but an argument specifier only has room for 4 (use JsVarArray)"
+        else:
+          info["signature"] = getArgumentSignature(jsondata)
+          info["callCost"] = getCallCost(jsondata, info["signature"])
+          info["wrapperCost"] = getWrapperCost(jsondata)
+          info["argSpec"] = getArgumentSpecifier(jsondata)
+        if "generate_js" in jsondata: info["wrapper"] = "generate_js"
+        elif "generate_full" in jsondata: info["wrapper"] = "generate_full"
+        elif jsondata["type"]=="object": info["wrapper"] = "object"
+        functions[name] = info
+      functions[name]["boards"].append(boardName)
+
+  print("")
+  print("Argument specifiers for "+str(len(functions))+" functions on "+str(len(boardNames))+" boards")
+  signatures = OrderedDict()
+  for f in functions.values():
+    if "signature" in f: signatures.setdefault(f["signature"], []).append(f)
+  print("%-56s %9s %11s %5s %6s" % ("argument specifier", "functions", "occurrences", "fast", "cycles"))
+  for signature in sorted(signatures.keys(), key=lambda s: (-len(signatures[s]), s)):
+    fs = signatures[signature]
+    print("%-56s %9d %11d %5s %6d" % (signature, len(fs), sum([len(f["boards"]) for f in fs]), "yes" if signature in FAST_PATH_SIGNATURES else "", fs[0]["callCost"]))
+
+  errors = [f for f in functions.values() if "error" in f]
+  if errors:
+    print("")
+    print("Functions that can't be given an argument specifier:")
+    for f in errors:
+      print("  "+f["name"]+" ("+f["filename"]+"): "+f["error"])
+
+  wrapped = sorted([f for f in functions.values() if "wrapper" in f and "signature" in f], key=lambda f: (-f["wrapperCost"], f["name"]))
+  print("")
+  print(str(len(wrapped))+" functions are called through a generated wrapper rather than directly (estimated extra cycles per call):")
+  for f in wrapped:
+    print("  %-48s %-13s %6d  %s (%d boards)" % (f["name"], f["wrapper"], f["wrapperCost"], f["filename"], len(f["boards"])))
+
+  # A fast path is only simple for arguments that don't need converting from JsVars
+  candidates = [s for s in signatures if not s in FAST_PATH_SIGNATURES and
+                all([p in ["this", "JsVar*"] for p in getSignatureParams(s)])]
+  candidates = sorted(candidates, key=lambda s: (-sum([len(f["boards"]) for f in signatures[s]]), s))[:10]
+  print("")
+  if candidates:
+    print("Argument specifiers that could be handled before 'the hard way' in jsnCallFunction (most used first):")
+    for signature in candidates:
+      fs = signatures[signature]
+      saved = CALL_COST_GENERIC + CALL_COST_ARGUMENT["JsVar"]*getSignatureParams(signature).count("JsVar*") - CALL_COST_FAST_PATH
+      print("  %-40s %3d functions, ~%d cycles saved per call, eg. %s" % (signature, len(fs), saved, ", ".join([f["name"] for f in fs[:3]])))
+      print("    argumentSpecifier==("+fs[0]["argSpec"]+")")
+    if [s for s in candidates if s.endswith(" immediate")]:
+      print("'immediate' argument specifiers (properties and variables) include JSWAT_EXECUTE_IMMEDIATELY, so they never match the existing fast paths")
+  else:
+    print("No more argument specifiers are worth a fast path in jsnCallFunction")
 
-#((uint32_t (*)(size_t,size_t,size_t,size_t))function)(argData[0],argData[1],argData[2],argData[3]);
-codeOut('  default: jsExceptionHere(JSET_ERROR,"Unknown argspec %d",argumentSpecifier);')
-codeOut('  }')
-codeOut('  return 0;')
-codeOut('}')
-codeOut('#endif')
+# ------------------------------------------------------------------------------------------------------
 
-codeOut('')
-codeOut('')
+scanned = common.parse_jsondata_args(is_for_document = False, parseArgs = True)
+# the wrapper IR (--ir=FILE) can save scanning entirely if it's up to date. With --boards its filename must contain %s
+irFileName = scanned["ir"]
+if batchMode and irFileName and not "%s" in irFileName:
+  print("ERROR: With --boards, the wrapper IR filename must contain %s")
+  exit(1)
+if batchMode and flashReportFileName and not "%s" in flashReportFileName:
+  print("ERROR: With --boards, the flash report filename must contain %s")
+  exit(1)
+if analyzeArgSpecs:
+  analyzeArgumentSpecifiers(common.scan_jsondata_files(scanned), boardNames, irFileName)
+elif not batchMode:
+  buildWrapperForBoard(scanned, boardNames[0], wrapperFileName, irFileName, flashReportFileName)
+else:
+  scanned = common.scan_jsondata_files(scanned) # once, for all boards
+  tasks = [(scanned, boardName, wrapperFileName.replace("%s", boardName), irFileName and irFileName.replace("%s", boardName),
+            flashReportFileName and flashReportFileName.replace("%s", boardName)) for boardName in boardNames]
+  pool = None
+  if scanned["jobs"]>1 and len(tasks)>1:
+    import multiprocessing
+    try: # only 'fork' - with 'spawn' this whole script would be re-run in each worker
+      pool = multiprocessing.get_context("fork").Pool(min(scanned["jobs"], len(tasks)))
+    except ValueError:
+      pool = None
+  if pool:
+    try:
+      results = pool.map(buildWrapperForBoardWorker, tasks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [buildWrapperForBoardWorker(task) for task in tasks]
+  for task, result in zip(tasks, results):
+    if result:
+      sys.stderr.write("ERROR: Failed to build wrapper for "+task[1]+"\n")
+      exit(result)
@@ -20,6 +20,13 @@ import json;
 import sys;
 import os;
 import importlib;
+import hashlib;
+import bisect;
+import traceback;
+try:
+  import cPickle as pickle # much faster in Python 2
+except ImportError:
+  import pickle;
 # Local
 import pinutils;
 
@@ -56,6 +63,288 @@ if "check_output" not in dir( subprocess ):
 #
 
 
+# ----------------------------------------------------------------------------------------
+# Cache of the /*JSON*/ comments found in each jswrap file. This is stored *before* any
+# ifdef/#if filtering, so it can be shared between all board builds and only files that
+# have changed need to be parsed again. Set NO_JSONDATA_CACHE=1 to disable it.
+#
+# {
+#   "version" : JSONDATA_CACHE_VERSION,
+#   "files" : {
+#     "src/jswrap_pin.c" : { "mtime" : secs, "size" : bytes, "hash" : "sha1...",
+#                            "no_docs" : false, // file contains DO_NOT_INCLUDE_IN_DOCS
+#                            "records" : [ { "line" : 123, "json" : { ... } }, ... ] }
+#   }
+# }
+JSONDATA_CACHE_VERSION = 1
+JSONDATA_CACHE_FILE = "gen/jsondata_cache.json"
+
+def load_jsondata_cache():
+  if os.getenv("NO_JSONDATA_CACHE"): return False
+  cache = { "files" : {}, "changed" : False }
+  try:
+    with open(JSONDATA_CACHE_FILE, "r") as f:
+      data = json.load(f)
+    if data.get("version")==JSONDATA_CACHE_VERSION:
+      cache["files"] = data["files"]
+    else:
+      print("JSON cache version mismatch - ignoring "+JSONDATA_CACHE_FILE)
+  except (IOError, OSError, ValueError, KeyError):
+    pass # no cache, or it's corrupt - we'll just rebuild it
+  return cache
+
+def save_jsondata_cache(cache):
+  if not cache or not cache["changed"]: return
+  # write to a temporary file and rename, so a parallel build never sees half a file
+  tmpname = JSONDATA_CACHE_FILE+"."+str(os.getpid())
+  try:
+    cachedir = os.path.dirname(JSONDATA_CACHE_FILE)
+    if not os.path.isdir(cachedir): # eg. after 'make clean'
+      try:
+        os.makedirs(cachedir)
+      except OSError:
+        if not os.path.isdir(cachedir): raise # unless a parallel build just made it
+    with open(tmpname, "w") as f:
+      json.dump({ "version" : JSONDATA_CACHE_VERSION, "files" : cache["files"] }, f)
+    getattr(os, "replace", os.rename)(tmpname, JSONDATA_CACHE_FILE) # no os.replace in Python 2
+    cache["changed"] = False
+  except (IOError, OSError) as e:
+    print("WARNING: Unable to write "+JSONDATA_CACHE_FILE+" - "+str(e))
+
+JSON_COMMENT_REGEX = re.compile(r"/\*JSON.*?\*/", re.VERBOSE | re.MULTILINE | re.DOTALL)
+
+# Find all /*JSON*/ comments in the given source code. Returns a list of (linenumber, comment)
+def find_json_comments(code):
+  # index of every newline, so the line number for any match can be found by bisection
+  newlines = []
+  pos = code.find("\n")
+  while pos>=0:
+    newlines.append(pos)
+    pos = code.find("\n", pos+1)
+  return [(1+bisect.bisect_left(newlines, match.start()), match.group(0)) for match in JSON_COMMENT_REGEX.finditer(code)]
+
+# Parse all the /*JSON*/ comments in the given source code (without any filtering)
+# Raises ValueError if a comment can't be parsed
+def parse_jswrap_code(jswrap, code):
+  records = []
+  for linenumber, comment in find_json_comments(code):
+    # Strip off /*JSON .. */ bit
+    comment = comment[6:-2]
+
+    endOfJson = comment.find("\n}")+2;
+    jsonstring = comment[0:endOfJson];
+    description =  comment[endOfJson:].strip();
+#        print("Parsing "+jsonstring)
+    try:
+      jsondata = json.loads(jsonstring)
+    except ValueError as e:
+      raise ValueError("JSON PARSE FAILED for " +  jsonstring + " - "+ str(e) + "\nIn "+jswrap+":"+str(linenumber))
+    if len(description): jsondata["description"] = description;
+    records.append({ "line" : linenumber, "json" : jsondata })
+  return records
+
+# Read and parse a jswrap file. If the file's hash is 'knownhash' it hasn't changed, so
+# we don't bother parsing it. This is run in worker processes when scanning with -J
+def scan_jswrap_file(args):
+  jswrap, knownhash = args
+  st = os.stat(jswrap)
+  with open(jswrap, "rb") as f:
+    raw = f.read()
+  data = {
+    "mtime" : st.st_mtime,
+    "size" : st.st_size,
+    "hash" : hashlib.sha1(raw).hexdigest()
+  }
+  if data["hash"]!=knownhash:
+    code = raw.decode("utf-8").replace("\r\n","\n").replace("\r","\n") # as open(..,"r") would
+    data["no_docs"] = "DO_NOT_INCLUDE_IN_DOCS" in code
+    data["records"] = parse_jswrap_code(jswrap, code)
+  return data
+
+# Get the parsed /*JSON*/ comments for each file (in the same order as jswraps). Files
+# that haven't changed come from the cache, and the rest are parsed using 'jobs' processes
+def scan_jswrap_files(jswraps, cache, jobs):
+  files = cache["files"] if cache else {}
+  todo = []
+  for jswrap in jswraps:
+    cached = files.get(jswrap)
+    st = os.stat(jswrap)
+    if not (cached and cached["mtime"]==st.st_mtime and cached["size"]==st.st_size):
+      todo.append((jswrap, cached["hash"] if cached else None))
+  results = None
+  if jobs>1 and len(todo)>1:
+    # Only use 'fork' - with 'spawn' the calling script would be run again in each worker
+    import multiprocessing
+    ctx = multiprocessing
+    if hasattr(multiprocessing, "get_context"):
+      try:
+        ctx = multiprocessing.get_context("fork")
+      except ValueError:
+        ctx = None
+    if ctx:
+      print("Scanning "+str(len(todo))+" files with "+str(jobs)+" processes")
+      pool = ctx.Pool(min(jobs, len(todo)))
+      try:
+        results = pool.map(scan_jswrap_file, todo)
+      finally:
+        pool.close()
+        pool.join()
+  if results is None:
+    results = [scan_jswrap_file(t) for t in todo]
+  for (jswrap, knownhash), data in zip(todo, results):
+    if data["hash"]==knownhash: # file was touched but not changed
+      files[jswrap]["mtime"] = data["mtime"]
+    else:
+      files[jswrap] = data
+    if cache: cache["changed"] = True
+  return [files[jswrap] for jswrap in jswraps]
+
+# ----------------------------------------------------------------------------------------
+# Evaluates the "#if" expressions in JSON comments, like a C preprocessor would. Supports
+# integers, macro names, defined(X), !, &&, ||, comparisons, arithmetic and brackets.
+#
+# Each distinct expression is compiled once into a closure, and the result is memoized
+# for each set of defines. 'defines' is the list used in get_jsondata, so "FOO" and
+# "FOO=3" define macros, and "defined(FOO)=True/False" sets the result of defined(FOO)
+# if FOO itself isn't defined (we use this for USB). As in C, macros that aren't defined
+# are 0.
+
+class IfExpressionError(Exception):
+  pass
+
+IF_TOKEN_REGEX = re.compile(r"\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|([A-Za-z_]\w*)|(&&|\|\||==|!=|<=|>=|[!<>()+\-*/%]))")
+IF_BINARY_OPERATORS = [ # lowest precedence first
+  { "||" : None },
+  { "&&" : None },
+  { "==" : lambda a,b: int(a==b), "!=" : lambda a,b: int(a!=b) },
+  { "<" : lambda a,b: int(a<b), ">" : lambda a,b: int(a>b), "<=" : lambda a,b: int(a<=b), ">=" : lambda a,b: int(a>=b) },
+  { "+" : lambda a,b: a+b, "-" : lambda a,b: a-b },
+  { "*" : lambda a,b: a*b, "/" : lambda a,b: c_divide(a,b), "%" : lambda a,b: a-b*c_divide(a,b) },
+]
+if_compiled_expressions = {}
+if_expression_results = {}
+
+def c_divide(a, b):
+  if b==0: raise IfExpressionError("division by zero")
+  q = abs(a) // abs(b)
+  return q if (a<0)==(b<0) else -q
+
+# Parse an integer literal like C does, so 010 is octal
+def parse_if_integer(s):
+  try:
+    if s[:2] in ("0x", "0X"): return int(s[2:], 16)
+    if s[:1]=="0": return int(s, 8)
+    return int(s)
+  except ValueError:
+    raise IfExpressionError("bad integer '"+s+"'")
+
+def tokenize_if_expression(expr):
+  tokens = []
+  pos = 0
+  expr = expr.rstrip()
+  while pos<len(expr):
+    match = IF_TOKEN_REGEX.match(expr, pos)
+    if not match: raise IfExpressionError("unexpected '"+expr[pos:].strip()+"'")
+    if match.group(1): tokens.append(("int", parse_if_integer(match.group(1))))
+    elif match.group(2): tokens.append(("name", match.group(2)))
+    else: tokens.append(("op", match.group(3)))
+    pos = match.end()
+  return tokens
+
+# Compile an expression into a function that takes the object from get_if_defines and returns an int
+def compile_if_expression(expr):
+  if expr in if_compiled_expressions: return if_compiled_expressions[expr]
+  tokens = tokenize_if_expression(expr)
+  pos = [0]
+  def peek():
+    return tokens[pos[0]] if pos[0]<len(tokens) else (None, None)
+  def expect(op):
+    if peek()!=("op", op): raise IfExpressionError("expected '"+op+"' in '"+expr+"'")
+    pos[0] += 1
+
+  def parse_primary():
+    kind, value = peek()
+    pos[0] += 1
+    if kind=="int":
+      return lambda d: value
+    if kind=="name" and value=="defined":
+      brackets = peek()==("op", "(")
+      if brackets: expect("(")
+      kind, name = peek()
+      if kind!="name": raise IfExpressionError("expected macro name after defined in '"+expr+"'")
+      pos[0] += 1
+      if brackets: expect(")")
+      return lambda d: int(is_if_defined(d, name))
+    if kind=="name":
+      return lambda d: get_if_macro_value(d, value)
+    if (kind, value)==("op", "("):
+      e = parse_binary(0)
+      expect(")")
+      return e
+    if (kind, value)==("op", "!"):
+      e = parse_primary()
+      return lambda d: int(not e(d))
+    if (kind, value)==("op", "-"):
+      e = parse_primary()
+      return lambda d: -e(d)
+    if (kind, value)==("op", "+"):
+      return parse_primary()
+    raise IfExpressionError("unexpected "+(str(value) if kind else "end")+" in '"+expr+"'")
+
+  def parse_binary(level):
+    if level>=len(IF_BINARY_OPERATORS): return parse_primary()
+    operators = IF_BINARY_OPERATORS[level]
+    left = parse_binary(level+1)
+    while peek()[0]=="op" and peek()[1] in operators:
+      op = peek()[1]
+      pos[0] += 1
+      right = parse_binary(level+1)
+      if op=="||": left = (lambda l,r: lambda d: int(bool(l(d)) or bool(r(d))))(left, right)
+      elif op=="&&": left = (lambda l,r: lambda d: int(bool(l(d)) and bool(r(d))))(left, right)
+      else: left = (lambda l,r,f: lambda d: f(l(d),r(d)))(left, right, operators[op])
+    return left
+
+  fn = parse_binary(0)
+  if pos[0]!=len(tokens): raise IfExpressionError("unexpected '"+str(peek()[1])+"' in '"+expr+"'")
+  if_compiled_expressions[expr] = fn
+  return fn
+
+# Turn get_jsondata's list of defines into something we can evaluate expressions with
+def get_if_defines(defines):
+  d = { "key" : tuple(defines), "values" : {}, "defined" : {}, "expanding" : [] }
+  for defn in defines:
+    name, eq, value = defn.partition("=")
+    if name.startswith("defined(") and name.endswith(")"):
+      d["defined"].setdefault(name[8:-1].strip(), value.strip()=="True")
+    else:
+      d["values"].setdefault(name.strip(), value.strip() if eq else "1")
+  return d
+
+def is_if_defined(d, name):
+  if name in d["values"]: return True
+  return d["defined"].get(name, False)
+
+def get_if_macro_value(d, name):
+  if not name in d["values"]:
+    return 0 # like the C preprocessor
+  value = d["values"][name]
+  if value=="True": return 1 # board files often use Python-style booleans
+  if value=="False": return 0
+  if name in d["expanding"]: raise IfExpressionError("recursive macro "+name)
+  d["expanding"].append(name)
+  try:
+    return compile_if_expression(value)(d)
+  finally:
+    d["expanding"].pop()
+
+# Evaluate an #if expression. Raises IfExpressionError if it can't be parsed, or a macro
+# it uses can't be evaluated
+def evaluate_if_expression(expr, d):
+  key = (expr, d["key"])
+  if not key in if_expression_results:
+    if_expression_results[key] = bool(compile_if_expression(expr)(d))
+  return if_expression_results[key]
+
 # Scans files for comments of the form /*JSON......*/
 #
 # Comments look like:
@@ -101,8 +390,19 @@ if "check_output" not in dir( subprocess ):
 # COMMAND LINE OPTIONS
 # -Ddefinition
 # -BBOARDFILE
+# -J[jobs]           Parse files that aren't in the cache with multiple processes (default: one per core)
+# --ir=FILE          Load the jsondata from this wrapper IR file if it's up to date, or save it there if not
 def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
-    global board # use the board object defined above
+    args = parse_jsondata_args(is_for_document, parseArgs, boardObject)
+    return get_board_jsondata(args, args["board"], args["ir"])
+
+# Parse the command-line and scan the files for JSON. This doesn't depend on the board, so
+# the result can be passed to filter_jsondata for as many boards as needed
+def scan_jsondata(is_for_document, parseArgs = True, boardObject = False):
+    return scan_jsondata_files(parse_jsondata_args(is_for_document, parseArgs, boardObject))
+
+# Parse the command-line, and work out which files to scan
+def parse_jsondata_args(is_for_document, parseArgs = True, boardObject = False):
     board = boardObject
     scriptdir = os.path.dirname	(os.path.realpath(__file__))
     print("Script location "+scriptdir)
@@ -116,6 +416,8 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
     defines = []
 
     explicit_files = False
+    jobs = 1
+    ir = False
     if parseArgs and len(sys.argv)>1:
       print("Using files from command line")
       for i in range(1,len(sys.argv)):
@@ -128,8 +430,17 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
             print("Now ignore_ifdefs = False");
             ignore_ifdefs = False
             board = importlib.import_module(arg[2:])            
+          elif arg[1]=="J":
+            if len(arg)>2: jobs = int(arg[2:])
+            else:
+              import multiprocessing
+              jobs = multiprocessing.cpu_count()
           elif arg[1]=="F":
             "" # -Fxxx.yy in args is filename xxx.yy, which is mandatory for build_jswrapper.py
+          elif arg.startswith("--ir="):
+            ir = arg[5:]
+          elif arg[1]=="-":
+            "" # --option is handled by the script that called us
           else:
             print("Unknown command-line option")
             exit(1)
@@ -141,8 +452,49 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
           print("WARNING: Ignoring unknown file type: " + arg)
     if not explicit_files:
       print("Scanning for jswrap.c files")
-      jswraps = subprocess.check_output(["find", ".", "-name", "jswrap*.c"]).strip().split("\n")
+      jswraps = subprocess.check_output(["find", ".", "-name", "jswrap*.c"]).decode("utf-8").strip().split("\n")
 
+    githash = get_git_hash()
+    if len(githash)==0: githash="master"
+
+    # ignore anything from archives
+    jswraps = [jswrap for jswrap in jswraps if not jswrap.startswith("./archives/")]
+
+    return {
+      "is_for_document" : is_for_document,
+      "ignore_ifdefs" : ignore_ifdefs,
+      "explicit_files" : explicit_files,
+      "defines" : defines,
+      "jobs" : jobs,
+      "githash" : githash,
+      "board" : board,
+      "ir" : ir,
+      "jswraps" : jswraps
+    }
+
+# Scan the files from parse_jsondata_args (or get the parsed comments from the cache)
+def scan_jsondata_files(args):
+    cache = load_jsondata_cache()
+    try:
+      scannedFiles = scan_jswrap_files(args["jswraps"], cache, args["jobs"])
+    except ValueError as e:
+      sys.stderr.write(str(e)+"\n")
+      exit(1)
+    save_jsondata_cache(cache)
+    scanned = dict(args)
+    scanned["files"] = list(zip(args["jswraps"], scannedFiles))
+    return scanned
+
+# Take the result of scan_jsondata and filter it for the given board (using ifdefs/etc)
+def filter_jsondata(scanned, boardObject):
+    global board # use the board object defined above
+    board = boardObject
+    is_for_document = scanned["is_for_document"]
+    ignore_ifdefs = scanned["ignore_ifdefs"]
+    explicit_files = scanned["explicit_files"]
+    githash = scanned["githash"]
+    # definitions that are used when evaluating IFDEFs/etc
+    defines = list(scanned["defines"])
     if board:
       if "usart" in board.chip: defines.append("USART_COUNT="+str(board.chip["usart"]));
       if "spi" in board.chip: defines.append("SPI_COUNT="+str(board.chip["spi"]));
@@ -169,35 +521,22 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
       print("Got #DEFINES:")
       for d in defines: print("   "+d)
       
-    githash = get_git_hash()
-    if len(githash)==0: githash="master"
+    ifDefines = get_if_defines(defines)
 
     jsondatas = []
-    for jswrap in jswraps:
-      # ignore anything from archives
-      if jswrap.startswith("./archives/"): continue
-
-      # now scan
+    jsondataIndex = {}
+    for jswrap, scannedFile in scanned["files"]:
       print("Scanning "+jswrap)
-      code = open(jswrap, "r").read()
 
-      if is_for_document and not explicit_files and "DO_NOT_INCLUDE_IN_DOCS" in code:
+      if is_for_document and not explicit_files and scannedFile["no_docs"]:
         print("FOUND 'DO_NOT_INCLUDE_IN_DOCS' IN FILE "+jswrap)
         continue
 
-      for comment in re.findall(r"/\*JSON.*?\*/", code, re.VERBOSE | re.MULTILINE | re.DOTALL):
-        charnumber = code.find(comment)
-        linenumber = 1+code.count("\n", 0, charnumber)
-        # Strip off /*JSON .. */ bit
-        comment = comment[6:-2]
-
-        endOfJson = comment.find("\n}")+2;
-        jsonstring = comment[0:endOfJson];
-        description =  comment[endOfJson:].strip();
-#            print("Parsing "+jsonstring)
+      for record in scannedFile["records"]:
+        # take a copy, as the data may be modified later (and we may have it in the cache)
+        jsondata = json.loads(json.dumps(record["json"]))
+        linenumber = record["line"]
         try:
-          jsondata = json.loads(jsonstring)
-          if len(description): jsondata["description"] = description;
           jsondata["filename"] = jswrap
           if jswrap[-2:]==".c":
             jsondata["include"] = jswrap[:-2]+".h"
@@ -222,48 +561,37 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
               print(dropped_prefix+" because of #ifdef "+jsondata["ifdef"])
               drop = True
             if ("#ifdef" in jsondata) or ("#ifndef" in jsondata):
-              sys.stderr.write( "'#ifdef' where 'ifdef' should be used in " + jsonstring + " - "+str(sys.exc_info()[0]) + "\n" )
+              sys.stderr.write( "'#ifdef' where 'ifdef' should be used in " + jswrap + ":" + str(linenumber) + "\n" )
               exit(1)
             if ("if" in jsondata):
-              sys.stderr.write( "'if' where '#if' should be used in " + jsonstring + " - "+str(sys.exc_info()[0]) + "\n" )
+              sys.stderr.write( "'if' where '#if' should be used in " + jswrap + ":" + str(linenumber) + "\n" )
               exit(1)
             if ("#if" in jsondata):
-              expr = jsondata["#if"]
-              for defn in defines:
-                expr = expr.replace("defined("+defn+")", "True");
-                if defn.find('=')!=-1:
-                  dname = defn[:defn.find('=')]
-                  dkey = defn[defn.find('=')+1:]
-                  expr = expr.replace("defined("+dname+")", "True");
-                  expr = expr.replace(dname, dkey);
-              # Now replace any defined(...) we haven't heard of with false
-              expr = re.sub(r"defined\([^\)]*\)", "False", expr)
-              expr = expr.replace("||","or").replace("&&","and");
-              expr = expr.replace("!","not ");
               try:
-                r = eval(expr)
-              except:
-                print("WARNING: error evaluating '"+expr+"' - from '"+jsondata["#if"]+"'")
+                r = evaluate_if_expression(jsondata["#if"], ifDefines)
+              except IfExpressionError as e:
+                print("WARNING: error evaluating '"+jsondata["#if"]+"' - "+str(e))
                 r = True
               if not r:
-                print(dropped_prefix+" because of #if "+jsondata["#if"]+ " -> "+expr)
+                print(dropped_prefix+" because of #if "+jsondata["#if"])
                 drop = True
           if not drop and "patch" in jsondata:
-            targetjsondata = [x for x in jsondatas if x["type"]==jsondata["type"] and x["class"]==jsondata["class"] and x["name"]==jsondata["name"]][0]
+            targetjsondata = find_jsondata(jsondataIndex, jsondata["type"], jsondata.get("class"), jsondata.get("name"))
+            if not targetjsondata:
+              raise Exception("No "+jsondata["type"]+" "+get_jsondata_key_name(jsondata)+" found to patch")
             for key in jsondata:
                if not key in ["type","class","name","patch"]:
                  print("Copying "+key+" --- "+jsondata[key]);
                  targetjsondata[key] = jsondata[key]
             drop = True 
           if not drop:
+            if not is_for_document and "name" in jsondata and find_jsondata(jsondataIndex, jsondata["type"], jsondata.get("class"), jsondata["name"]):
+              print("WARNING: Duplicate "+jsondata["type"]+" "+get_jsondata_key_name(jsondata)+" in "+jswrap+":"+str(linenumber))
             jsondatas.append(jsondata)
-        except ValueError as e:
-          sys.stderr.write( "JSON PARSE FAILED for " +  jsonstring + " - "+ str(e) + "\n")
-          print(''.join(traceback.format_exception(None, exc_obj, exc_obj.__traceback__)))          
-          exit(1)
+            add_to_jsondata_index(jsondataIndex, jsondata)
         except Exception as e:
-          sys.stderr.write( "JSON PARSE FAILED for " + jsonstring + " - "+str(e) + "\n" )
-          print(''.join(traceback.format_exception(None, exc_obj, exc_obj.__traceback__)))
+          sys.stderr.write( "JSON PROCESSING FAILED for " + jswrap + ":" + str(linenumber) + " - "+str(e) + "\n" )
+          print(traceback.format_exc())
           exit(1)
     print("Scanning finished.")
 
@@ -301,6 +629,140 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
 
     return jsondatas
 
+# ----------------------------------------------------------------------------------------
+# Wrapper IR - the jsondata for one board, both as used for the wrapper (is_for_document=False)
+# and for the docs (is_for_document=True), plus the structures build_docs.py/build_jsstub.py
+# make from it. It's saved by whichever of build_jswrapper.py, build_board_json.py,
+# build_docs.py or build_jsstub.py is run first with --ir=FILE, and the others then load it
+# rather than scanning and filtering the jswrap files again. It's only used if it was made
+# from the same files, defines and board, and none of the files - nor the board's file or
+# this one, which filter the jsondata - have changed since. A FILE ending in .json is
+# written as JSON, anything else is pickled (which loads faster).
+#
+# {
+#   "version" : WRAPPER_IR_VERSION,
+#   "key" : { "board" : "PICO_R1_3", "defines" : [ ... ], "githash" : "...", "ignore_ifdefs" : false,
+#             "explicit_files" : true, "files" : [ [ "src/jswrap_pin.c", mtime, size ], ... ],
+#             "sources" : [ [ "boards/PICO_R1_3.py", mtime, size ], [ "scripts/common.py", mtime, size ] ] },
+#   "wrapper" : { "jsondatas" : [ ... ], "classes" : [ ... ], "libraries" : [ ... ] },
+#   "docs" : { "jsondatas" : [ ... ], "classes" : [ ... ], "libraries" : [ ... ], "struct" : { ... } }
+# }
+WRAPPER_IR_VERSION = 1
+
+# Get [ filename, mtime, size ] for each file, so we can tell if any have changed
+def get_file_stats(filenames):
+    files = []
+    for filename in filenames:
+      try:
+        st = os.stat(filename)
+        files.append([filename, st.st_mtime, st.st_size])
+      except OSError:
+        files.append([filename, 0, -1])
+    return files
+
+# Get the .py file a module was loaded from
+def get_module_source(module):
+    filename = os.path.relpath(module.__file__)
+    if filename.endswith(".pyc"): filename = filename[:-1]
+    return filename
+
+# Get what a wrapper IR made from the given arguments (from parse_jsondata_args) and board must match
+def get_wrapper_ir_key(args, boardObject):
+    sources = [get_module_source(boardObject)] if boardObject else []
+    sources.append(get_module_source(sys.modules[__name__])) # filter_jsondata
+    return {
+      "board" : boardObject.__name__ if boardObject else "",
+      "defines" : args["defines"],
+      "githash" : args["githash"],
+      "ignore_ifdefs" : args["ignore_ifdefs"],
+      "explicit_files" : args["explicit_files"],
+      "files" : get_file_stats(args["jswraps"]),
+      "sources" : get_file_stats(sources)
+    }
+
+def get_wrapper_ir_view(ir, is_for_document):
+    return ir["docs" if is_for_document else "wrapper"]
+
+# Load a wrapper IR, returning False if it doesn't exist or doesn't match the given arguments
+# and board. If args is None, just check that the files it was made from haven't changed
+def load_wrapper_ir(filename, args = None, boardObject = False):
+    try:
+      if filename.endswith(".json"):
+        with open(filename, "r") as f:
+          ir = json.load(f)
+      else:
+        with open(filename, "rb") as f:
+          ir = pickle.load(f)
+    except (IOError, OSError, ValueError, EOFError, pickle.UnpicklingError):
+      return False # not there yet, or corrupt - it'll be rebuilt
+    if not isinstance(ir, dict) or ir.get("version")!=WRAPPER_IR_VERSION:
+      print("Wrapper IR version mismatch - ignoring "+filename)
+      return False
+    if args is None:
+      args = { "jswraps" : [f[0] for f in ir["key"]["files"]], "defines" : ir["key"]["defines"],
+               "githash" : ir["key"]["githash"], "ignore_ifdefs" : ir["key"]["ignore_ifdefs"],
+               "explicit_files" : ir["key"]["explicit_files"] }
+      key = get_wrapper_ir_key(args, False)
+      key["board"] = ir["key"]["board"]
+      key["sources"] = get_file_stats([f[0] for f in ir["key"]["sources"]])
+    else:
+      key = get_wrapper_ir_key(args, boardObject)
+    # JSON may have turned tuples into lists/etc, so compare it the same way
+    if json.loads(json.dumps(key))!=json.loads(json.dumps(ir["key"])):
+      print("Wrapper IR "+filename+" is out of date")
+      return False
+    print("Loaded wrapper IR "+filename)
+    return ir
+
+# Save a wrapper IR for the given data from scan_jsondata and board
+def save_wrapper_ir(filename, scanned, boardObject, views):
+    ir = { "version" : WRAPPER_IR_VERSION, "key" : get_wrapper_ir_key(scanned, boardObject) }
+    for name in views:
+      jsondatas = views[name]
+      classes = []
+      libraries = []
+      for jsondata in jsondatas:
+        if "class" in jsondata and not jsondata["class"] in classes:
+          classes.append(jsondata["class"])
+        if jsondata["type"]=="library" and not jsondata["class"] in libraries:
+          libraries.append(jsondata["class"])
+      ir[name] = { "jsondatas" : jsondatas, "classes" : classes, "libraries" : libraries }
+    ir["docs"]["struct"] = get_struct_from_jsondata(views["docs"])
+    # write to a temporary file and rename, so a parallel build never sees half a file
+    tmpname = filename+"."+str(os.getpid())
+    try:
+      if filename.endswith(".json"):
+        with open(tmpname, "w") as f:
+          json.dump(ir, f)
+      else:
+        with open(tmpname, "wb") as f:
+          pickle.dump(ir, f, 2) # protocol 2 can be read by Python 2 and 3
+      getattr(os, "replace", os.rename)(tmpname, filename) # no os.replace in Python 2
+    except (IOError, OSError) as e:
+      print("WARNING: Unable to write "+filename+" - "+str(e))
+
+# filter_jsondata, but if irFilename is set, load the result from the wrapper IR in it if
+# it's up to date - or save both views of the jsondata in it if not. 'scanned' can also
+# just be from parse_jsondata_args, in which case the files are only scanned if needed
+def get_board_jsondata(scanned, boardObject, irFilename):
+    if irFilename:
+      ir = load_wrapper_ir(irFilename, scanned, boardObject)
+      if ir: return get_wrapper_ir_view(ir, scanned["is_for_document"])["jsondatas"]
+    if not "files" in scanned:
+      scanned = scan_jsondata_files(scanned)
+    jsondatas = filter_jsondata(scanned, boardObject)
+    if irFilename:
+      other = dict(scanned)
+      other["is_for_document"] = not scanned["is_for_document"]
+      otherJsondatas = filter_jsondata(other, boardObject)
+      if scanned["is_for_document"]:
+        views = { "wrapper" : otherJsondatas, "docs" : jsondatas }
+      else:
+        views = { "wrapper" : jsondatas, "docs" : otherJsondatas }
+      # save now, before whoever called us changes anything in jsondatas
+      save_wrapper_ir(irFilename, scanned, boardObject, views)
+    return jsondatas
+
 # Takes the data from get_jsondata and restructures it in prepartion for output as JS
 #
 # Results look like:,
@@ -397,6 +859,32 @@ def get_struct_from_jsondata(jsondata):
 
   return context
 
+# An index of jsondata, so we can find items by type, class and name without searching
+# the whole list. { (type, class, name) : [ jsondata, ... ] } where class/name are None if
+# they're not defined. There can be more than one item with the same key, eg. for docs
+def get_jsondata_key(jsondata):
+  return (jsondata["type"], jsondata.get("class"), jsondata.get("name"))
+
+def get_jsondata_key_name(jsondata):
+  return ".".join([jsondata[k] for k in ["class","name"] if k in jsondata])
+
+def add_to_jsondata_index(index, jsondata):
+  key = get_jsondata_key(jsondata)
+  if key in index: index[key].append(jsondata)
+  else: index[key] = [ jsondata ]
+
+def get_jsondata_index(jsondatas):
+  index = {}
+  for jsondata in jsondatas:
+    add_to_jsondata_index(index, jsondata)
+  return index
+
+# Return the first item with the given type/class/name, or None
+def find_jsondata(index, type, className, name = None):
+  items = index.get((type, className, name))
+  if items: return items[0]
+  return None
+
 def get_includes_from_jsondata(jsondatas):
         includes = []
         for jsondata in jsondatas:
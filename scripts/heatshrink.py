@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Heatshrink compression, producing data that can be decoded by heatshrink_decode in
+# libs/compression/compress_heatshrink.c (and require("heatshrink").decompress)
+#
+# USAGE: heatshrink.py file [file ...] - print compressed sizes
+# ----------------------------------------------------------------------------------------
+
+import sys;
+
+# These must match libs/compression/heatshrink/heatshrink_config.h
+WINDOW_BITS = 8
+LOOKAHEAD_BITS = 6
+
+class BitWriter:
+  def __init__(self):
+    self.data = bytearray()
+    self.byte = 0
+    self.bits = 0
+
+  def write(self, value, count):
+    for i in reversed(range(count)):
+      self.byte = (self.byte << 1) | ((value >> i) & 1)
+      self.bits += 1
+      if self.bits==8:
+        self.data.append(self.byte)
+        self.byte = 0
+        self.bits = 0
+
+  def finish(self):
+    if self.bits: # pad with zeros - the decoder can't read a whole backref from them
+      self.data.append(self.byte << (8-self.bits))
+      self.bits = 0
+    return self.data
+
+# Compress a bytes/bytearray, returns a bytearray
+def encode(data, windowBits=WINDOW_BITS, lookaheadBits=LOOKAHEAD_BITS):
+  data = bytearray(data)
+  windowSize = 1 << windowBits
+  maxLength = 1 << lookaheadBits
+  # a backref is 1+windowBits+lookaheadBits bits and a literal is 9, so only use
+  # backrefs when they're at least this long
+  minLength = (1 + windowBits + lookaheadBits) // 8 + 1
+  out = BitWriter()
+  positions = {} # pairs of bytes -> list of positions they occurred at
+  i = 0
+  while i<len(data):
+    bestLength = 0
+    bestOffset = 0
+    key = bytes(data[i:i+2])
+    candidates = positions.get(key, [])
+    for j in reversed(candidates):
+      if i-j > windowSize: break
+      length = 0
+      while length<maxLength and i+length<len(data) and data[j+length]==data[i+length]:
+        length += 1
+      if length>bestLength:
+        bestLength = length
+        bestOffset = i-j
+        if length==maxLength: break
+    if bestLength>=minLength:
+      out.write(0, 1)
+      out.write(bestOffset-1, windowBits)
+      out.write(bestLength-1, lookaheadBits)
+      count = bestLength
+    else:
+      out.write(1, 1)
+      out.write(data[i], 8)
+      count = 1
+    for k in range(i, i+count):
+      if k+1<len(data):
+        positions.setdefault(bytes(data[k:k+2]), []).append(k)
+    i += count
+  return out.finish()
+
+# Decompress a bytes/bytearray, returns a bytearray
+def decode(data, windowBits=WINDOW_BITS, lookaheadBits=LOOKAHEAD_BITS):
+  data = bytearray(data)
+  out = bytearray()
+  bitCount = len(data)*8
+  pos = [0]
+  def read(count):
+    value = 0
+    for i in range(count):
+      value = (value << 1) | ((data[pos[0]>>3] >> (7-(pos[0]&7))) & 1)
+      pos[0] += 1
+    return value
+  while pos[0]<bitCount:
+    if read(1):
+      if pos[0]+8>bitCount: break
+      out.append(read(8))
+    else:
+      if pos[0]+windowBits+lookaheadBits>bitCount: break
+      offset = read(windowBits)+1
+      length = read(lookaheadBits)+1
+      for i in range(length):
+        # the decoder's window starts off full of zeros
+        out.append(out[len(out)-offset] if offset<=len(out) else 0)
+  return out
+
+if __name__ == "__main__":
+  if len(sys.argv)<2:
+    print("USAGE: heatshrink.py file [file ...]")
+    exit(1)
+  for filename in sys.argv[1:]:
+    data = bytearray(open(filename, "rb").read())
+    compressed = encode(data)
+    if decode(compressed)!=data:
+      print("ERROR: "+filename+" didn't decompress correctly")
+      exit(1)
+    print(filename+": "+str(len(data))+" -> "+str(len(compressed))+" bytes")
@@ -52,7 +52,8 @@ Options:
     --no-start-addr         Don't write start addr to output file.
     --overlap=METHOD        What to do when data in files overlapped.
                             Supported variants:
-                            * error -- stop and show error message (default)
+                            * error -- stop and show the overlapped address
+                                       ranges (default)
                             * ignore -- keep data from first file that
                                         contains data at overlapped address
                             * replace -- use data from last file that
@@ -139,7 +140,8 @@ def main(args=None):
     import intelhex
     # TODO: move actual merge code into intelhex package as helper function
     #       and write couple of tests for it.
-    res = intelhex.IntelHex()
+    # segments, so files are merged a block at a time rather than per byte
+    res = intelhex.IntelHexSegments()
 
     def end_addr_inclusive(addr):
         if addr is not None:
@@ -155,7 +157,7 @@ def main(args=None):
             return 1
         if fname == '-':
             fname = sys.stdin
-        ih = intelhex.IntelHex(fname)
+        ih = intelhex.IntelHexSegments(fname)
         if (fstart, fend) != (None, None):
             ih = ih[fstart:end_addr_inclusive(fend)]
         try:
@@ -38,6 +38,8 @@ __docformat__ = "javadoc"
 from array import array
 from binascii import hexlify, unhexlify
 from bisect import bisect_right
+from itertools import groupby
+import mmap
 import os
 import sys
 
@@ -48,9 +50,11 @@ from intelhex.compat import (
     array_tobytes,
     asbytes,
     asstr,
+    bytes_to_int,
     dict_items_g,
     dict_keys,
     dict_keys_g,
+    int_to_bytes,
     range_g,
     range_l,
     )
@@ -64,6 +68,12 @@ class _DeprecatedParam(object):
 _DEPRECATED = _DeprecatedParam()
 
 
+# Translation table for the checksum of a sum of bytes
+_NEGATE_TABLE = bytearray([(-i) & 0x0FF for i in range_g(256)])
+if sys.version_info[0] < 3:
+    _NEGATE_TABLE = str(_NEGATE_TABLE)
+
+
 class IntelHex(object):
     ''' Intel HEX file reader. '''
 
@@ -94,7 +104,7 @@ class IntelHex(object):
                 self.padding = source.padding
                 if source.start_addr:
                     self.start_addr = source.start_addr.copy()
-                self._buf = source._buf.copy()
+                self._buf = dict(source._buf)
             else:
                 raise ValueError("source: bad initializer type")
 
@@ -202,20 +212,205 @@ class IntelHex(object):
             fclose = None
 
         self._offset = 0
-        line = 0
 
         try:
-            decode = self._decode_record
-            try:
-                for s in fobj:
-                    line += 1
-                    decode(s, line)
-            except _EndOfFile:
-                pass
+            lines = fobj.read().split('\n')
         finally:
             if fclose:
                 fclose()
 
+        decode = self._decode_record
+        i = 0
+        try:
+            for size, group in groupby(map(len, lines)):
+                stop = i + len(list(group))
+                # lines of the same length are checked a column at a time
+                # to see if they're all data records
+                n = stop - i
+                text = ''.join(lines[i:stop])
+                if size > 8 and text[0::size] == ':'*n and \
+                        text[7::size] + text[8::size] == '0'*(2*n):
+                    i = self._decode_data_records(lines, i, stop)
+                while i < stop:
+                    # otherwise each line is decoded on its own, apart from
+                    # any runs of data records in between
+                    j = i
+                    while j < stop and lines[j][7:9] == '00' and \
+                            lines[j][:1] == ':':
+                        j += 1
+                    if j > i:
+                        i = self._decode_data_records(lines, i, j)
+                    if i < stop:
+                        decode(lines[i], i+1)
+                        i += 1
+        except _EndOfFile:
+            pass
+
+    def _decode_data_records(self, lines, start, stop):
+        """Decode a run of data records of the same line length. The hex
+        for the whole run is converted at once, all checksums are checked,
+        and the data is joined into contiguous blocks which are checked for
+        overlaps before anything is written. If a record is bad, the records
+        before it are still loaded. If there is an overlap, the records are
+        decoded one at a time with _decode_record to raise the same error.
+
+        @param  lines   lines of HEX file.
+        @param  start   index of the first data record in lines.
+        @param  stop    index after the last data record in lines.
+        @return         index of the first line that wasn't decoded.
+        """
+        n = stop - start
+        text = ''.join(lines[start:stop])
+        size = len(lines[start])
+        hexlen = len(lines[start].rstrip('\r\n')) - 1
+        # every line is the same length, so if only the ':' at the start and
+        # the line endings are removed, the hex is all that's left
+        block = None
+        s = text.replace(':', '').replace('\r', '')
+        endings = [text[i::size] for i in range_g(hexlen+1, size)]
+        if len(s) == n*hexlen and endings == ['\r'*n]*len(endings):
+            try:
+                block = self._decode_contiguous_records(n,
+                            bytearray(unhexlify(asbytes(s))))
+            except (TypeError, ValueError):
+                pass
+        if block is not None:
+            blocks = [block]
+            count = n
+        else:
+            hexes = [s.rstrip('\r\n')[1:] for s in lines[start:stop]]
+            try:
+                bin = bytearray(unhexlify(asbytes(''.join(hexes))))
+            except (TypeError, ValueError):
+                bin = None
+            blocks, count = self._decode_records(hexes, bin)
+        overlap = False
+        end = None
+        for addr, length, data in sorted(blocks, key=lambda b: b[0]):
+            if (end is not None and addr < end) or \
+                    self._has_data(addr, length):
+                overlap = True
+                break
+            end = addr + length
+        if overlap:
+            for i in range_g(start, start+count):
+                self._decode_record(lines[i], i+1)
+        else:
+            for addr, length, data in blocks:
+                if length:
+                    self._put_block(addr, bytearray().join(data))
+        return start + count
+
+    def _decode_contiguous_records(self, n, bin):
+        """Decode data records that are all the same length, with each one
+        following on from the one before. This works on columns of bytes
+        (every length byte, every checksum...) rather than record by record.
+
+        @param  n       number of records.
+        @param  bin     binary of all the records.
+        @return         [addr, length, [data]] or None if the records
+                        aren't like that, or are bad.
+        """
+        size = len(bin) // n
+        if n < 2 or len(bin) != n*size or not 6 <= size <= 257:
+            return None
+        length = size - 5
+        if bin[0::size] != bytearray([length])*n:
+            return None
+        # add up each record in a 16 bit lane of one big number, so the
+        # low byte of every lane is 0 if all checksums are right
+        lanes = bytearray(2*n)
+        total = 0
+        for i in range_g(size):
+            lanes[1::2] = bin[i::size]
+            total += bytes_to_int(lanes)
+        if bytearray(int_to_bytes(total, 2*n))[1::2] != bytearray(n):
+            return None
+        addr = bin[1]*256 + bin[2]
+        if addr + (n-1)*length > 0x0FFFF:
+            return None
+        expected = array('H', range_g(addr, addr + n*length, length))
+        if sys.byteorder == 'little':
+            expected.byteswap()
+        actual = bytearray(2*n)
+        actual[0::2] = bin[1::size]
+        actual[1::2] = bin[2::size]
+        if array_tobytes(expected) != actual:
+            return None
+        data = bytearray(n*length)
+        for i in range_g(length):
+            data[i::length] = bin[4+i::size]
+        return [addr + self._offset, n*length, [data]]
+
+    def _decode_records(self, hexes, bin):
+        """Decode data records one at a time, stopping at the first bad one.
+
+        @param  hexes   hex of each record.
+        @param  bin     binary of all the records, or None.
+        @return         ([[addr, length, [data, ...]], ...], count) with the
+                        contiguous blocks of data and the number of records.
+        """
+        blocks = []
+        pos = 0
+        count = 0
+        for h in hexes:
+            length = len(h) >> 1
+            if bin is None or length*2 != len(h):
+                # find the first bad line one record at a time
+                bin = None
+                try:
+                    rec = bytearray(unhexlify(asbytes(h)))
+                except (TypeError, ValueError):
+                    break
+            else:
+                rec = bin[pos:pos+length]
+                pos += length
+            if length < 5 or rec[0] + 5 != length or sum(rec) & 0x0FF:
+                break
+            addr = rec[1]*256 + rec[2] + self._offset
+            if blocks and blocks[-1][0] + blocks[-1][1] == addr:
+                block = blocks[-1]
+            else:
+                block = [addr, 0, []]
+                blocks.append(block)
+            block[1] += rec[0]
+            block[2].append(rec[4:-1])
+            count += 1
+        return blocks, count
+
+    def _has_data(self, addr, length):
+        """Return True if there is data at any of length addresses from addr."""
+        buf = self._buf
+        if buf:
+            for i in range_g(addr, addr+length):
+                if i in buf:
+                    return True
+        return False
+
+    def _put_block(self, addr, data):
+        """Store a block of bytes at addr."""
+        self._buf.update(zip(range_g(addr, addr+len(data)), data))
+
+    def _overlap_ranges(self, blocks):
+        """Return a list of (start, end) for the ranges of addresses in
+        blocks that already have data, in address order (end exclusive).
+
+        @param  blocks  list of (start, data) in address order, like
+                        _segment_data returns.
+        """
+        buf = self._buf
+        ranges = []
+        for start, data in blocks:
+            end = None
+            for addr in range_g(start, start+len(data)):
+                if addr in buf:
+                    if addr != end:
+                        ranges.append((addr, addr+1))
+                    else:
+                        ranges[-1] = (ranges[-1][0], addr+1)
+                    end = addr+1
+        return ranges
+
     def loadbin(self, fobj, offset=0):
         """Load bin file into internal buffer. Not needed if source set in
         constructor. This will overwrite addresses without warning
@@ -401,10 +596,14 @@ class IntelHex(object):
         else:
             close_fd = False
 
-        fobj.write(self._tobinstr_really(start, end, pad, size))
+        try:
+            self._tobinfile_really(fobj, start, end, pad, size)
+        finally:
+            if close_fd:
+                fobj.close()
 
-        if close_fd:
-            fobj.close()
+    def _tobinfile_really(self, fobj, start, end, pad, size):
+        fobj.write(self._tobinstr_really(start, end, pad, size))
 
     def todict(self):
         '''Convert to python dictionary.
@@ -563,12 +762,17 @@ class IntelHex(object):
         if fwrite:
             fobj = f
             fclose = None
+            eol = IntelHex._get_eol_textfile(eolstyle, sys.platform)
+            tofile = asstr
         else:
-            fobj = open(f, 'w')
+            # written as binary, so the line endings aren't translated
+            fobj = open(f, 'wb')
             fwrite = fobj.write
             fclose = fobj.close
-
-        eol = IntelHex._get_eol_textfile(eolstyle, sys.platform)
+            eol = IntelHex._get_eol_textfile(eolstyle, sys.platform)
+            if eol == '\n':
+                eol = os.linesep
+            tofile = asbytes
 
         # Translation table for uppercasing hex ascii string.
         # timeit shows that using hexstr.translate(table)
@@ -599,9 +803,9 @@ class IntelHex(object):
                 bin[6] = (ip >> 8) & 0x0FF
                 bin[7] = ip & 0x0FF
                 bin[8] = (-sum(bin)) & 0x0FF    # chksum
-                fwrite(':' +
+                fwrite(tofile(':' +
                        asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                       eol)
+                       eol))
             elif keys == ['EIP']:
                 # Start Linear Address Record
                 bin[0] = 4      # reclen
@@ -614,101 +818,131 @@ class IntelHex(object):
                 bin[6] = (eip >> 8) & 0x0FF
                 bin[7] = eip & 0x0FF
                 bin[8] = (-sum(bin)) & 0x0FF    # chksum
-                fwrite(':' +
+                fwrite(tofile(':' +
                        asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                       eol)
+                       eol))
             else:
                 if fclose:
                     fclose()
                 raise InvalidStartAddressValueError(start_addr=self.start_addr)
 
         # data
-        addresses = dict_keys(self._buf)
-        addresses.sort()
-        addr_len = len(addresses)
-        if addr_len:
-            minaddr = addresses[0]
-            maxaddr = addresses[-1]
-
-            if maxaddr > 65535:
-                need_offset_record = True
-            else:
-                need_offset_record = False
-            high_ofs = 0
-
-            cur_addr = minaddr
-            cur_ix = 0
-
-            while cur_addr <= maxaddr:
-                if need_offset_record:
+        blocks = self._segment_data()
+        if blocks:
+            start, data = blocks[-1]
+            need_offset_record = start + len(data) - 1 > 65535
+        high_ofs = None
+        beol = asbytes(eol)
+        for start, data in blocks:
+            # as bytes, since Python 2 can't do strided slices of memoryviews
+            view = bytes(data)
+            addr = start
+            end = start + len(data)
+            while addr < end:
+                if need_offset_record and (addr >> 16) != high_ofs:
                     bin = array('B', asbytes('\0'*7))
                     bin[0] = 2      # reclen
                     bin[1] = 0      # offset msb
                     bin[2] = 0      # offset lsb
                     bin[3] = 4      # rectyp
-                    high_ofs = int(cur_addr>>16)
+                    high_ofs = int(addr>>16)
                     b = divmod(high_ofs, 256)
                     bin[4] = b[0]   # msb of high_ofs
                     bin[5] = b[1]   # lsb of high_ofs
                     bin[6] = (-sum(bin)) & 0x0FF    # chksum
-                    fwrite(':' +
+                    fwrite(tofile(':' +
                            asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                           eol)
-
-                while True:
-                    # produce one record
-                    low_addr = cur_addr & 0x0FFFF
-                    # chain_len off by 1
-                    chain_len = min(byte_count-1, 65535-low_addr, maxaddr-cur_addr)
-
-                    # search continuous chain
-                    stop_addr = cur_addr + chain_len
-                    if chain_len:
-                        ix = bisect_right(addresses, stop_addr,
-                                          cur_ix,
-                                          min(cur_ix+chain_len+1, addr_len))
-                        chain_len = ix - cur_ix     # real chain_len
-                        # there could be small holes in the chain
-                        # but we will catch them by try-except later
-                        # so for big continuous files we will work
-                        # at maximum possible speed
-                    else:
-                        chain_len = 1               # real chain_len
-
-                    bin = array('B', asbytes('\0'*(5+chain_len)))
-                    b = divmod(low_addr, 256)
-                    bin[1] = b[0]   # msb of low_addr
-                    bin[2] = b[1]   # lsb of low_addr
-                    bin[3] = 0          # rectype
-                    try:    # if there is small holes we'll catch them
-                        for i in range_g(chain_len):
-                            bin[4+i] = self._buf[cur_addr+i]
-                    except KeyError:
-                        # we catch a hole so we should shrink the chain
-                        chain_len = i
-                        bin = bin[:5+i]
-                    bin[0] = chain_len
-                    bin[4+chain_len] = (-sum(bin)) & 0x0FF    # chksum
-                    fwrite(':' +
-                           asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                           eol)
-
-                    # adjust cur_addr/cur_ix
-                    cur_ix += chain_len
-                    if cur_ix < addr_len:
-                        cur_addr = addresses[cur_ix]
-                    else:
-                        cur_addr = maxaddr + 1
-                        break
-                    high_addr = int(cur_addr>>16)
-                    if high_addr > high_ofs:
-                        break
+                           eol))
+                # records don't go past the end of a 64K page
+                page_end = min(end, (addr | 0x0FFFF) + 1)
+                fwrite(tofile(IntelHex._data_records(addr & 0x0FFFF,
+                       view[addr-start:page_end-start], byte_count, beol,
+                       table)))
+                addr = page_end
 
         # end-of-file record
-        fwrite(":00000001FF"+eol)
+        fwrite(tofile(":00000001FF"+eol))
         if fclose:
             fclose()
 
+    def _segment_data(self):
+        """Return a list of (start, data) for each contiguous block of
+        data, in address order, with the data as a bytearray.
+        """
+        buf = self._buf
+        addresses = dict_keys(buf)
+        addresses.sort()
+        blocks = []
+        end = None
+        for addr in addresses:
+            if addr != end:
+                data = bytearray()
+                blocks.append((addr, data))
+            data.append(buf[addr])
+            end = addr + 1
+        return blocks
+
+    def _data_records(offset, data, byte_count, eol, table):
+        """Return data records (as bytes) for data from the 16 bit offset.
+        All the records that are byte_count long are done together.
+
+        @param  offset      offset of the first byte (data must not go
+                            past the end of the 64K page).
+        @param  data        bytes of data.
+        @param  byte_count  number of bytes in the data field.
+        @param  eol         line ending as bytes.
+        @param  table       translation table for uppercasing hex.
+        """
+        n = len(data) // byte_count
+        size = byte_count + 5
+        records = []
+        if n > 1 and (size-1) * 255 <= 0x0FFFF:
+            bin = bytearray(n*size)
+            bin[0::size] = bytearray([byte_count])*n
+            addrs = array('H', range_g(offset, offset + n*byte_count, byte_count))
+            if sys.byteorder == 'little':
+                addrs.byteswap()
+            addrs = array_tobytes(addrs)
+            bin[1::size] = addrs[0::2]
+            bin[2::size] = addrs[1::2]
+            for i in range_g(byte_count):
+                bin[4+i::size] = data[i:n*byte_count:byte_count]
+            # add up each record in a 16 bit lane of one big number, so
+            # the low byte of each lane is the sum for that record
+            lanes = bytearray(2*n)
+            total = 0
+            for i in range_g(size-1):
+                lanes[1::2] = bin[i::size]
+                total += bytes_to_int(lanes)
+            sums = bytearray(int_to_bytes(total, 2*n))[1::2]
+            bin[size-1::size] = sums.translate(_NEGATE_TABLE)
+            # then put ':' and the line ending around each record's hex
+            hexstr = hexlify(bin).translate(table)
+            line = 1 + 2*size + len(eol)
+            text = bytearray(n*line)
+            text[0::line] = asbytes(':'*n)
+            for i in range_g(2*size):
+                text[1+i::line] = hexstr[i::2*size]
+            for i in range_g(len(eol)):
+                text[1+2*size+i::line] = eol[i:i+1]*n
+            records.append(bytes(text))
+            offset += n*byte_count
+            data = data[n*byte_count:]
+        while len(data):
+            chain_len = min(byte_count, len(data))
+            bin = bytearray(5+chain_len)
+            bin[0] = chain_len
+            bin[1] = offset >> 8    # msb of offset
+            bin[2] = offset & 0x0FF # lsb of offset
+            bin[3] = 0              # rectype
+            bin[4:4+chain_len] = data[:chain_len]
+            bin[4+chain_len] = (-sum(bin)) & 0x0FF    # chksum
+            records.append(asbytes(':') + hexlify(bin).translate(table) + eol)
+            offset += chain_len
+            data = data[chain_len:]
+        return asbytes('').join(records)
+    _data_records = staticmethod(_data_records)
+
     def tofile(self, fobj, format, byte_count=16):
         """Write data to hex or bin file. Preferred method over tobin or tohex.
 
@@ -856,7 +1090,10 @@ class IntelHex(object):
         @raise  ValueError      if other is the same object as self 
                                 (it can't merge itself)
         @raise  ValueError      if overlap argument has incorrect value
-        @raise  AddressOverlapError    on overlapped data
+        @raise  AddressOverlapError    on overlapped data, with the ranges
+                                       of addresses that overlap as a
+                                       list of (start, end) in its ranges
+                                       attribute (end exclusive)
         """
         # check args
         if not isinstance(other, IntelHex):
@@ -866,17 +1103,18 @@ class IntelHex(object):
         if overlap not in ('error', 'ignore', 'replace'):
             raise ValueError("overlap argument should be either "
                 "'error', 'ignore' or 'replace'")
-        # merge data
-        this_buf = self._buf
-        other_buf = other._buf
-        for i in other_buf:
-            if i in this_buf:
-                if overlap == 'error':
-                    raise AddressOverlapError(
-                        'Data overlapped at address 0x%X' % i)
-                elif overlap == 'ignore':
-                    continue
-            this_buf[i] = other_buf[i]
+        # merge data, a block at a time
+        blocks = other._segment_data()
+        ranges = self._overlap_ranges(blocks)
+        if ranges:
+            if overlap == 'error':
+                raise AddressOverlapError(_overlap_message(ranges),
+                                          address=ranges[0][0],
+                                          ranges=ranges)
+            elif overlap == 'ignore':
+                blocks = _remove_ranges(blocks, ranges)
+        for start, data in blocks:
+            self._put_block(start, data)
         # merge start_addr
         if self.start_addr != other.start_addr:
             if self.start_addr is None:     # set start addr from other
@@ -1032,6 +1270,586 @@ class IntelHex16bit(IntelHex):
 #/class IntelHex16bit
 
 
+def _overlap_message(ranges):
+    """Return the message for data overlapping in ranges of addresses."""
+    if len(ranges) == 1 and ranges[0][1] - ranges[0][0] == 1:
+        return 'Data overlapped at address 0x%X' % ranges[0][0]
+    return 'Data overlapped at addresses ' + ', '.join([
+        end - start == 1 and '0x%X' % start or '0x%X-0x%X' % (start, end-1)
+        for start, end in ranges])
+
+
+def _remove_ranges(blocks, ranges):
+    """Return blocks without the data in ranges.
+
+    @param  blocks  list of (start, data) in address order.
+    @param  ranges  list of (start, end) in address order (end exclusive),
+                    each inside one of the blocks.
+    @return         list of (start, data) for what's left of the blocks.
+    """
+    result = []
+    i = 0
+    for start, data in blocks:
+        addr = start
+        end = start + len(data)
+        while i < len(ranges) and ranges[i][0] < end:
+            lo, hi = ranges[i]
+            if lo > addr:
+                result.append((addr, data[addr-start:lo-start]))
+            addr = hi
+            i += 1
+        if addr < end:
+            result.append((addr, data[addr-start:]))
+    return result
+
+
+class _SegmentBuffer(object):
+    """Data of IntelHexSegments: sorted contiguous segments of bytes.
+
+    Segments are kept as a sorted list of start addresses and a parallel
+    list of bytearrays. Segments never overlap or touch each other, so each
+    one is a contiguous block of occupied addresses. Works as a mapping of
+    address to byte value (like the dict used by IntelHex) so the methods
+    of IntelHex that aren't overridden still work on it.
+
+    A segment can also be a read only memoryview (eg. of a memory mapped
+    file, see insert), which is copied into a bytearray when it's changed.
+    """
+
+    def __init__(self, source=None):
+        self._starts = []
+        self._data = []
+        if source is not None:
+            self.update(source)
+
+    def _find(self, addr):
+        """Return (index, offset) of addr in the segments, or (None, None)."""
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0:
+            offset = addr - self._starts[i]
+            if offset < len(self._data[i]):
+                return i, offset
+        return None, None
+
+    def get(self, addr, default=None):
+        i, offset = self._find(addr)
+        if i is None:
+            return default
+        return self._data[i][offset]
+
+    def __getitem__(self, addr):
+        i, offset = self._find(addr)
+        if i is None:
+            raise KeyError(addr)
+        return self._data[i][offset]
+
+    def __contains__(self, addr):
+        return self._find(addr)[0] is not None
+
+    def _writable(self, i):
+        """Return segment i as a bytearray, copying it if it was read only."""
+        buf = self._data[i]
+        if not isinstance(buf, bytearray):
+            buf = self._data[i] = bytearray(buf)
+        return buf
+
+    has_key = __contains__
+
+    def __setitem__(self, addr, byte):
+        starts = self._starts
+        data = self._data
+        i = bisect_right(starts, addr) - 1
+        if i >= 0:
+            offset = addr - starts[i]
+            if offset < len(data[i]):
+                self._writable(i)[offset] = byte
+                return
+            if offset == len(data[i]):
+                buf = self._writable(i)
+                buf.append(byte)
+                # join the next segment if this filled the gap to it
+                if i+1 < len(starts) and starts[i+1] == addr+1:
+                    buf += data[i+1]
+                    del starts[i+1]
+                    del data[i+1]
+                return
+        if i+1 < len(starts) and starts[i+1] == addr+1:
+            self._writable(i+1)[0:0] = bytearray((byte,))
+            starts[i+1] = addr
+        else:
+            starts.insert(i+1, addr)
+            data.insert(i+1, bytearray((byte,)))
+
+    def __delitem__(self, addr):
+        i, offset = self._find(addr)
+        if i is None:
+            raise KeyError(addr)
+        if len(self._data[i]) == 1:
+            del self._starts[i]
+            del self._data[i]
+            return
+        buf = self._writable(i)
+        if offset == 0:
+            del buf[0]
+            self._starts[i] += 1
+        elif offset == len(buf)-1:
+            del buf[offset]
+        else:
+            self._starts.insert(i+1, addr+1)
+            self._data.insert(i+1, buf[offset+1:])
+            del buf[offset:]
+
+    def write(self, addr, data):
+        """Write a run of bytes at addr, overwriting any existing data.
+
+        @param  addr    address of the first byte.
+        @param  data    bytes, bytearray, array('B') or list of byte values.
+        """
+        if not len(data):
+            return
+        starts = self._starts
+        segs = self._data
+        end = addr + len(data)
+        # segments that overlap or touch [addr, end) are joined into one
+        first = bisect_right(starts, addr) - 1
+        if first < 0 or starts[first] + len(segs[first]) < addr:
+            first += 1
+        last = bisect_right(starts, end) - 1
+        if first > last:
+            starts.insert(first, addr)
+            segs.insert(first, bytearray(data))
+            return
+        last_start = starts[last]
+        last_buf = segs[last]
+        start = starts[first]
+        if start <= addr:
+            buf = self._writable(first)
+            buf[addr-start:end-start] = bytearray(data)
+            if first == last:
+                return
+        else:
+            start = addr
+            buf = bytearray(data)
+        if last_start + len(last_buf) > end:
+            buf += last_buf[end-last_start:]
+        del starts[first+1:last+1]
+        del segs[first+1:last+1]
+        starts[first] = start
+        segs[first] = buf
+
+    def insert(self, addr, data):
+        """Add data at addr as a segment without copying it, if it doesn't
+        overlap or touch any other segment. Otherwise it's copied with write.
+
+        @param  addr    address of the first byte.
+        @param  data    read only memoryview of bytes.
+        """
+        if not len(data):
+            return
+        starts = self._starts
+        i = bisect_right(starts, addr) - 1
+        if (i >= 0 and starts[i] + len(self._data[i]) >= addr) or \
+                (i+1 < len(starts) and starts[i+1] <= addr + len(data)):
+            self.write(addr, data)
+        else:
+            starts.insert(i+1, addr)
+            self._data.insert(i+1, data)
+
+    def overlaps(self, addr, length):
+        """Return True if any of length addresses from addr have data."""
+        i = bisect_right(self._starts, addr+length-1) - 1
+        return i >= 0 and self._starts[i] + len(self._data[i]) > addr
+
+    def overlap_ranges(self, addr, length):
+        """Return a list of (start, end) for the parts of the length
+        addresses from addr that have data (end exclusive).
+        """
+        starts = self._starts
+        end = addr + length
+        i = max(bisect_right(starts, addr) - 1, 0)
+        ranges = []
+        while i < len(starts) and starts[i] < end:
+            lo = max(starts[i], addr)
+            hi = min(starts[i] + len(self._data[i]), end)
+            if lo < hi:
+                ranges.append((lo, hi))
+            i += 1
+        return ranges
+
+    def read(self, addr, length):
+        """Return length bytes from addr as bytes, or None if any are missing."""
+        i, offset = self._find(addr)
+        if i is None or offset+length > len(self._data[i]):
+            return None
+        return bytes(self._data[i][offset:offset+length])
+
+    def segments(self):
+        """Return a list of (start, end) for each segment (end exclusive)."""
+        return [(start, start+len(buf))
+                for start, buf in zip(self._starts, self._data)]
+
+    def iter_segments(self):
+        """Yield (start, bytearray) for each segment in address order."""
+        return zip(self._starts, self._data)
+
+    def minaddr(self):
+        if not self._starts:
+            return None
+        return self._starts[0]
+
+    def maxaddr(self):
+        if not self._starts:
+            return None
+        return self._starts[-1] + len(self._data[-1]) - 1
+
+    def __len__(self):
+        return sum([len(buf) for buf in self._data])
+
+    def __iter__(self):
+        for start, buf in zip(self._starts, self._data):
+            for addr in range_g(start, start+len(buf)):
+                yield addr
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [byte for buf in self._data for byte in buf]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iteritems(self):
+        for start, buf in zip(self._starts, self._data):
+            for offset, byte in enumerate(buf):
+                yield start+offset, byte
+
+    def copy(self):
+        other = _SegmentBuffer()
+        other._starts = self._starts[:]
+        # read only segments can be shared
+        other._data = [isinstance(buf, bytearray) and bytearray(buf) or buf
+                       for buf in self._data]
+        return other
+
+    def update(self, source):
+        """Update from a mapping of address to byte value."""
+        if isinstance(source, _SegmentBuffer):
+            for start, buf in source.iter_segments():
+                if isinstance(buf, bytearray):
+                    self.write(start, buf)
+                else:
+                    self.insert(start, buf)
+            return
+        # sorted, so that bytes mostly get appended to segments
+        keys = dict_keys(source)
+        keys.sort()
+        for addr in keys:
+            self[addr] = source[addr]
+
+    def clear(self):
+        self._starts = []
+        self._data = []
+
+    def __eq__(self, other):
+        if isinstance(other, _SegmentBuffer):
+            return self._starts == other._starts and self._data == other._data
+        if isinstance(other, dict):
+            if len(other) != len(self):
+                return False
+            for addr, byte in self.iteritems():
+                if other.get(addr) != byte:
+                    return False
+            return True
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __sizeof__(self):
+        n = object.__sizeof__(self)
+        n += sys.getsizeof(self._starts) + sys.getsizeof(self._data)
+        n += sum([sys.getsizeof(a) for a in self._starts])
+        n += sum([sys.getsizeof(buf) for buf in self._data])
+        return n
+
+#/class _SegmentBuffer
+
+
+def _release(views):
+    """Release the memoryviews in a list, so the bytearrays they're views of
+    can be resized again straight away (no release in Python 2).
+    """
+    for view in views:
+        release = getattr(view, "release", None)
+        if release is not None:
+            release()
+
+
+class IntelHexSegments(IntelHex):
+    """IntelHex with data stored as sorted contiguous segments of bytes
+    rather than a dict with an entry for every address. Uses much less
+    memory for big files, and works on whole segments when converting to
+    binary and slicing, but setting single bytes that don't extend a
+    segment is slower. Otherwise it works just like IntelHex.
+    """
+
+    def __init__(self, source=None):
+        """Constructor. Takes the same sources as IntelHex.
+
+        @param  source      source for initialization
+                            (file name of HEX file, file object, addr dict or
+                             other IntelHex object)
+        """
+        IntelHex.__init__(self)
+
+        if source is not None:
+            if isinstance(source, StrType) or getattr(source, "read", None):
+                # load hex file
+                self.loadhex(source)
+            elif isinstance(source, dict):
+                self.fromdict(source)
+            elif isinstance(source, IntelHex):
+                self.padding = source.padding
+                if source.start_addr:
+                    self.start_addr = source.start_addr.copy()
+                self._buf.update(source._buf)
+            else:
+                raise ValueError("source: bad initializer type")
+
+    def _get_buf(self):
+        return self._segments
+
+    def _set_buf(self, buf):
+        # anything else setting _buf gets a copy as segments
+        if not isinstance(buf, _SegmentBuffer):
+            buf = _SegmentBuffer(buf)
+        self._segments = buf
+
+    _buf = property(_get_buf, _set_buf)
+
+    def frombytes(self, bytes, offset=0):
+        """Load data from array or list of bytes.
+        Similar to loadbin() method but works directly with iterable bytes.
+        """
+        self._buf.write(offset, bytearray(bytes))
+
+    def _segment_data(self):
+        """Return a list of (start, data) for each contiguous block of
+        data, in address order, with the data as a bytearray.
+        """
+        return list(self._buf.iter_segments())
+
+    def _has_data(self, addr, length):
+        """Return True if there is data at any of length addresses from addr."""
+        return length > 0 and self._buf.overlaps(addr, length)
+
+    def _put_block(self, addr, data):
+        """Store a block of bytes at addr."""
+        self._buf.write(addr, data)
+
+    def _overlap_ranges(self, blocks):
+        """Return a list of (start, end) for the ranges of addresses in
+        blocks that already have data, in address order (end exclusive).
+        """
+        ranges = []
+        for start, data in blocks:
+            ranges.extend(self._buf.overlap_ranges(start, len(data)))
+        return ranges
+
+    def loadbin(self, fobj, offset=0, use_mmap=False):
+        """Load bin file into internal buffer. Not needed if source set in
+        constructor. This will overwrite addresses without warning
+        if object was already initialized.
+
+        @param  fobj        file name or file-like object
+        @param  offset      starting address offset
+        @param  use_mmap    memory map the file rather than reading it, so
+                            the data is only read from the file when used.
+                            The file must not be changed while this object
+                            is in use. Falls back to reading the file if it
+                            can't be memory mapped.
+        """
+        if not use_mmap:
+            return IntelHex.loadbin(self, fobj, offset)
+        if getattr(fobj, "read", None) is None:
+            f = open(fobj, "rb")
+        else:
+            f = fobj
+        try:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mm)[f.tell():]
+            except (AttributeError, TypeError, ValueError, EnvironmentError):
+                # not a real file, empty, or no memoryview of mmap (Python 2)
+                return IntelHex.loadbin(self, f, offset)
+            self._buf.insert(offset, view)
+        finally:
+            if f is not fobj:
+                f.close()
+
+    def _tobin_chunks(self, start, end, pad, size):
+        """Return the binary form of [start, end] as a list of padding
+        bytearrays and memoryview slices of the segments, without copying
+        the data. Returns an empty list if there's no data and start or end
+        is None.
+        """
+        if pad is None:
+            pad = self.padding
+        if not self._buf._starts and None in (start, end):
+            return []
+        if size is not None and size <= 0:
+            raise ValueError("tobinarray: wrong value for size")
+        start, end = self._get_start_end(start, end, size)
+        chunks = []
+        addr = start
+        for seg_start, buf in self._buf.iter_segments():
+            seg_end = seg_start + len(buf)
+            if seg_end <= addr:
+                continue
+            if seg_start > end:
+                break
+            if seg_start > addr:
+                chunks.append(bytearray((pad,)) * (seg_start-addr))
+                addr = seg_start
+            hi = min(seg_end, end+1)
+            chunks.append(memoryview(buf)[addr-seg_start:hi-seg_start])
+            addr = hi
+        if addr <= end:
+            chunks.append(bytearray((pad,)) * (end+1-addr))
+        return chunks
+
+    def _tobinbytes(self, start, end, pad, size):
+        """Return binary data as a bytearray."""
+        chunks = self._tobin_chunks(start, end, pad, size)
+        bin = bytearray()
+        # not join, which doesn't take memoryviews in Python 2
+        for chunk in chunks:
+            bin += chunk
+        _release(chunks)
+        return bin
+
+    def _tobinarray_really(self, start, end, pad, size):
+        """Return binary array."""
+        return array('B', self._tobinbytes(start, end, pad, size))
+
+    def _tobinstr_really(self, start, end, pad, size):
+        return bytes(self._tobinbytes(start, end, pad, size))
+
+    def _tobinfile_really(self, fobj, start, end, pad, size):
+        # write each segment straight from the buffer, without joining
+        chunks = self._tobin_chunks(start, end, pad, size)
+        try:
+            for chunk in chunks:
+                fobj.write(chunk)
+        finally:
+            _release(chunks)
+
+    def tobinview(self, start=None, end=None, size=None):
+        """Convert to binary form and return as a read only memoryview.
+        If the whole range is in one memory mapped segment (see loadbin)
+        the view is of the file's data, without any copying. Otherwise
+        the data is copied like tobinstr. Padding uses self.padding.
+
+        @param  start   start address of output bytes.
+        @param  end     end address of output bytes (inclusive).
+        @param  size    size of the block, used with start or end parameter.
+        @return         memoryview of binary data.
+        """
+        chunks = self._tobin_chunks(start, end, None, size)
+        if len(chunks) == 1 and isinstance(chunks[0], memoryview) \
+                and chunks[0].readonly:
+            return chunks[0]
+        _release(chunks)
+        return memoryview(self._tobinstr_really(start, end, None, size))
+
+    def addresses(self):
+        '''Returns all used addresses in sorted order.
+        @return         list of occupied data addresses in sorted order. 
+        '''
+        return self._buf.keys()
+
+    def minaddr(self):
+        '''Get minimal address of HEX content.
+        @return         minimal address or None if no data
+        '''
+        return self._buf.minaddr()
+
+    def maxaddr(self):
+        '''Get maximal address of HEX content.
+        @return         maximal address or None if no data
+        '''
+        return self._buf.maxaddr()
+
+    def __getitem__(self, addr):
+        ''' Get requested byte from address.
+        @param  addr    address of byte.
+        @return         byte if address exists in HEX file, or self.padding
+                        if no data found.
+        '''
+        if type(addr) != slice or addr.step not in (None, 1):
+            return IntelHex.__getitem__(self, addr)
+        ih = IntelHexSegments()
+        if self._buf._starts:
+            start = addr.start or self._buf.minaddr()
+            stop = addr.stop or (self._buf.maxaddr()+1)
+            for seg_start, buf in self._buf.iter_segments():
+                seg_end = seg_start + len(buf)
+                if seg_end <= start:
+                    continue
+                if seg_start >= stop:
+                    break
+                lo = max(seg_start, start)
+                hi = min(seg_end, stop)
+                ih._buf.write(lo, buf[lo-seg_start:hi-seg_start])
+        return ih
+
+    def __len__(self):
+        """Return count of bytes with real values."""
+        return len(self._buf)
+
+    def gets(self, addr, length):
+        """Get string of bytes from given address. If any entries are blank
+        from addr through addr+length, a NotEnoughDataError exception will
+        be raised. Padding is not used.
+        """
+        s = self._buf.read(addr, length)
+        if s is None:
+            raise NotEnoughDataError(address=addr, length=length)
+        return s
+
+    def puts(self, addr, s):
+        """Put string of bytes at given address. Will overwrite any previous
+        entries.
+        """
+        self._buf.write(addr, asbytes(s))
+
+    def segments(self, min_gap=1):
+        """Return a list of ordered tuple objects, representing contiguous occupied data addresses.
+        Each tuple has a length of two and follows the semantics of the range and xrange objects.
+        The second entry of the tuple is always an integer greater than the first entry.
+        @param min_gap      the minimum gap size between data in order to separate the segments
+        """
+        result = []
+        for start, end in self._buf.segments():
+            # the gap is from the last address of a segment to the next one
+            if result and start - (result[-1][1]-1) <= min_gap:
+                result[-1] = (result[-1][0], end)
+            else:
+                result.append((start, end))
+        return result
+
+#/class IntelHexSegments
+
+
 def hex2bin(fin, fout, start=None, end=None, size=None, pad=None):
     """Hex-to-Bin convertor engine.
     @return     0   if all OK
@@ -75,6 +75,11 @@ if sys.version_info[0] >= 3:
     def dict_items_g(dikt):     # dict items generator
         return dikt.items()
 
+    def bytes_to_int(b):        # big-endian bytes to int
+        return int.from_bytes(b, 'big')
+    def int_to_bytes(i, length):    # int to big-endian bytes
+        return i.to_bytes(length, 'big')
+
     from io import StringIO, BytesIO
 
     def get_binary_stdout():
@@ -138,6 +143,12 @@ else:
     def dict_items_g(dikt):     # dict items generator
         return dikt.items()
 
+    from binascii import hexlify, unhexlify
+    def bytes_to_int(b):        # big-endian bytes to int
+        return long(hexlify(b) or '0', 16)
+    def int_to_bytes(i, length):    # int to big-endian bytes
+        return unhexlify('%0*x' % (2*length, i))
+
     from cStringIO import StringIO
     BytesIO = StringIO
 
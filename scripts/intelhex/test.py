@@ -1170,6 +1170,32 @@ class TestIntelHexMerge(TestIntelHexBase):
         ih1.merge(ih2, overlap='replace')
         self.assertEqual({0:2}, ih1.todict())
 
+    def test_merge_overlap_ranges(self):
+        data1 = dict([(i, 1) for i in range_l(0x10, 0x20) + [0x30, 0x40]])
+        data2 = dict([(i, 2) for i in range_g(0x18, 0x38)])
+        # error, with all the overlapped ranges and no data merged
+        ih1 = IntelHex(data1)
+        try:
+            ih1.merge(IntelHex(data2))
+            self.fail('AddressOverlapError not raised')
+        except AddressOverlapError:
+            e = sys.exc_info()[1]
+            self.assertEqual('Data overlapped at addresses 0x18-0x1F, 0x30',
+                             str(e))
+            self.assertEqual([(0x18, 0x20), (0x30, 0x31)], e.ranges)
+        self.assertEqual(data1, ih1.todict())
+        # ignore
+        ih1.merge(IntelHex(data2), overlap='ignore')
+        expected = dict(data2)
+        expected.update(data1)
+        self.assertEqual(expected, ih1.todict())
+        # replace
+        ih1 = IntelHex(data1)
+        ih1.merge(IntelHex(data2), overlap='replace')
+        expected = dict(data1)
+        expected.update(data2)
+        self.assertEqual(expected, ih1.todict())
+
     def test_merge_start_addr(self):
         # this, None
         ih1 = IntelHex({'start_addr': {'EIP': 0x12345678}})
@@ -1793,6 +1819,210 @@ class TestWriteHexFileByteCount(unittest.TestCase):
         self.assertEqual(ih.tobinstr(), ih2.tobinstr(),
                          "Written hex file does not equal with original")
 
+class TestIntelHexSegments(TestIntelHexBase):
+    """Test that IntelHexSegments works like IntelHex"""
+
+    def test_read_write_hex_file(self):
+        for hexstr in (hex8, hex64k):
+            ih = intelhex.IntelHex(StringIO(hexstr))
+            ihs = intelhex.IntelHexSegments(StringIO(hexstr))
+            self.assertEqual(ih.todict(), ihs.todict())
+            self.assertEqual(ih.segments(), ihs.segments())
+            self.assertEqual(ih.segments(min_gap=16), ihs.segments(min_gap=16))
+            self.assertEqual(ih.tobinstr(), ihs.tobinstr())
+            self.assertEqual(ih.tobinstr(start=0x100, size=0x400),
+                             ihs.tobinstr(start=0x100, size=0x400))
+            sio = StringIO()
+            ih.write_hex_file(sio)
+            sio2 = StringIO()
+            ihs.write_hex_file(sio2)
+            self.assertEqualWrittenData(sio.getvalue(), sio2.getvalue())
+
+    def test_segments_join_and_split(self):
+        ih = intelhex.IntelHexSegments()
+        ih[2] = 1
+        ih[4] = 3
+        self.assertEqual([(2,3), (4,5)], ih.segments())
+        ih[3] = 2
+        self.assertEqual([(2,5)], ih.segments())
+        ih[1] = 0
+        ih.puts(5, asbytes('\x04\x05'))
+        self.assertEqual([(1,7)], ih.segments())
+        self.assertEqual({1:0, 2:1, 3:2, 4:3, 5:4, 6:5}, ih.todict())
+        del ih[3]
+        self.assertEqual([(1,3), (4,7)], ih.segments())
+        self.assertEqual(5, len(ih))
+        self.assertEqual(asbytes('\x03\x04\x05'), ih.gets(4, 3))
+        self.assertRaises(intelhex.NotEnoughDataError, ih.gets, 1, 3)
+        ih.puts(0, asbytes('\x10\x11\x12\x13\x14'))
+        self.assertEqual([(0,7)], ih.segments())
+        self.assertEqual(asbytes('\x10\x11\x12\x13\x14\x04\x05'), ih.gets(0, 7))
+
+    def test_slice_and_copy(self):
+        ih = intelhex.IntelHexSegments({0:1, 1:2, 2:3, 10:4})
+        ih2 = ih[1:11]
+        self.assertTrue(isinstance(ih2, intelhex.IntelHexSegments))
+        self.assertEqual({1:2, 2:3, 10:4}, ih2.todict())
+        self.assertEqual({0:1, 2:3, 10:4}, ih[::2].todict())
+        self.assertEqual({0:1, 1:2, 2:3, 10:4}, ih._buf)
+        ih3 = intelhex.IntelHex(ih)
+        self.assertEqual({0:1, 1:2, 2:3, 10:4}, ih3._buf)
+        self.assertEqual(ih._buf, intelhex.IntelHexSegments(ih3)._buf)
+
+    def test_write_hex_file_pages(self):
+        # records are split at the end of each 64K page and at gaps
+        data = dict([(0xFF00+i, i & 0x0FF) for i in range_g(0x300)])
+        data.update(dict([(0x10400+i, 0x55) for i in range_g(40)]))
+        data['start_addr'] = {'EIP': 0x12345678}
+        ih = intelhex.IntelHex(data)
+        ihs = intelhex.IntelHexSegments(data)
+        for byte_count in (1, 13, 16, 255):
+            sio = StringIO()
+            ih.write_hex_file(sio, byte_count=byte_count)
+            s = sio.getvalue()
+            self.assertEqual(data, intelhex.IntelHex(StringIO(s)).todict())
+            sio = StringIO()
+            ihs.write_hex_file(sio, byte_count=byte_count)
+            self.assertEqualWrittenData(s, sio.getvalue())
+        # with 255 bytes per record, the last byte of the first page has a
+        # record of its own
+        self.assertTrue(':01FFFF00FF02\n:020000040001F9\n' in s)
+        # to a file name, without translating the line endings
+        fd, name = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            ihs.write_hex_file(name, eolstyle='CRLF')
+            f = open(name, 'rb')
+            try:
+                s = f.read()
+            finally:
+                f.close()
+            sio = StringIO()
+            ih.write_hex_file(sio)
+            self.assertEqual(asbytes(sio.getvalue().replace('\n', '\r\n')), s)
+        finally:
+            os.remove(name)
+
+    def test_tobinfile(self):
+        data = {0:1, 1:2, 5:3, 6:4, 0x20:5}
+        ih = intelhex.IntelHex(data)
+        ihs = intelhex.IntelHexSegments(data)
+        for start, end in ((None, None), (2, None), (None, 5), (3, 0x30)):
+            self.assertEqual(ih.tobinarray(start=start, end=end),
+                             ihs.tobinarray(start=start, end=end))
+            sio = BytesIO()
+            ih.tobinfile(sio, start=start, end=end)
+            sio2 = BytesIO()
+            ihs.tobinfile(sio2, start=start, end=end)
+            self.assertEqual(sio.getvalue(), sio2.getvalue())
+        self.assertEqual(asbytes('\x01\x02\xFF\xFF'), ihs.tobinview(size=4))
+        # segments can still grow after writing from them
+        ihs[2] = 9
+        self.assertEqual([(0,3), (5,7), (0x20,0x21)], ihs.segments())
+
+    def test_loadbin_mmap(self):
+        fd, name = tempfile.mkstemp()
+        os.write(fd, asbytes('\x01\x02\x03\x04\x05'))
+        os.close(fd)
+        try:
+            ih = intelhex.IntelHexSegments()
+            ih.loadbin(name, offset=0x10, use_mmap=True)
+            self.assertEqual({0x10:1, 0x11:2, 0x12:3, 0x13:4, 0x14:5},
+                             ih.todict())
+            # a range in the file is a view of it, rather than a copy
+            view = ih.tobinview(start=0x11, size=3)
+            self.assertTrue(view.readonly)
+            self.assertEqual(asbytes('\x02\x03\x04'), view)
+            ih2 = intelhex.IntelHexSegments(ih)
+            # changing the data copies it
+            ih[0x12] = 0x33
+            ih[0x15] = 6
+            self.assertEqual(asbytes('\x01\x02\x33\x04\x05\x06'),
+                             ih.tobinstr())
+            self.assertEqual(asbytes('\x01\x02\x03\x04\x05'), ih2.tobinstr())
+            self.assertEqual(asbytes('\x02\x03\x04'), view)
+            del ih2[0x12]
+            self.assertEqual([(0x10,0x12), (0x13,0x15)], ih2.segments())
+            del view
+            # data that touches other data is copied too
+            ih.loadbin(name, offset=0x16, use_mmap=True)
+            self.assertEqual([(0x10,0x1B)], ih.segments())
+            ih.write_hex_file(StringIO())
+        finally:
+            os.remove(name)
+        # file objects that can't be mapped are read instead
+        ih = intelhex.IntelHexSegments()
+        ih.loadbin(BytesIO(asbytes('\x01\x02')), use_mmap=True)
+        self.assertEqual({0:1, 1:2}, ih.todict())
+
+    def test_merge(self):
+        ih1 = intelhex.IntelHexSegments({0:1, 1:2})
+        ih1.merge(intelhex.IntelHex({2:3}))
+        ih1.merge(intelhex.IntelHexSegments({1:5, 3:4}), overlap='replace')
+        self.assertEqual({0:1, 1:5, 2:3, 3:4}, ih1.todict())
+        self.assertEqual([(0,4)], ih1.segments())
+        self.assertRaises(AddressOverlapError, ih1.merge,
+                          intelhex.IntelHexSegments({3:0}))
+
+
+class TestLoadHexRuns(TestIntelHexBase):
+    """Test that runs of data records decoded together give the same
+    data and errors as decoding them one at a time"""
+
+    def setUp(self):
+        self.data = [i & 0x0FF for i in range_g(64*16)]
+        self.records = [Record.data(0x100+i*16, self.data[i*16:i*16+16])
+                        for i in range_g(64)]
+
+    def load(self, records):
+        for cls in (intelhex.IntelHex, intelhex.IntelHexSegments):
+            ih = cls()
+            ih.loadhex(StringIO('\n'.join(records + [Record.eof()])))
+            yield ih
+
+    def loadError(self, records, excClass, msg):
+        for cls in (intelhex.IntelHex, intelhex.IntelHexSegments):
+            ih = cls()
+            self.assertRaisesMsg(excClass, msg, ih.loadhex,
+                StringIO('\n'.join(records + [Record.eof()])))
+            yield ih
+
+    def test_contiguous(self):
+        for ih in self.load(self.records):
+            self.assertEqual(self.data, list(ih.tobinarray()))
+            self.assertEqual(0x100, ih.minaddr())
+        # with a gap and a short record in the middle
+        records = self.records[:10] + [Record.data(0x600, [1, 2, 3])] + \
+                  self.records[20:]
+        for ih in self.load(records):
+            self.assertEqual([(0x100, 0x1A0), (0x240, 0x500), (0x600, 0x603)],
+                             ih.segments())
+            self.assertEqual(self.data[:160] + self.data[320:] + [1, 2, 3],
+                             [ih[a] for a in ih.addresses()])
+
+    def test_bad_checksum(self):
+        records = self.records[:]
+        records[40] = records[40][:-2] + '00'
+        for ih in self.loadError(records, RecordChecksumError,
+                                 'Record at line 41 has invalid checksum'):
+            # the records before the bad one are still loaded
+            self.assertEqual(self.data[:40*16], list(ih.tobinarray()))
+
+    def test_bad_length(self):
+        records = self.records[:]
+        records[63] = records[63][:-4] + records[63][-2:]
+        for ih in self.loadError(records, RecordLengthError,
+                                 'Record at line 64 has invalid length'):
+            self.assertEqual(self.data[:63*16], list(ih.tobinarray()))
+
+    def test_overlap(self):
+        records = self.records[:]
+        records[30] = self.records[2]
+        for ih in self.loadError(records, AddressOverlapError,
+                'Hex file has data overlap at address 0x120 on line 31'):
+            self.assertEqual(self.data[:30*16], list(ih.tobinarray()))
+
+
 ##
 # MAIN
 if __name__ == '__main__':
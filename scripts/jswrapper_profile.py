@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Reports on how built-in symbols were looked up, using the files written by a Linux
+# build made with JSWRAPPER_COUNT_COMPARISONS=1. Eg:
+#
+#   make clean;BOARD=LINUX JSWRAPPER_COUNT_COMPARISONS=1 make
+#   JSWRAPPER_PROFILE=profile.txt ./espruino benchmark/donut.js
+#   scripts/jswrapper_profile.py profile.txt
+#
+# USAGE: jswrapper_profile.py [-nTABLES] profile.txt [profile.txt ...]
+#
+# Counts from several files (eg. from different benchmarks) are added together
+# ----------------------------------------------------------------------------------------
+
+import sys;
+
+# Only suggest a perfect hash for tables that do at least this many compares per search,
+# and that account for at least this fraction of all symbol compares
+MIN_COMPARES_PER_SEARCH = 3
+MIN_COMPARES_FRACTION = 0.02
+
+def readProfile(filename, lookups, tables, symbols):
+  for line in open(filename).read().splitlines():
+    fields = line.split()
+    if not fields: continue
+    if fields[0]=="lookups":
+      for i in range(3):
+        lookups[i] += int(fields[1+i])
+    elif fields[0]=="table":
+      name = fields[1]
+      if not name in tables:
+        tables[name] = { "name" : name, "symbols" : int(fields[2]), "searches" : 0, "hits" : 0, "compares" : 0 }
+      tables[name]["searches"] += int(fields[3])
+      tables[name]["hits"] += int(fields[4])
+      tables[name]["compares"] += int(fields[5])
+    elif fields[0]=="symbol":
+      name = fields[1]+"."+fields[2]
+      symbols[name] = symbols.get(name, 0) + int(fields[3])
+    else:
+      print("WARNING: Unknown line in "+filename+": "+line)
+
+def percent(a, b):
+  return "%5.1f%%" % (100.0*a/b if b else 0)
+
+if __name__ == "__main__":
+  maxTables = 20
+  filenames = []
+  for arg in sys.argv[1:]:
+    if arg.startswith("-n"): maxTables = int(arg[2:])
+    else: filenames.append(arg)
+  if not filenames:
+    print("USAGE: jswrapper_profile.py [-nTABLES] profile.txt [profile.txt ...]")
+    exit(1)
+
+  lookups = [0, 0, 0] # lookups, misses, compares
+  tables = {}
+  symbols = {} # "table.symbol" -> hits
+  for filename in filenames:
+    readProfile(filename, lookups, tables, symbols)
+  lookupCount, missCount, compareCount = lookups
+  symbolCompares = sum([t["compares"] for t in tables.values()])
+  print("%d lookups, %d misses (%s), %d comparisons (%.2f per lookup)" % (lookupCount, missCount, percent(missCount, lookupCount).strip(), compareCount, float(compareCount)/max(lookupCount,1)))
+  print("%d comparisons finding the symbol table, %d string compares in symbol tables" % (compareCount-symbolCompares, symbolCompares))
+  print("")
+
+  used = sorted([t for t in tables.values() if t["searches"]], key=lambda t: -t["compares"])
+  print("Hottest symbol tables (by string compares):")
+  print("%-32s %7s %10s %7s %10s %7s %9s" % ("table", "symbols", "searches", "hits", "compares", "total", "/search"))
+  for t in used[:maxTables]:
+    print("%-32s %7d %10d %7s %10d %7s %9.2f" % (t["name"], t["symbols"], t["searches"], percent(t["hits"], t["searches"]),
+          t["compares"], percent(t["compares"], symbolCompares), float(t["compares"])/t["searches"]))
+  if len(used)>maxTables:
+    print("... and "+str(len(used)-maxTables)+" more")
+  print(str(len(tables)-len(used))+" of "+str(len(tables))+" tables were never searched")
+  print("")
+
+  if symbols:
+    hits = sum(symbols.values())
+    print("Most used symbols:")
+    for name in sorted(symbols.keys(), key=lambda n: (-symbols[n], n))[:maxTables]:
+      print("%-40s %10d %7s" % (name, symbols[name], percent(symbols[name], hits)))
+    print("")
+
+  # A perfect hash (SYMBOL_HASH) makes every search one string compare, so it helps most
+  # on tables that are searched a lot and take several compares each time
+  suggested = [t for t in used if float(t["compares"])/t["searches"]>=MIN_COMPARES_PER_SEARCH and
+                                  float(t["compares"])/max(symbolCompares,1)>=MIN_COMPARES_FRACTION]
+  if suggested:
+    saved = sum([t["compares"]-t["searches"] for t in suggested])
+    print("Suggest building these tables with perfect hashes, which would save about "+str(saved)+" of "+str(symbolCompares)+" string compares:")
+    print("  SYMBOL_HASH="+",".join([t["name"] for t in suggested]))
+  else:
+    print("No symbol tables would benefit much from a perfect hash")
+  print("Or build with SYMBOL_PROFILE=<profile file> to check the most used symbols in each table first")
+  missTables = [t for t in suggested+used[:maxTables] if t["searches"]-t["hits"] > t["hits"]]
+  if missTables:
+    names = []
+    for t in missTables:
+      if not t["name"] in names: names.append(t["name"])
+    print("Most searches of "+", ".join(names)+" are misses (eg. methods found further up the prototype chain)")
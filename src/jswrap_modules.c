@@ -106,13 +106,10 @@ JsVar *jswrap_require(JsVar *moduleName) {
   // Ok - it's not built-in as native or storage.
   // Look and see if it's compiled-in as a C-String of JS - if so get the actual text and execute it
   if (!moduleExport) {
-    const char *builtInJS = jswGetBuiltInJSLibrary(moduleNameBuf);
-    if (builtInJS) {
-      JsVar *fileContents = jsvNewNativeString((char*)builtInJS, strlen(builtInJS));       
-      if (fileContents) {
-        moduleExport = jspEvaluateModule(fileContents);
-        jsvUnLock(fileContents);
-      }
+    JsVar *fileContents = jswGetBuiltInJSLibrary(moduleNameBuf);
+    if (fileContents) {
+      moduleExport = jspEvaluateModule(fileContents);
+      jsvUnLock(fileContents);
     }
   }
 
@@ -130,8 +130,9 @@ bool jswOnCharEvent(IOEventFlags channel, char charData);
   pointer of the object's constructor */
 void *jswGetBuiltInLibrary(const char *name);
 
-/** If we have a built-in JS module with the given name, return the module's contents - or 0 */
-const char *jswGetBuiltInJSLibrary(const char *name);
+/** If we have a built-in JS module with the given name, return a String of the module's contents - or 0.
+ * Modules may be stored compressed (see build_jswrapper.py --compress-modules) */
+JsVar *jswGetBuiltInJSLibrary(const char *name);
 
 /** Return a comma-separated list of built-in libraries */
 const char *jswGetBuiltInLibraryNames();